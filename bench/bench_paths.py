@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Compares the time needed to match a large change against many path-filtered jobs, using
+`is_dir_in_change()`, a `PathMatcher` for each job and a single `PathIndex` for all of them.
+
+Run it from the root of the repository with:
+
+    python bench/bench_paths.py [files] [jobs]
+
+"""
+
+import random
+import sys
+import time
+
+from positronic.brain.paths import PathIndex, PathMatcher
+from positronic.brain.utils import is_dir_in_change
+
+
+class Change(object):
+
+    def __init__(self, files):
+        self.files = files
+
+
+def random_path(rnd, depth):
+    return '/'.join('dir%d' % rnd.randint(0, 20) for _ in range(depth))
+
+
+def main(files, jobs):
+    rnd = random.Random(0)
+
+    # A large commit, touching files none of the jobs are interested in: the worst case, since
+    # there is no early exit.
+    change = Change(['other/%s/file%d.c' % (random_path(rnd, rnd.randint(1, 6)), i)
+                     for i in range(files)])
+    job_paths = [[random_path(rnd, rnd.randint(1, 3)) for _ in range(3)] for _ in range(jobs)]
+
+    start = time.time()
+    old = [is_dir_in_change(paths, change) for paths in job_paths]
+    old_time = time.time() - start
+
+    start = time.time()
+    matchers = [PathMatcher(paths) for paths in job_paths]
+    compile_time = time.time() - start
+
+    start = time.time()
+    new = [m(change) for m in matchers]
+    new_time = time.time() - start
+
+    index = PathIndex()
+
+    for i, paths in enumerate(job_paths):
+        index.add(paths, i)
+
+    start = time.time()
+    routed = index.lookup(change.files)
+    index_time = time.time() - start
+
+    assert old == new
+    assert routed == set(i for i, matched in enumerate(new) if matched)
+
+    print '%d files, %d jobs' % (files, jobs)
+    print 'is_dir_in_change: %8.3f s' % old_time
+    print 'PathMatcher:      %8.3f s (plus %.3f s to compile, once)' % (new_time, compile_time)
+    print 'PathIndex:        %8.3f s' % index_time
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200)
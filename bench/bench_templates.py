@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the time needed to render notification emails.
+
+Run it from the root of the repository with:
+
+    python bench/bench_templates.py [iterations]
+
+It prints the time per email of the first rendering in a fresh master, with and without the
+bytecode cache, and of later renderings, served by the in-memory cache of compiled templates.
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+from mock import MagicMock
+
+from buildbot.status.builder import FAILURE
+
+import positronic.brain.mail
+from positronic.brain.mail import html_message_formatter
+from positronic.brain.templating import TEMPLATES_CACHE_SIZE
+
+
+def fresh_env(bytecode_cache=None):
+    return Environment(loader=PackageLoader('positronic.brain', 'templates'),
+                       cache_size=TEMPLATES_CACHE_SIZE,
+                       auto_reload=False,
+                       bytecode_cache=bytecode_cache)
+
+
+def mock_build():
+    log = MagicMock()
+    log.isFinished.return_value = False
+    log.getChunks.return_value = ['line %d\n' % i for i in range(250)]
+    log.step.results = FAILURE
+
+    build = MagicMock()
+    build.getLogs.return_value = [log]
+    build.getReason.return_value = 'benchmark'
+    build.getSlavename.return_value = 'worker'
+    build.getSourceStamps.return_value = []
+
+    return build
+
+
+def render(env, build, status):
+    positronic.brain.mail.TEMPLATES_ENV = env
+    html_message_formatter(None, 'bench', build, FAILURE, status)
+
+
+def first_render(iterations, make_env, build, status):
+    start = time.time()
+
+    for _ in range(iterations):
+        render(make_env(), build, status)
+
+    return (time.time() - start) / iterations
+
+
+def main(iterations):
+    build = mock_build()
+    status = MagicMock()
+    status.getURLForThing.return_value = 'http://localhost:8010/builders/bench/builds/1'
+    cache_dir = tempfile.mkdtemp()
+
+    try:
+        cache = FileSystemBytecodeCache(cache_dir)
+        render(fresh_env(cache), build, status)
+
+        cold = first_render(iterations, fresh_env, build, status)
+        bytecode = first_render(iterations, lambda: fresh_env(cache), build, status)
+
+        env = fresh_env()
+        render(env, build, status)
+        warm = first_render(iterations, lambda: env, build, status)
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print 'first email, compiling templates:    %8.3f ms' % (cold * 1000)
+    print 'first email, with bytecode cache:    %8.3f ms' % (bytecode * 1000)
+    print 'next emails, with compiled template: %8.3f ms' % (warm * 1000)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
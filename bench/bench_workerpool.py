@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the time needed to generate the configuration of a large WorkerPoolJob, with explicit
+forwarding of configuration methods and with the old `__getattribute__` forwarding.
+
+Run it from the root of the repository with:
+
+    python bench/bench_workerpool.py [pools] [steps]
+
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+from positronic.brain import BuildmasterConfig, WorkerPoolJob, master
+
+
+class LegacyWorkerPoolJob(WorkerPoolJob):
+    """Forwards methods with the `__getattribute__` WorkerPoolJob used to have."""
+
+    def __getattribute__(self, name):
+        if hasattr(self, name):
+            return super(LegacyWorkerPoolJob, self).__getattribute__(name)
+        else:
+            def wrapper(*args, **kwargs):
+                for j in self.pool.values():
+                    getattr(j, name)(*args, **kwargs)
+
+            return wrapper
+
+
+def generate(cls, pools, steps):
+    for key in ('builders', 'schedulers', 'change_source'):
+        del BuildmasterConfig[key][:]
+
+    start = time.time()
+
+    with cls('bench-%s' % cls.__name__, pools) as job:
+        job.checkout('src', 'svn://svn.example.com/project', 'trunk')
+
+        for i in xrange(steps):
+            job.command('make', 'step%d' % i)
+
+        job.notify('dev@example.com')
+
+    return time.time() - start
+
+
+def main(pools, steps):
+    basedir = tempfile.mkdtemp()
+
+    try:
+        master(basedir=basedir, url='http://buildbot.example.com/')
+
+        worker_pools = dict(('pool%d' % i, ['worker%d' % i]) for i in xrange(pools))
+
+        new_time = generate(WorkerPoolJob, worker_pools, steps)
+        old_time = generate(LegacyWorkerPoolJob, worker_pools, steps)
+    finally:
+        shutil.rmtree(basedir)
+
+    print '%d pools, %d steps' % (pools, steps)
+    print '__getattribute__:    %8.3f s' % old_time
+    print 'explicit forwarding: %8.3f s' % new_time
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100)
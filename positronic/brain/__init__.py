@@ -32,9 +32,10 @@ from positronic.brain.monkeypatch import patch_all
 patch_all()
 
 # Continue with standard bootstrap.
-from positronic.brain.base import change_source, master, worker
+from positronic.brain.base import admins_digest, artifacts, change_source, master, smtp, worker
 from positronic.brain.config import BrainConfig, BuildmasterConfig
 from positronic.brain.job.freestyle import FreestyleJob
+from positronic.brain.job.matrix import MatrixJob
 from positronic.brain.job.workerpool import WorkerPoolJob
 
 
@@ -42,8 +43,12 @@ __all__ = [
     'BrainConfig',
     'BuildmasterConfig',
     'FreestyleJob',
+    'MatrixJob',
     'WorkerPoolJob',
+    'admins_digest',
+    'artifacts',
     'change_source',
     'master',
+    'smtp',
     'worker',
 ]
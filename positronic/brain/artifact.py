@@ -21,9 +21,7 @@ This module contains all functions needed to deal with artifacts such as adding
 necessary to host them on worker nodes and then transferring them back to the master.
 """
 
-from os import listdir
-from os.path import isdir, join
-from shutil import rmtree
+from os.path import join
 
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.buildstep import SUCCESS
@@ -31,10 +29,13 @@ from buildbot.process.properties import Interpolate
 from buildbot.steps.master import SetProperty
 from buildbot.steps.slave import MakeDirectory
 from buildbot.steps.slave import RemoveDirectory
-from buildbot.steps.transfer import DirectoryUpload
 
 from positronic.brain.config import BuildmasterConfig
 from positronic.brain.config import BrainConfig
+from positronic.brain.durations import RecordDurations
+from positronic.brain.janitor import JANITOR
+from positronic.brain.retention import get_retention_engine
+from positronic.brain.transfer import ArtifactUpload
 
 
 class PruneOldArtifacts(BuildStep):
@@ -44,43 +45,14 @@ class PruneOldArtifacts(BuildStep):
         super(PruneOldArtifacts, self).__init__(**kwargs)
 
     def start(self):
-        root = BrainConfig['artifactsDir']
-        max_artifacts = BrainConfig['maxArtifacts']
-        artifacts = Interpolate(join(root, '%(prop:buildername)s')).getRenderingFor(self).result
+        engine = get_retention_engine()
+        engine.record_result(self.getProperty('buildername'), self.getProperty('buildnumber'),
+                             self.build.result)
 
-        remove_obsolete_artifact_dirs(artifacts, max_artifacts)
-
-        self.finished(SUCCESS)
-
-
-def remove_obsolete_artifact_dirs(root, max_artifacts):
-    """Remove obsolete artifacts from the given root directory.
-
-    This function asserts that the root directory does not contain files and that all directory
-    names can be converted to integers in strictly increasing order. Each directory name should
-    correspond to a build number for that particular builder.
-
-    This function also removes empty artifacts directories.
-    """
-    assert max_artifacts > 0
-
-    # This ensures we only get files or directories with names that can be converted to an integer,
-    # we also first sort it in increasing order. Strictly increasing order should be guaranteed by
-    # fs semantics: you can't have two directories with the same name!
-    dirs = map(str, sorted(map(int, listdir(root))))
-    paths = [join(root, d) for d in dirs]
-
-    # We only want directories.
-    for p in paths:
-        assert isdir(p)
-
-    paths_to_remove = paths[:-max_artifacts]
-
-    for p in paths:
-        if not listdir(p):
-            rmtree(p)
-        elif p in paths_to_remove:
-            rmtree(p)
+        # Removing artifacts may take a long time, so we let the janitor do it in the background.
+        d = JANITOR.submit(engine.root, engine.run)
+        d.addCallback(lambda _: self.finished(SUCCESS))
+        d.addErrback(self.failed)
 
 
 def add_artifact_pre_build_steps(job):
@@ -101,12 +73,24 @@ def add_artifact_pre_build_steps(job):
 
 
 def add_artifact_post_build_steps(job):
-    job.add_step(DirectoryUpload(
-        name='collect artifacts',
+    upload = BrainConfig['artifactsUpload']
+
+    job.add_step(ArtifactUpload(
         slavesrc=Interpolate('%(prop:artifactsdir)s'),
         masterdest=Interpolate(
             join(BrainConfig['artifactsDir'], '%(prop:buildername)s', '%(prop:buildnumber)s')),
         url=Interpolate(BuildmasterConfig[
-                            'buildbotURL'] + 'artifacts/%(prop:buildername)s/%(prop:buildnumber)s/')))
+                            'buildbotURL'] + 'artifacts/%(prop:buildername)s/%(prop:buildnumber)s/'),
+        compress=upload['compress'],
+        blocksize=upload['blocksize'],
+        skip_unchanged=upload['skip_unchanged'] or job.delta_artifacts,
+        compare='hash' if job.delta_artifacts else upload['compare']))
 
+    job.add_step(RecordDurations(hideStepIf=True))
     job.add_step(PruneOldArtifacts())
+
+
+def has_reached_artifact_upload(build):
+    """Returns whether a running build is uploading its artifacts, or has already uploaded them."""
+    return (isinstance(build.currentStep, ArtifactUpload) or
+            not any(isinstance(step, ArtifactUpload) for step in build.steps))
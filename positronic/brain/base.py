@@ -24,14 +24,20 @@ import os
 import os.path
 
 import jinja2
+from buildbot import config
 from buildbot.buildslave import BuildSlave
 from buildbot.changes.pb import PBChangeSource
 from buildbot.status.html import WebStatus
-from buildbot.status.mail import MailNotifier
 from buildbot.status.web.authz import Authz
 
+from positronic.brain.capacity import RESOURCES_PROPERTY
 from positronic.brain.config import BrainConfig, BuildmasterConfig
+from positronic.brain.durations import get_duration_store, prioritize_builders
 from positronic.brain.mail import html_message_formatter
+from positronic.brain.notifier import MailDigest, RoutedMailNotifier
+from positronic.brain.retention import RetentionPolicy
+from positronic.brain.scheduler import ChangeRouter
+from positronic.brain.templating import setup_templates
 from positronic.brain.utils import get_default_email_address
 
 
@@ -65,6 +71,24 @@ def master(basedir, url, admins=[], email_from=None, title='BuildBot', listen_po
     BrainConfig['emailLookup'] = BrainConfig['emailFrom'].split('@')[-1]
     BrainConfig['maxArtifacts'] = 5
     BrainConfig['artifactsDir'] = os.path.join(basedir, 'public_html', 'artifacts')
+    BrainConfig['artifactRetention'] = RetentionPolicy(max_artifacts=BrainConfig['maxArtifacts'])
+    BrainConfig['artifactsDedup'] = False
+    BrainConfig['artifactsUpload'] = {
+        'blocksize': 256 * 1024,
+        'compress': None,
+        'skip_unchanged': False,
+        'compare': 'mtime',
+    }
+    BrainConfig['smtp'] = {
+        'relayhost': 'localhost',
+        'port': 25,
+    }
+
+    # Compiled templates are cached on disk, so that they are not compiled again at each restart.
+    setup_templates(basedir)
+
+    # Past durations are read here, so that looking them up never waits for the disk later.
+    get_duration_store()
 
     # Site definition
     # See: http://docs.buildbot.net/current/manual/cfg-global.html#site-definitions
@@ -80,6 +104,9 @@ def master(basedir, url, admins=[], email_from=None, title='BuildBot', listen_po
     BuildmasterConfig['eventHorizon'] = 50  # Connection/Disconnection to slaves to keep.
     BuildmasterConfig['logHorizon'] = 50  # How many build logs to keep. Must be <= buildHorizon.
 
+    # Workers go to the builders with the longest builds first, according to past builds.
+    BuildmasterConfig['prioritizeBuilders'] = prioritize_builders
+
     # Caches
     # See: http://docs.buildbot.net/current/manual/cfg-global.html#caches
     BuildmasterConfig['caches'] = {
@@ -103,36 +130,186 @@ def master(basedir, url, admins=[], email_from=None, title='BuildBot', listen_po
                 'base': True,
                 'bitbucket': True,
                 'github': True,
+                'svn': True,
             },
             jinja_loaders=[
                 jinja2.PackageLoader('positronic.brain.status.web', 'templates'),
             ])
     ]
 
+    # A single scheduler starts builds for incoming changes. Jobs register their interests in it
+    # with `watch()` and `watch_paths()`.
+    BrainConfig['changeRouter'] = ChangeRouter(name='change-router', treeStableTimer=60)
+    BuildmasterConfig['schedulers'].append(BrainConfig['changeRouter'])
+
+    # A single notifier sends all emails. Jobs add their recipients to it with `notify()`.
+    BrainConfig['notifier'] = RoutedMailNotifier(
+        fromaddr=BrainConfig['emailFrom'],
+        messageFormatter=html_message_formatter)
+    BuildmasterConfig['status'].append(BrainConfig['notifier'])
+
     # These people receive emails for EVERYTHING that happens within this BuildBot.
+    BrainConfig['adminsRoute'] = None
+
     if admins:
-        BuildmasterConfig['status'].append(MailNotifier(
-            extraRecipients=admins,
-            fromaddr=BrainConfig['emailFrom'],
-            messageFormatter=html_message_formatter,
-            mode='all',
-            sendToInterestedUsers=False))
+        BrainConfig['adminsRoute'] = BrainConfig['notifier'].add_route(admins, mode='all')
+
+
+def artifacts(max_artifacts=5, max_bytes=None, max_builder_bytes=None, max_age=None,
+              keep_last_successful=True, evict='oldest', dedup=False, compress=None,
+              blocksize=256 * 1024, skip_unchanged=False, compare='mtime'):
+    """Configures how artifacts are transferred to and retained on the master.
+
+    By default the master keeps the artifacts of the last 5 builds of each builder. Call this
+    function after `master()` and before defining any job to change that. All limits are enforced
+    after each build; those set to None are disabled.
+
+    Arguments:
+
+    - max_artifacts: The maximum number of builds to keep for each builder.
+    - max_bytes: The maximum size in bytes of all artifacts stored on the master. Files hard linked
+      by several builds, such as unchanged files of delta uploads, are counted once.
+    - max_builder_bytes: The maximum size in bytes of the artifacts of a single builder.
+    - max_age: The maximum age of artifacts, in seconds.
+    - keep_last_successful: Never remove the artifacts of the last successful build of a builder,
+      regardless of the limits above.
+    - evict: Which builds to remove first when over a size limit: 'oldest' or 'lru' (least recently
+      accessed).
+    - dedup: Store identical files only once, by hard linking them to a content-addressed pool in
+      the `.blobs` directory of the artifacts directory. Size limits then count identical files
+      once.
+    - compress: How to compress artifacts while transferring them from workers: None, 'gz' or 'bz2'.
+    - blocksize: The size in bytes of each chunk of data sent by workers. Each chunk costs a round
+      trip, so larger blocks are faster on high latency links.
+    - skip_unchanged: Do not transfer files which are identical to those of the previous build.
+      This needs a Python interpreter on workers (see `worker()`), and costs an extra round trip
+      to list files before each upload, so it only pays off when many files are skipped.
+    - compare: How to tell that a file is unchanged, with skip_unchanged. With 'mtime' files must
+      have the same size and modification time, which is cheap but only matches files copied with
+      their modification time preserved: the artifacts directory is emptied before each build, so
+      files generated again always look changed. With 'hash' files must have the same SHA-1
+      digest, which costs reading all files on the worker but also matches regenerated files.
+
+    Example:
+
+        artifacts(max_artifacts=10, max_bytes=200 * 1024 ** 3, max_age=30 * 24 * 3600)
+
+    """
+    BrainConfig['maxArtifacts'] = max_artifacts
+    BrainConfig['artifactsDedup'] = dedup
+    BrainConfig['artifactsUpload'] = {
+        'blocksize': blocksize,
+        'compress': compress,
+        'skip_unchanged': skip_unchanged,
+        'compare': compare,
+    }
+    BrainConfig['artifactRetention'] = RetentionPolicy(
+        max_artifacts=max_artifacts,
+        max_bytes=max_bytes,
+        max_builder_bytes=max_builder_bytes,
+        max_age=max_age,
+        keep_last_successful=keep_last_successful,
+        evict=evict)
+
+
+def smtp(relayhost='localhost', port=25, use_tls=False, user=None, password=None,
+         max_connections=2, max_queue=1000, max_retries=3, backoff=5):
+    """Configures how emails are delivered.
+
+    Emails are rendered and sent in background threads. By default they are delivered through the
+    SMTP server listening on port 25 of the master.
+
+    Arguments:
+
+    - relayhost: The SMTP server used to send emails.
+    - port: The port of the SMTP server.
+    - use_tls: Whether to use STARTTLS to encrypt the connection with the SMTP server.
+    - user: The user name used to authenticate with the SMTP server, if any.
+    - password: The password used to authenticate with the SMTP server.
+    - max_connections: The maximum number of connections to the SMTP server. They are kept open
+      and reused for later emails.
+    - max_queue: The maximum number of emails waiting to be sent. Further emails are dropped.
+    - max_retries: How many times sending an email is retried before giving up.
+    - backoff: The time in seconds before the first retry. It doubles at each further retry.
+
+    Example:
+
+        smtp(relayhost='smtp.example.com', port=587, use_tls=True, user='buildbot', password='pw')
+
+    """
+    BrainConfig['smtp'] = {
+        'relayhost': relayhost,
+        'port': port,
+        'use_tls': use_tls,
+        'user': user,
+        'password': password,
+        'max_connections': max_connections,
+        'max_queue': max_queue,
+        'max_retries': max_retries,
+        'backoff': backoff,
+    }
 
 
-def worker(name, password):
+def admins_digest(interval=3600, max_builds=100, immediate_failures=True):
+    """Sends administrators periodic summaries instead of an email for each build.
+
+    Call this function after `master()`.
+
+    Arguments:
+
+    - interval: The maximum time in seconds between the end of a build and the summary reporting
+      it.
+    - max_builds: The maximum number of builds in a summary. When reached, the summary is sent
+      right away.
+    - immediate_failures: Also send the usual email for each failed build, as soon as it finishes.
+
+    Example:
+
+        admins_digest(interval=6 * 3600, immediate_failures=False)
+
+    """
+    if BrainConfig['adminsRoute'] is None:
+        config.error('admins_digest() needs some admins, see master()')
+        return
+
+    BrainConfig['adminsRoute'].digest = MailDigest(
+        interval=interval,
+        max_builds=max_builds,
+        immediate_failures=immediate_failures)
+
+
+def worker(name, password, python='python', slots=1, resources=None):
     """Adds a new worker node.
 
-    All worker nodes are configured to run at most one build at a time.
+    By default worker nodes run at most one build at a time. Larger nodes can be given more slots
+    and, to avoid overcommitting them, the amount of each resource they have: builds of jobs
+    requiring some resources (see `FreestyleJob.requires()`) only start on a node when enough of
+    them are free.
 
     Arguments:
     - name: The name of the worker node, shown in the web interface.
     - password: Password used by the agent installed on worker nodes to authenticate with the
       master.
+    - python: The Python interpreter used to run helper scripts on the worker node.
+    - slots: The maximum number of builds running at the same time on the worker node.
+    - resources: A dictionary mapping resource names to the amount the worker node has, such as
+      {'cpu': 64, 'memory': 256, 'disk_heavy': 1}. Resources not listed are not limited.
 
     """
+    if slots < 1:
+        config.error('worker() needs at least one slot, got %r' % slots)
+
+    for resource, amount in (resources or {}).iteritems():
+        if amount < 0:
+            config.error('worker() got a negative amount of %s: %r' % (resource, amount))
+
     # In general, our slaves assume that they have full control of the machine they are running on,
-    # thus, we force at most one job running on each node at a time.
-    BuildmasterConfig['slaves'].append(BuildSlave(name, password, max_builds=1))
+    # thus, unless told otherwise, we force at most one job running on each node at a time.
+    BuildmasterConfig['slaves'].append(BuildSlave(
+        name, password, max_builds=slots, properties={
+            'worker_python': python,
+            RESOURCES_PROPERTY: dict(resources or {}),
+        }))
 
 
 def change_source(name, password):
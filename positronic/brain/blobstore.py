@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains a content-addressed store for artifacts, which allows identical files uploaded
+by different builds to share the same disk space.
+"""
+
+import errno
+import hashlib
+import os
+from os.path import exists, isdir, islink, join
+
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class BlobStore(object):
+    """A pool of files keyed by the hash of their content.
+
+    Files ingested in the store are replaced by hard links to a single copy in the pool, so that
+    identical files cost their size on disk only once. Reference counting is left to the file
+    system: a blob whose link count drops to one is only referenced by the pool and can be freed.
+
+    The pool MUST be on the same file system as the directories whose files are ingested. Files
+    which cannot be hard linked (e.g. because the file system doesn't support it) are left alone.
+
+    Arguments:
+
+    - root: The directory containing the pool.
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return join(self.root, digest[:2], digest)
+
+    def ingest(self, directory):
+        """Moves all regular files in the given directory tree into the pool.
+
+        Returns the list of digests of the files which are now linked to the pool and their total
+        size in bytes.
+        """
+        digests = []
+        linked_size = 0
+
+        for dirpath, _, filenames in os.walk(directory):
+            for f in filenames:
+                p = join(dirpath, f)
+
+                if islink(p):
+                    continue
+
+                digest = file_digest(p)
+
+                if self._link(p, digest):
+                    digests.append(digest)
+                    linked_size += os.path.getsize(p)
+
+        return digests, linked_size
+
+    def release(self, digests):
+        """Frees all blobs in the given list which are no longer linked from outside the pool.
+
+        This should be called after the files linked to these blobs have been removed. Returns the
+        number of bytes freed.
+        """
+        bytes_freed = 0
+
+        for digest in set(digests):
+            p = self.path(digest)
+
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+
+            if st.st_nlink == 1:
+                os.remove(p)
+                bytes_freed += st.st_size
+
+        return bytes_freed
+
+    def _link(self, p, digest):
+        blob = self.path(digest)
+
+        try:
+            if not exists(blob):
+                if not isdir(os.path.dirname(blob)):
+                    os.makedirs(os.path.dirname(blob))
+
+                os.link(p, blob)
+            elif not os.path.samefile(p, blob):
+                # Link to a temporary name and rename, so that the file is replaced atomically.
+                tmp = p + '.blob'
+                os.link(blob, tmp)
+                os.rename(tmp, p)
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP):
+                return False
+
+            raise
+
+        return True
+
+
+def file_digest(p):
+    """Returns the SHA-1 hex digest of the content of the given file."""
+    h = hashlib.sha1()
+
+    with open(p, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            h.update(block)
+
+    return h.hexdigest()
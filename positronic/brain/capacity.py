@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module decides whether a worker has enough free resources to start a build.
+
+Workers declare the amount of each resource they have (see `positronic.brain.base.worker()`), and
+jobs declare how much of them their builds need (see `FreestyleJob.requires()`). A build starts on
+a worker only if its needs, added to those of the builds already running there, don't exceed what
+the worker has. Resources are arbitrary names, such as 'cpu', 'memory' or 'disk_heavy'.
+"""
+
+from buildbot import util
+
+# The worker property holding the resources of a worker.
+RESOURCES_PROPERTY = 'worker_resources'
+
+
+class ResourceDemand(util.ComparableMixin):
+    """The resources needed by each build of a builder, used as its `canStartBuild` function.
+
+    Resources not declared by a worker are not limited on that worker.
+
+    Arguments:
+
+    - demands: A dictionary mapping resource names to the amount needed.
+
+    """
+
+    compare_attrs = ['demands']
+
+    def __init__(self, demands):
+        self.demands = dict(demands)
+
+    def __call__(self, builder, slavebuilder, breq):
+        slave = slavebuilder.slave
+        available = slave.properties.getProperty(RESOURCES_PROPERTY, {})
+        in_use = resources_in_use(slave)
+
+        return all(in_use.get(name, 0) + amount <= available[name]
+                   for name, amount in self.demands.iteritems() if name in available)
+
+
+def resources_in_use(slave):
+    """Returns the amount of each resource used by the builds running on a worker."""
+    in_use = {}
+
+    for slavebuilder in slave.slavebuilders.values():
+        demand = getattr(slavebuilder.builder.config, 'canStartBuild', None)
+
+        if not slavebuilder.isBusy() or not isinstance(demand, ResourceDemand):
+            continue
+
+        for name, amount in demand.demands.iteritems():
+            in_use[name] = in_use.get(name, 0) + amount
+
+    return in_use
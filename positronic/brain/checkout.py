@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the build steps checking out sources with the strategies supported by
+`FreestyleJob.checkout()` and `FreestyleJob.checkout_git()`.
+
+All of them add the time they took to the 'checkout_duration' build property (seconds), so that
+strategies can be compared.
+"""
+
+import os.path
+import time
+
+from buildbot import config
+from buildbot.process.buildstep import BuildStep, BuildStepFailed, RemoteShellCommand
+from buildbot.status.results import SUCCESS
+from buildbot.steps.source.git import Git
+from buildbot.steps.source.svn import SVN
+
+from positronic.brain.transfer import WORKER_BOOTSTRAP, worker_script
+
+# How SVN sources are checked out: (mode, method) of the SVN step, or None for the shared cache.
+SVN_STRATEGIES = {
+    'clean': ('full', 'clean'),
+    'incremental': ('incremental', None),
+    'export': ('full', 'export'),
+    'shared': None,
+}
+
+# How git sources are checked out: (mode, method, shallow) of the Git step.
+GIT_STRATEGIES = {
+    'clean': ('full', 'clean', False),
+    'incremental': ('incremental', None, False),
+    'shallow': ('full', 'clobber', True),
+}
+
+# How files are copied from the shared cache.
+LINK_METHODS = ('copy', 'hardlink')
+
+# Where workers keep the shared cache, relative to the build directory: it's shared by all builders
+# of the same worker, since their build directories are siblings.
+SHARED_CACHE = os.path.join('..', 'checkout-cache')
+
+
+class TimedCheckoutMixin(object):
+    """Adds the duration of a step to the 'checkout_duration' build property."""
+
+    def startStep(self, remote):
+        self.checkout_started = time.time()
+
+        return super(TimedCheckoutMixin, self).startStep(remote)
+
+    def finished(self, results):
+        elapsed = time.time() - self.checkout_started
+        total = self.getProperty('checkout_duration', 0) + elapsed
+        self.setProperty('checkout_duration', round(total, 3), 'Checkout')
+
+        return super(TimedCheckoutMixin, self).finished(results)
+
+
+class TimedSVN(TimedCheckoutMixin, SVN):
+    pass
+
+
+class TimedGit(TimedCheckoutMixin, Git):
+    pass
+
+
+class WorkerScriptStep(BuildStep):
+    """A build step running a function of the worker-side checkout script."""
+
+    haltOnFailure = True
+    flunkOnFailure = True
+
+    def __init__(self, workdir, **kwargs):
+        BuildStep.__init__(self, **kwargs)
+
+        self.workdir = workdir
+        self.cmd = None
+
+    def arguments(self):
+        """Returns the name of the function to run and its arguments."""
+        raise NotImplementedError
+
+    def start(self):
+        function, args = self.arguments()
+
+        self.cmd = RemoteShellCommand(
+            workdir=self.workdir,
+            command=[self.getProperty('worker_python', 'python'), '-c', WORKER_BOOTSTRAP],
+            initialStdin=worker_script('checkout.py', function, *args),
+            logEnviron=False)
+        self.cmd.useLog(self.addLog('stdio'), False)
+
+        d = self.runCommand(self.cmd)
+
+        @d.addCallback
+        def check(_):
+            if self.cmd.didFail():
+                raise BuildStepFailed()
+
+            return SUCCESS
+
+        d.addCallback(self.finished)
+        d.addErrback(self.failed)
+
+    def interrupt(self, reason):
+        BuildStep.interrupt(self, reason)
+
+        if self.cmd:
+            return self.cmd.interrupt(reason)
+
+
+class SharedSVNCheckout(TimedCheckoutMixin, WorkerScriptStep):
+    """Checks out SVN sources from a working copy shared by all builders of a worker.
+
+    The revision of the build (or HEAD) is exported to the working directory from the shared
+    working copy, which is updated first. Only what changed since the last update is downloaded,
+    even for builders which never built the URL on this worker.
+
+    Arguments:
+
+    - workdir: Where to put sources, relative to the build directory.
+    - repourl: The URL to check out.
+    - cache: Where to keep the shared working copies, relative to the build directory.
+    - link: How to copy files from the shared working copy, 'copy' (copy-on-write clones where
+      supported) or 'hardlink' (faster, but builds must not modify sources in place).
+
+    """
+
+    name = 'svn'
+
+    renderables = ['repourl', 'cache']
+
+    def __init__(self, workdir, repourl, cache=SHARED_CACHE, link='copy', **kwargs):
+        WorkerScriptStep.__init__(self, workdir='.', **kwargs)
+
+        if link not in LINK_METHODS:
+            config.error("'link' must be one of %s" % ', '.join(LINK_METHODS))
+
+        self.dest = workdir
+        self.repourl = repourl
+        self.cache = cache
+        self.link = link
+
+    def arguments(self):
+        return 'svn_shared', (self.cache, self.repourl, self.getProperty('revision') or None,
+                              self.dest, self.link)
+
+
+class GitReference(TimedCheckoutMixin, WorkerScriptStep):
+    """Makes a git working directory borrow objects from a reference repository on the worker."""
+
+    name = 'git reference'
+
+    renderables = ['reference']
+
+    def __init__(self, workdir, reference, **kwargs):
+        WorkerScriptStep.__init__(self, workdir='.', **kwargs)
+
+        self.dest = workdir
+        self.reference = reference
+
+    def arguments(self):
+        return 'git_reference', (self.dest, self.reference)
+
+
+def svn_checkout_steps(workdir, repourl, strategy='clean', link='copy'):
+    """Returns the build steps checking out an SVN URL with the given strategy.
+
+    Strategies are:
+
+    - clean: Reverts local changes and removes unversioned files, then updates.
+    - incremental: Just updates, keeping build products of previous builds.
+    - export: Exports a fresh copy, with no working copy metadata. This is fastest from a mirror
+      close to the worker, such as a local svnsync mirror.
+    - shared: Copies sources from a working copy shared by all builders of the worker (see
+      SharedSVNCheckout).
+
+    """
+    if strategy not in SVN_STRATEGIES:
+        config.error("'strategy' must be one of %s" % ', '.join(sorted(SVN_STRATEGIES)))
+        return []
+
+    if strategy == 'shared':
+        return [SharedSVNCheckout(workdir=workdir, repourl=repourl, link=link)]
+
+    mode, method = SVN_STRATEGIES[strategy]
+
+    return [TimedSVN(mode=mode, method=method, repourl=repourl, workdir=workdir)]
+
+
+def git_checkout_steps(workdir, repourl, branch, strategy='incremental', reference=None):
+    """Returns the build steps checking out a git branch with the given strategy.
+
+    Strategies are:
+
+    - clean: Removes untracked files, then fetches and checks out the branch.
+    - incremental: Just fetches and checks out the branch.
+    - shallow: Clones the last commit of the branch from scratch.
+
+    With a reference repository on the worker, objects it contains are not downloaded. Shallow
+    clones can't use a reference repository.
+    """
+    if strategy not in GIT_STRATEGIES:
+        config.error("'strategy' must be one of %s" % ', '.join(sorted(GIT_STRATEGIES)))
+        return []
+
+    mode, method, shallow = GIT_STRATEGIES[strategy]
+
+    if reference and shallow:
+        config.error('Shallow git checkouts cannot use a reference repository')
+        return []
+
+    steps = []
+
+    if reference:
+        steps.append(GitReference(workdir=workdir, reference=reference, hideStepIf=True))
+
+    steps.append(TimedGit(mode=mode, method=method, shallow=shallow, repourl=repourl,
+                          branch=branch, workdir=workdir))
+
+    return steps
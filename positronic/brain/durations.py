@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module keeps track of how long builds, steps and tests take, so that work can be balanced
+across shards (see `FreestyleJob.sharded_command()`) and the longest builds start first.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from os.path import dirname, exists, isdir, join
+from xml.etree import cElementTree as ElementTree
+
+from buildbot.process.buildstep import BuildStep
+from buildbot.status.results import SUCCESS
+from twisted.internet import defer, threads
+
+from positronic.brain.config import BrainConfig, BuildmasterConfig
+
+# The key of the duration of whole builds.
+BUILD_KEY = 'build'
+
+# The prefixes of the keys of step and test durations.
+STEP_PREFIX = 'step:'
+TEST_PREFIX = 'test:'
+
+# How much the last duration weighs against the previous ones.
+SMOOTHING = 0.5
+
+# Duration store path -> DurationStore
+DURATION_STORES = {}
+
+
+class DurationStore(object):
+    """Remembers how long things took in the recent builds of each builder.
+
+    For each builder and key, such as BUILD_KEY, 'step:compile' or 'test:tests/test_foo.py', the
+    store keeps a moving average of the durations and the number of the last build that reported
+    it. Keys which no build reported in the last `horizon` builds are forgotten, like BuildBot
+    forgets builds older than its 'buildHorizon'. The store is safe to use from several threads.
+
+    The store is read from disk when created, and lookups only touch memory, so that they can be
+    done on the reactor thread. Recording durations writes the whole store, without blocking
+    lookups meanwhile.
+
+    Arguments:
+
+    - path: Where the store is kept. If None, the store lives in memory only.
+    - horizon: How many builds to remember durations for.
+
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, horizon=100):
+        self.path = path
+        self.horizon = horizon
+
+        # Builder name -> key -> [duration, build number].
+        self.builders = {}
+
+        # Guards builders.
+        self._lock = threading.Lock()
+        # Serializes writes of the store, which may only replace older snapshots.
+        self._save_lock = threading.Lock()
+        self._changes = 0
+        self._saved = 0
+
+        self._load()
+
+    def record(self, builder, number, durations):
+        """Records the durations (seconds) reported by a build, given as a key -> duration dict."""
+        with self._lock:
+            entries = self.builders.setdefault(builder, {})
+
+            for key, duration in durations.items():
+                if key in entries:
+                    duration = SMOOTHING * duration + (1 - SMOOTHING) * entries[key][0]
+
+                entries[key] = [round(duration, 3), number]
+
+            if self.horizon is not None:
+                for key in [k for k, (_, n) in entries.items() if n <= number - self.horizon]:
+                    del entries[key]
+
+            self._changes += 1
+            changes = self._changes
+            snapshot = json.dumps({'version': self.VERSION, 'builders': self.builders},
+                                  separators=(',', ':'))
+
+        self._save(snapshot, changes)
+
+    def expected(self, builder, key, default=None):
+        """Returns how long something is expected to take, in seconds."""
+        with self._lock:
+            entry = self.builders.get(builder, {}).get(key)
+
+        return entry[0] if entry else default
+
+    def durations(self, builder, prefix):
+        """Returns a dictionary mapping the keys with the given prefix, without it, to durations."""
+        with self._lock:
+            return dict((k[len(prefix):], d) for k, (d, _) in self.builders.get(builder, {}).items()
+                        if k.startswith(prefix))
+
+    def _load(self):
+        if not self.path or not exists(self.path):
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except ValueError:
+            # A corrupted store is as good as a missing one.
+            return
+
+        if data.get('version') == self.VERSION:
+            self.builders = data['builders']
+
+    def _save(self, snapshot, changes):
+        if not self.path:
+            return
+
+        with self._save_lock:
+            # A newer snapshot has been written meanwhile.
+            if changes <= self._saved:
+                return
+
+            if not isdir(dirname(self.path)):
+                os.makedirs(dirname(self.path))
+
+            # Write and rename, so that a crash never leaves a half-written store behind.
+            tmp_path = self.path + '.tmp'
+
+            with open(tmp_path, 'w') as f:
+                f.write(snapshot)
+
+            os.rename(tmp_path, self.path)
+            self._saved = changes
+
+
+class RecordDurations(BuildStep):
+    """Records the durations of the build, of its steps and of the tests in its JUnit reports.
+
+    Reports are looked up among the artifacts of the build on the master, so this step must follow
+    their upload. Each test file (or class, for reports which don't name files) is recorded with
+    the total duration of its test cases.
+    """
+
+    name = 'record durations'
+
+    haltOnFailure = False
+    flunkOnFailure = False
+    warnOnFailure = False
+
+    def start(self):
+        durations = {}
+
+        for step in self.build.build_status.getSteps():
+            started, finished = step.getTimes()
+
+            if started is not None and finished is not None:
+                durations[STEP_PREFIX + step.getName()] = finished - started
+
+        started, _ = self.build.build_status.getTimes()
+        durations[BUILD_KEY] = time.time() - started
+
+        artifacts = join(BrainConfig['artifactsDir'], self.getProperty('buildername'),
+                         str(self.getProperty('buildnumber')))
+
+        d = threads.deferToThread(
+            record_build, self.getProperty('buildername'), self.getProperty('buildnumber'),
+            os.path.expanduser(artifacts), durations)
+        d.addCallback(lambda _: self.finished(SUCCESS))
+        d.addErrback(self.failed)
+
+
+def get_duration_store():
+    """Returns the duration store of the master, pruned with the current 'buildHorizon'."""
+    path = join(BrainConfig['basedir'], 'durations.json')
+
+    if path not in DURATION_STORES:
+        DURATION_STORES[path] = DurationStore(path)
+
+    store = DURATION_STORES[path]
+    store.horizon = BuildmasterConfig.get('buildHorizon')
+
+    return store
+
+
+def record_build(builder, number, artifacts, durations):
+    """Records the given durations of a build, and those of the tests in its artifacts."""
+    durations = dict(durations)
+
+    for name, duration in junit_durations(artifacts).items():
+        durations[TEST_PREFIX + name] = duration
+
+    get_duration_store().record(builder, number, durations)
+
+
+def junit_durations(root):
+    """Returns the total duration of the test cases of each test file in the JUnit reports in root.
+
+    Test cases without a 'file' attribute are grouped by their 'classname'. XML files which are not
+    JUnit reports are ignored.
+    """
+    durations = {}
+
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith('.xml'):
+                continue
+
+            try:
+                for _, element in ElementTree.iterparse(join(dirpath, filename)):
+                    if element.tag != 'testcase':
+                        continue
+
+                    name = element.get('file') or element.get('classname')
+
+                    if name:
+                        durations[name] = durations.get(name, 0) + float(element.get('time', 0))
+
+                    element.clear()
+            except (SyntaxError, ValueError, EnvironmentError):
+                continue
+
+    return durations
+
+
+def lpt_partition(durations, bins):
+    """Splits items among bins so that the total durations of bins are as even as possible.
+
+    Items are taken from the longest to the shortest, and each one goes to the bin with the least
+    work so far (the "longest processing time first" rule). Returns a list of lists of items.
+    """
+    partition = [[] for _ in range(bins)]
+    loads = [(0, i) for i in range(bins)]
+
+    for item, duration in sorted(durations.items(), key=lambda i: (-i[1], i[0])):
+        load, i = heapq.heappop(loads)
+        partition[i].append(item)
+        heapq.heappush(loads, (load + duration, i))
+
+    return partition
+
+
+@defer.inlineCallbacks
+def prioritize_builders(buildmaster, builders):
+    """A `prioritizeBuilders` function starting the builders with the longest builds first.
+
+    Builders whose builds are expected to take longer get workers first, so that short builds fill
+    the gaps instead of making long ones finish late. Builders with no recorded durations come last,
+    and builders with the same expected duration are ordered by their oldest build request, as
+    BuildBot does by default.
+    """
+    store = get_duration_store()
+    oldest = yield defer.gatherResults([b.getOldestRequestTime() for b in builders])
+
+    def key(item):
+        builder, requested = item
+        return (-store.expected(builder.name, BUILD_KEY, 0), requested is None, requested)
+
+    defer.returnValue([b for b, _ in sorted(zip(builders, oldest), key=key)])
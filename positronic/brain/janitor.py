@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the artifact janitor, which removes obsolete artifacts from the master without
+blocking the reactor thread.
+"""
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from buildbot.process.metrics import MetricCountEvent
+
+
+class ArtifactJanitor(object):
+    """Runs artifact maintenance jobs in a bounded pool of threads.
+
+    Jobs are keyed by the artifacts root of a builder: at most one job runs for a given root at any
+    time, and a job submitted while another one for the same root is still waiting to start is
+    coalesced into it (the arguments of the most recent submission win). Job functions must return
+    the number of bytes they freed.
+
+    Arguments:
+
+    - max_threads: The maximum number of jobs running at the same time.
+
+    """
+
+    def __init__(self, max_threads=2):
+        self.pool = ThreadPool(minthreads=0, maxthreads=max_threads, name='artifact-janitor')
+        self.bytes_freed = 0
+
+        # Root -> (function, arguments, Deferreds waiting for it) for jobs which haven't started yet.
+        self._queued = {}
+        # Roots with a running job.
+        self._running = set()
+
+    @property
+    def queue_depth(self):
+        """The number of jobs waiting to be started."""
+        return len(self._queued)
+
+    def submit(self, root, fn, *args):
+        """Schedules `fn(*args)` to run for the given root.
+
+        Returns a Deferred which fires with the number of bytes freed by the job that served this
+        request.
+        """
+        d = defer.Deferred()
+
+        if root in self._queued:
+            _, _, waiting = self._queued[root]
+        else:
+            waiting = []
+
+        waiting.append(d)
+        self._queued[root] = (fn, args, waiting)
+
+        self._maybe_start(root)
+        self._report()
+
+        return d
+
+    def _maybe_start(self, root):
+        if root in self._running or root not in self._queued:
+            return
+
+        fn, args, waiting = self._queued.pop(root)
+        self._running.add(root)
+
+        d = self._defer(fn, *args)
+        d.addBoth(self._finished, root, waiting)
+
+    def _finished(self, result, root, waiting):
+        self._running.discard(root)
+
+        if isinstance(result, Failure):
+            for d in waiting:
+                d.errback(result)
+        else:
+            self.bytes_freed += result
+            MetricCountEvent.log('positronic.janitor.bytes_freed', result)
+
+            for d in waiting:
+                d.callback(result)
+
+        self._maybe_start(root)
+        self._report()
+
+    def _report(self):
+        MetricCountEvent.log('positronic.janitor.queue_depth', self.queue_depth, absolute=True)
+
+    def _defer(self, fn, *args):
+        if not self.pool.started:
+            self.pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+        return threads.deferToThreadPool(reactor, self.pool, fn, *args)
+
+
+JANITOR = ArtifactJanitor()
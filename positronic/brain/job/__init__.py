@@ -23,6 +23,8 @@ from buildbot.steps.trigger import Trigger
 
 from positronic.brain.config import BuildmasterConfig
 from positronic.brain import utils
+from positronic.brain.locality import LocalityPolicy
+from positronic.brain.scheduler import merge_requests
 from positronic.brain.utils import scheduler_name
 
 
@@ -30,7 +32,9 @@ class Job(object):
     """The base class for all job types.
 
     It doesn't do much by itself, except for creating a new Builder and a new Force Scheduler so
-    that users can forcibly trigger a new build.
+    that users can forcibly trigger a new build. Build requests queued on the Builder are merged
+    together when possible (see `positronic.brain.scheduler.merge_requests`), and builds prefer the
+    idle workers which ran the last ones (see `positronic.brain.locality.LocalityPolicy`).
 
     This class can be used as a context manager although, by default, it does nothing.
 
@@ -42,10 +46,13 @@ class Job(object):
 
         self.build = BuildFactory()
 
-        BuildmasterConfig['builders'].append(BuilderConfig(
+        self.builder_config = BuilderConfig(
             name=self.name,
             factory=self.build,
-            slavenames=self.workers))
+            slavenames=self.workers,
+            mergeRequests=merge_requests,
+            nextSlave=LocalityPolicy())
+        BuildmasterConfig['builders'].append(self.builder_config)
 
         BuildmasterConfig['schedulers'].append(ForceScheduler(
             name=scheduler_name(self, 'force'),
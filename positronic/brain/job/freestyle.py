@@ -16,95 +16,356 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from functools import partial
-from random import randrange
+from contextlib import contextmanager
 
-from buildbot.changes.filter import ChangeFilter
+from buildbot import config
 from buildbot.process.properties import Interpolate
-from buildbot.changes.svnpoller import SVNPoller
-from buildbot.schedulers.basic import SingleBranchScheduler
-from buildbot.schedulers.triggerable import Triggerable
-from buildbot.status.mail import MailNotifier
 from buildbot.steps.shell import ShellCommand
-from buildbot.steps.source.svn import SVN
+from buildbot.steps.trigger import Trigger
 
 from positronic.brain.artifact import add_artifact_pre_build_steps, add_artifact_post_build_steps
+from positronic.brain.capacity import RESOURCES_PROPERTY, ResourceDemand
+from positronic.brain.checkout import git_checkout_steps, svn_checkout_steps
 from positronic.brain.config import BrainConfig, BuildmasterConfig
 from positronic.brain.job import Job
-from positronic.brain.mail import html_message_formatter
-from positronic.brain.utils import has_svn_change_source, hashify, scheduler_name, is_dir_in_change
+from positronic.brain.locality import LocalityPolicy
+from positronic.brain.parallel import COMMAND_FLAGS, ParallelCommands
+from positronic.brain.poller import branch_url, get_svn_poller
+from positronic.brain.scheduler import Debounce, merge_requests
+from positronic.brain.trigger import MatrixTrigger, TrackedTriggerable
+from positronic.brain.utils import scheduler_name
+
+# How long to wait for more changes after a pushed one, in seconds. Pushed revisions are complete,
+# so this only merges commits made in quick succession.
+PUSH_STABLE_TIMER = 2
 
 
 class FreestyleJob(Job):
-    def __init__(self, name, workers):
+    """A job made of arbitrary commands, run on a set of workers.
+
+    Arguments:
+
+    - name: The name of the job.
+    - workers: The names of all workers which can run this job.
+    - delta_artifacts: Transfer to the master only artifacts whose content differs from those of
+      the previous build. Files are hashed on the worker, which is worth it for jobs producing large
+      artifacts that rarely change.
+    - env: Environment variables set for all commands of the job.
+
+    """
+
+    def __init__(self, name, workers, delta_artifacts=False, env=None):
         super(FreestyleJob, self).__init__(name, workers)
 
+        self.delta_artifacts = delta_artifacts
+        self.env = dict(env or {})
+
+        # Commands of the parallel() block being configured, if any.
+        self.parallel_commands = None
+
         add_artifact_pre_build_steps(self)
 
+        # Where the steps added by the user start (see sharded_command()).
+        self.first_step = len(self.build.steps)
+
+        # The jobs running the shards of sharded commands.
+        self.shard_jobs = []
+
         # Add a "triggerable" build step so that other jobs can trigger us.
-        BuildmasterConfig['schedulers'].append(Triggerable(
+        BuildmasterConfig['schedulers'].append(TrackedTriggerable(
             name=scheduler_name(self, 'trigger'),
             builderNames=[self.name]))
 
     def __exit__(self, type, value, traceback):
+        for job in self.shard_jobs:
+            job.__exit__(type, value, traceback)
+
         # As the last step, we grab artifacts from the worker. This MUST always be the last step.
         add_artifact_post_build_steps(self)
 
-    def checkout(self, workdir, url, branch):
-        repo_url = '%s/%s' % (url, branch)
+    def checkout(self, workdir, url, branch, strategy='clean', mirror=None, link='copy'):
+        """Checks out a branch of an SVN repository in the given working directory.
+
+        The time taken is added to the 'checkout_duration' build property.
+
+        Arguments:
 
-        self.add_step(SVN(
-            mode='full',
-            method='clean',
-            repourl=repo_url,
-            workdir=workdir))
+        - workdir: Where to put sources, relative to the build directory.
+        - url: The URL of the repository.
+        - branch: The branch to check out, relative to the URL.
+        - strategy: How sources are checked out: 'clean', 'incremental', 'export' or 'shared' (see
+          `positronic.brain.checkout.svn_checkout_steps`).
+        - mirror: The URL of a mirror of the repository to check out from instead, such as a local
+          svnsync mirror on the worker.
+        - link: With the 'shared' strategy, whether files are copied from the shared working copy
+          ('copy') or hard linked to it ('hardlink').
+
+        """
+        repo_url = '%s/%s' % (mirror or url, branch)
+
+        for step in svn_checkout_steps(workdir, repo_url, strategy, link):
+            self.add_step(step)
+
+    def checkout_git(self, workdir, url, branch='master', strategy='incremental', reference=None):
+        """Checks out a branch of a git repository in the given working directory.
+
+        The time taken is added to the 'checkout_duration' build property.
+
+        Arguments:
+
+        - workdir: Where to put sources, relative to the build directory.
+        - url: The URL of the repository.
+        - branch: The branch to check out.
+        - strategy: How sources are checked out: 'clean', 'incremental' or 'shallow' (see
+          `positronic.brain.checkout.git_checkout_steps`).
+        - reference: The path of a repository on the worker to borrow objects from.
+
+        """
+        for step in git_checkout_steps(workdir, url, branch, strategy, reference):
+            self.add_step(step)
 
     def command(self, *args, **kwargs):
-        env = {
+        env = dict(self.env)
+        env.update(kwargs.get('env', {}))
+        env.update({
             'BUILD': Interpolate('%(prop:buildnumber)s'),
             'BUILD_ARTIFACTS': Interpolate('%(prop:artifactsdir)s'),
             'CI': '1',
-        }
+        })
+
+        kwargs['env'] = env
+
+        if self.parallel_commands is None:
+            self.add_step(ShellCommand(command=list(args), **kwargs))
+            return
 
-        if 'env' in kwargs:
-            kwargs['env'].update(env)
-        else:
-            kwargs['env'] = env
+        unsupported = set(kwargs) - set(('env', 'name') + COMMAND_FLAGS)
+
+        if unsupported:
+            config.error('Commands in parallel() do not support %s' %
+                         ', '.join(sorted(unsupported)))
+
+        kwargs['command'] = list(args)
+        self.parallel_commands.append(kwargs)
+
+    @contextmanager
+    def parallel(self, limit=None, workdir=None):
+        """Runs the commands added inside the block at the same time, on the same worker.
+
+        The output of each command is kept in its own log, and the block stops the build like
+        separate steps would (see `positronic.brain.parallel.ParallelCommands`). Commands only
+        support the 'env' and 'name' arguments and the 'haltOnFailure', 'flunkOnFailure' and
+        'warnOnFailure' flags.
+
+        Example:
+
+            with j.parallel(limit=2):
+                j.command('make', 'lint')
+                j.command('make', 'docs', flunkOnFailure=False, warnOnFailure=True)
+                j.command('make', 'check')
+
+        Arguments:
+
+        - limit: How many commands can run at the same time, or None to run all of them at once.
+        - workdir: Where commands are run, relative to the build directory.
+
+        """
+        if self.parallel_commands is not None:
+            config.error('parallel() blocks cannot be nested')
+
+        self.parallel_commands = commands = []
+
+        try:
+            yield self
+        finally:
+            self.parallel_commands = None
+
+        if commands:
+            self.add_step(ParallelCommands(commands, limit=limit, workdir=workdir))
+
+    def sharded_command(self, shards, *args, **kwargs):
+        """Splits a long command, such as a test suite, in shards run at the same time by other
+        workers.
+
+        Shards are builds of a separate job, named after this one with a '-shards' suffix, running
+        on the same workers. Each shard repeats the steps added to this job so far, such as the
+        checkout and the build, and then runs the command with the SHARD_INDEX (from 0) and
+        SHARD_COUNT environment variables: the command must use them to pick its share of the work.
+
+        Once shards have left JUnit XML reports in their artifacts, SHARD_FILES lists the test files
+        (or classes) of each shard, separated by spaces, so that shards take about the same time
+        according to past builds (see `positronic.brain.durations`). SHARD_KNOWN_FILES lists those
+        of all shards: commands should run the files in SHARD_FILES, plus their share by
+        SHARD_INDEX of the files missing from SHARD_KNOWN_FILES, such as new ones.
+
+        This job waits for all shards, and fails if any of them fails. The output of the command in
+        each shard is copied to a log named after the shard, and the artifacts of each shard are
+        linked in a directory named after the shard inside the artifacts of this build, such as
+        'shard-0'.
+
+        Example:
+
+            j.sharded_command(4, 'make', 'check')
+
+        Arguments:
+
+        - shards: The number of shards.
+        - fail_fast: Whether to stop all other shards as soon as one of them fails.
+
+        Any other argument is passed to command() in the shards.
+        """
+        fail_fast = kwargs.pop('fail_fast', False)
 
-        self.add_step(ShellCommand(command=list(args), **kwargs))
+        if shards < 1:
+            config.error('sharded_command() needs at least one shard, got %r' % (shards,))
+
+        if self.parallel_commands is not None:
+            config.error('sharded_command() cannot be used in parallel() blocks')
+
+        name = self.name + '-shards'
+
+        if self.shard_jobs:
+            name += '-%d' % (len(self.shard_jobs) + 1)
+
+        job = FreestyleJob(name, self.workers, delta_artifacts=self.delta_artifacts, env=self.env)
+        # Shards have the same sources, but they are different builds.
+        job.builder_config.mergeRequests = False
+        job.builder_config.canStartBuild = self.builder_config.canStartBuild
+        self.shard_jobs.append(job)
+
+        for step in self.build.steps[self.first_step:]:
+            if not issubclass(step.factory, Trigger):
+                job.add_step(step)
+
+        env = dict(kwargs.pop('env', {}))
+        env.update({
+            'SHARD_INDEX': Interpolate('%(prop:shard_index)s'),
+            'SHARD_COUNT': str(shards),
+            'SHARD_FILES': Interpolate('%(prop:shard_files:-)s'),
+            'SHARD_KNOWN_FILES': Interpolate('%(prop:shard_known_files:-)s'),
+        })
+
+        kwargs.setdefault('name', 'shard')
+        job.command(env=env, *args, **kwargs)
+
+        trigger = scheduler_name(job, 'trigger')
+
+        self.add_step(MatrixTrigger(
+            name='shards',
+            cells=dict(('shard-%d' % i, (trigger, {'shard_index': i})) for i in range(shards)),
+            fail_fast=fail_fast,
+            merge_logs=kwargs['name'],
+            collect_artifacts=True,
+            balance=job.name))
 
     def notify(self, *recipients):
-        BuildmasterConfig['status'].append(MailNotifier(
-            builders=[self.name],
-            extraRecipients=recipients,
-            fromaddr=BrainConfig['emailFrom'],
-            messageFormatter=html_message_formatter,
-            mode=['change', 'failing'],
-            sendToInterestedUsers=False))
-
-    def watch(self, url, branch):
-        repo_url = '%s/%s' % (url, branch)
-
-        if not has_svn_change_source(repo_url):
-            BuildmasterConfig['change_source'].append(SVNPoller(
-                svnurl=repo_url,
-                pollInterval=300 + randrange(0, 60),
-                histmax=5))
-
-        BuildmasterConfig['schedulers'].append(SingleBranchScheduler(
-            name=scheduler_name(self, 'svn-' + hashify(repo_url)),
-            treeStableTimer=60,
-            builderNames=[self.name],
-            change_filter=ChangeFilter(repository=repo_url)))
+        BrainConfig['notifier'].add_route(recipients, builders=[self.name],
+                                          mode=['change', 'failing'])
+
+    def debounce(self, min_delay=5, max_delay=60, max_wait=300, merge=True):
+        """Configures how long builds wait for more changes before starting.
+
+        A lone change is built after `min_delay` seconds, while bursts of changes wait up to
+        `max_delay` seconds after each change, and `max_wait` seconds overall, so that they are
+        built together (see `positronic.brain.scheduler.Debounce`).
+
+        Arguments:
+
+        - min_delay: The delay after a lone change, in seconds.
+        - max_delay: The longest delay after any change, in seconds.
+        - max_wait: The longest time a change waits for its build to start, in seconds.
+        - merge: Whether build requests still queued when a worker becomes available are merged in
+          a single build.
+
+        """
+        BrainConfig['changeRouter'].set_debounce(
+            self.name, Debounce(min_delay=min_delay, max_delay=max_delay, max_wait=max_wait))
+
+        self.builder_config.mergeRequests = merge_requests if merge else False
+
+    def cancel_superseded(self, running=False):
+        """Drops queued builds of older changes when a build of newer changes is requested.
+
+        Only builds of changes coming from the same repository are dropped, and forced builds are
+        always kept.
+
+        Arguments:
+
+        - running: Interrupt running builds of older changes as well, unless they have already
+          started uploading their artifacts.
+
+        """
+        BrainConfig['changeRouter'].set_cancel_superseded(self.name, running)
+
+    def locality(self, wait=60, history=10):
+        """Makes builds wait for a worker with a warm working copy before starting elsewhere.
+
+        By default builds start on the idle worker which ran the most recent build of this job, if
+        any, or else on the least loaded idle worker.
+
+        Arguments:
+
+        - wait: How long to wait, in seconds, for one of the workers which ran the last builds.
+        - history: How many of the last builds to look at to find those workers.
+
+        """
+        self.builder_config.nextSlave = LocalityPolicy(wait=wait, history=history)
+
+    def requires(self, **demands):
+        """Declares the resources needed by each build of this job.
+
+        Builds only start on workers having enough of these resources free, given the builds
+        already running there (see `positronic.brain.capacity`).
+
+        Example:
+
+            j.requires(cpu=16, memory=32)
+
+        """
+        for resource, amount in demands.iteritems():
+            if amount < 0:
+                config.error('requires() got a negative amount of %s: %r' % (resource, amount))
+
+        # A build needing more than a worker has would never start on it.
+        for slave in BuildmasterConfig['slaves']:
+            if slave.slavename not in self.workers:
+                continue
+
+            available = slave.properties.getProperty(RESOURCES_PROPERTY, {})
+
+            for resource, amount in demands.iteritems():
+                if amount > available.get(resource, amount):
+                    config.error('%s requires %r %s, but worker %s only has %r' % (
+                        self.name, amount, resource, slave.slavename, available[resource]))
+
+        self.builder_config.canStartBuild = ResourceDemand(demands)
+
+    def watch(self, url, branch, push=False):
+        """Start the build when changes are committed to the given branch of an SVN repository.
+
+        The repository is polled for changes, unless `push` is true: then the repository must run
+        `positronic/brain/scripts/svn_post_commit.py` as post-commit hook, and builds start a few
+        seconds after each commit. Polling is disabled for all branches of the repository.
+        """
+        # Changes carry the branch URL normalized by the poller.
+        repo_url = branch_url(url, branch)
+
+        # All branches of a repository share the same poller.
+        poller = get_svn_poller(url)
+        poller.add_branch(branch)
+
+        if push:
+            poller.enable_push()
+
+        BrainConfig['changeRouter'].add_repository(
+            repo_url, self.name, treeStableTimer=PUSH_STABLE_TIMER if push else None)
 
     def watch_paths(self, paths):
         """
-        Start the build if an incoming change-set contains files that begin with the given
-        directory names.
+        Start the build if an incoming change-set contains files inside the given directories.
+
+        Paths may also be glob patterns, such as 'src/*/tests' or 'src/**/*.h', and patterns
+        starting with '!' exclude files (see `positronic.brain.paths.PathMatcher`).
 
         """
-        BuildmasterConfig['schedulers'].append(SingleBranchScheduler(
-            builderNames=[self.name],
-            change_filter=ChangeFilter(filter_fn=partial(is_dir_in_change, paths)),
-            name=scheduler_name(self, 'filter-' + hashify(''.join(paths))),
-            treeStableTimer=60))
+        BrainConfig['changeRouter'].add_paths(paths, self.name)
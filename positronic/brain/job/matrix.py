@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import re
+import sys
+from contextlib import contextmanager
+
+from buildbot import config
+
+from positronic.brain.job import Job
+from positronic.brain.job.freestyle import FreestyleJob
+from positronic.brain.trigger import MatrixTrigger
+from positronic.brain.utils import scheduler_name
+
+
+def forward_to_cells(name):
+    """Returns a MatrixJob method calling the FreestyleJob method `name` of all cells."""
+    def method(self, *args, **kwargs):
+        for job in self.cells.values():
+            getattr(job, name)(*args, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = getattr(FreestyleJob, name).__doc__
+
+    return method
+
+
+class MatrixJob(Job):
+    """
+    A virtual job that builds all combinations of some parameters, such as platform, compiler and
+    configuration, in parallel.
+
+    Each combination (a cell) is a FreestyleJob, whose commands see the value of each axis in an
+    environment variable named after it. Forcing a build of the matrix job triggers all cells at
+    once, and waits for all of them: it then reports the result and duration of each cell (see
+    `positronic.brain.trigger.MatrixTrigger`).
+
+    .. code:: python
+
+        WORKERS = {
+            'linux': ['linux-worker-1', 'linux-worker-2'],
+            'windows': ['windows-worker-1'],
+        }
+
+        axes = [
+            ('platform', ['linux', 'windows']),
+            ('compiler', ['gcc', 'clang', 'msvc']),
+            ('config', {'debug': {'CFLAGS': '-O0 -g'}, 'release': {'CFLAGS': '-O2'}}),
+        ]
+
+        def supported(cell):
+            return (cell['platform'] == 'windows') == (cell['compiler'] == 'msvc')
+
+        with MatrixJob('foo', axes, lambda cell: WORKERS[cell['platform']],
+                       include=supported, fail_fast=True) as job:
+            job.checkout('src', 'svn+ssh://svn.example.com/svn/foo', 'trunk')
+            job.command('make', 'CC=$COMPILER')
+
+    This creates the jobs 'foo-linux-gcc-debug', 'foo-linux-clang-release', 'foo-windows-msvc-debug'
+    and so on, with the PLATFORM, COMPILER and CONFIG environment variables, and CFLAGS.
+
+    All FreestyleJob configuration methods, such as checkout(), command(), notify() and watch(),
+    are forwarded to all cells. Cells can also be configured one by one through the 'cells'
+    dictionary, whose keys are the names of the cells without the name of the matrix job, such as
+    'linux-gcc-debug'.
+
+    Arguments:
+
+    - name: The name of the matrix job.
+    - axes: A list of (name, values) pairs. Values are either a list, or a dictionary mapping each
+      value to additional environment variables.
+    - workers: The names of the workers running the cells, or a function returning them given a
+      cell, as a dictionary mapping axis names to values.
+    - include: A function telling whether a cell, given as above, is part of the matrix.
+    - exclude: A function telling whether a cell, given as above, is NOT part of the matrix.
+    - fail_fast: Whether to cancel all other cells as soon as one of them fails.
+    - env: Environment variables of all cells. The variables of axes take precedence.
+
+    Any other argument is forwarded to all cells.
+    """
+
+    def __init__(self, name, axes, workers, include=None, exclude=None, fail_fast=False, env=None,
+                 **kwargs):
+        super(MatrixJob, self).__init__(name, ['master'])
+
+        self.axes = [(axis, values) for axis, values in axes]
+
+        # Cell name -> FreestyleJob building the cell.
+        self.cells = dict()
+
+        for values in itertools.product(*[sorted(v) for _, v in self.axes]):
+            cell = dict((axis, value) for (axis, _), value in zip(self.axes, values))
+
+            if (include and not include(cell)) or (exclude and exclude(cell)):
+                continue
+
+            cell_env = dict(env or {})
+
+            for (axis, axis_values), value in zip(self.axes, values):
+                cell_env[env_name(axis)] = str(value)
+
+                if isinstance(axis_values, dict):
+                    cell_env.update(axis_values[value] or {})
+
+            cell_name = '-'.join(str(v) for v in values)
+            cell_workers = workers(cell) if callable(workers) else workers
+
+            self.cells[cell_name] = FreestyleJob(name + '-' + cell_name, cell_workers,
+                                                 env=cell_env, **kwargs)
+
+        if not self.cells:
+            config.error('The matrix %s has no cells' % self.name)
+
+        self.add_step(MatrixTrigger(
+            cells=dict((cell, (scheduler_name(job, 'trigger'), {}))
+                       for cell, job in self.cells.items()),
+            fail_fast=fail_fast))
+
+    def __enter__(self):
+        # Forward context manager events to all cells.
+        for job in self.cells.values():
+            job.__enter__()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # Forward context manager events to all cells.
+        for job in self.cells.values():
+            job.__exit__(type, value, traceback)
+
+    @contextmanager
+    def parallel(self, limit=None, workdir=None):
+        """Runs the commands added inside the block at the same time, in each cell.
+
+        See `FreestyleJob.parallel()`.
+        """
+        blocks = [job.parallel(limit=limit, workdir=workdir) for job in self.cells.values()]
+
+        for block in blocks:
+            block.__enter__()
+
+        try:
+            yield self
+        except:
+            exc_info = sys.exc_info()
+
+            for block in blocks:
+                block.__exit__(*exc_info)
+
+            raise exc_info[0], exc_info[1], exc_info[2]
+        else:
+            for block in blocks:
+                block.__exit__(None, None, None)
+
+    # Build configuration is forwarded to all cells.
+    checkout = forward_to_cells('checkout')
+    checkout_git = forward_to_cells('checkout_git')
+    command = forward_to_cells('command')
+    notify = forward_to_cells('notify')
+    trigger = forward_to_cells('trigger')
+    watch = forward_to_cells('watch')
+    watch_paths = forward_to_cells('watch_paths')
+    debounce = forward_to_cells('debounce')
+    cancel_superseded = forward_to_cells('cancel_superseded')
+    locality = forward_to_cells('locality')
+    requires = forward_to_cells('requires')
+    sharded_command = forward_to_cells('sharded_command')
+
+
+def env_name(axis):
+    """Returns the name of the environment variable holding the value of an axis."""
+    return re.sub(r'\W', '_', axis).upper()
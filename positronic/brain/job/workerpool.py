@@ -16,11 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from positronic.brain.job import Job
-from positronic.brain.job.freestyle import FreestyleJob
+from positronic.brain.job.matrix import MatrixJob
 
 
-class WorkerPoolJob(Job):
+class WorkerPoolJob(MatrixJob):
     """
     A virtual job that triggers platform-specific builds.
 
@@ -62,6 +61,10 @@ class WorkerPoolJob(Job):
     - foo-windows: A FreestyleJob associated to all workers in the 'windows' pool.
     - foo: The "meta" job. Forcing a build of this job will trigger the other two.
 
+    A WorkerPoolJob is a MatrixJob with a single axis, the pool: commands see the name of the pool
+    in the POOL environment variable. The FreestyleJob configuration methods, such as checkout(),
+    command(), notify(), trigger() and watch(), are forwarded to all jobs in the pool.
+
     Platform specific jobs can still be addressed via the 'pool' dictionary. As an example, to run
     a different build command on Windows and Linux your can add a fragment like this to your
     configuration file:
@@ -82,38 +85,9 @@ class WorkerPoolJob(Job):
             job.command('make', 'check')
     """
 
-    def __init__(self, name, pools):
-        super(WorkerPoolJob, self).__init__(name, ['master'])
+    def __init__(self, name, pools, **kwargs):
+        super(WorkerPoolJob, self).__init__(name, [('pool', list(pools))],
+                                            lambda cell: pools[cell['pool']], **kwargs)
 
         # Worker pool name -> Job bound to workers in said pool
-        self.pool = dict()
-
-        for pool_name, workers in pools.items():
-            self.pool[pool_name] = FreestyleJob(name + '-' + pool_name, workers)
-
-        self.trigger(self.pool.values())
-
-    def __enter__(self):
-        # Forward context manager events to all jobs in the pool.
-        for job in self.pool.values():
-            job.__enter__()
-
-        return self
-
-    def __exit__(self, type, value, traceback):
-        # Forward context manager events to all jobs in the pool.
-        for job in self.pool.values():
-            job.__exit__(type, value, traceback)
-
-    def __getattribute__(self, name):
-        if hasattr(self, name):
-            # If we have the attribute, do nothing
-            return super(WorkerPoolJob, self).__getattribute__(name)
-        else:
-            # Otherwise forward the method call to all Job(s) in the pool.
-            # NOTE: Assumes a method call.
-            def wrapper(*args, **kwargs):
-                for j in self.pool.values():
-                    getattr(j, name)(*args, **kwargs)
-
-            return wrapper
\ No newline at end of file
+        self.pool = self.cells
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module chooses which worker runs the next build of a builder.
+
+Checking out a large tree from scratch takes a long time, so builds prefer the workers which
+built the same builder most recently, since their working copies only need an update.
+"""
+
+from buildbot import util
+from buildbot.process.metrics import MetricCountEvent
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class LocalityPolicy(util.ComparableMixin):
+    """A `nextSlave` function preferring workers with a warm working copy.
+
+    Workers which ran one of the last `history` builds of the builder are warm, the most recent
+    one being preferred. If none of the warm workers is idle, the build waits up to `wait` seconds
+    for one of them, then starts on the least loaded idle worker instead.
+
+    Builds starting on warm and cold workers are counted in the `positronic.locality.warm` and
+    `positronic.locality.cold` metrics.
+
+    Arguments:
+
+    - wait: How long to wait for a warm worker, in seconds.
+    - history: How many of the last builds to look at to find warm workers.
+
+    """
+
+    compare_attrs = ['wait', 'history']
+
+    # For tests.
+    _reactor = reactor
+
+    def __init__(self, wait=0, history=10):
+        self.wait = wait
+        self.history = history
+
+        # Builder name -> when we started waiting for a warm worker, and the retry call.
+        self._waiting = {}
+
+    def __call__(self, builder, slavebuilders):
+        if not slavebuilders:
+            return None
+
+        idle = dict((sb.slave.slavename, sb) for sb in slavebuilders)
+        warm = self.warm_workers(builder)
+
+        for name in warm:
+            if name in idle:
+                self._stop_waiting(builder.name)
+                MetricCountEvent.log('positronic.locality.warm', 1)
+                return idle[name]
+
+        # Warm workers are all busy, they may become idle soon enough.
+        if warm and self._should_wait(builder):
+            return None
+
+        self._stop_waiting(builder.name)
+        MetricCountEvent.log('positronic.locality.cold', 1)
+
+        return min(slavebuilders, key=lambda sb: (running_builds(sb.slave), sb.slave.slavename))
+
+    def warm_workers(self, builder):
+        """Returns the names of the workers which ran the last builds of a builder, most recent
+        first."""
+        workers = []
+
+        for build in builder.builder_status.generateFinishedBuilds(num_builds=self.history):
+            if build.getSlavename() not in workers:
+                workers.append(build.getSlavename())
+
+        return workers
+
+    def _should_wait(self, builder):
+        now = self._reactor.seconds()
+
+        if builder.name not in self._waiting:
+            if self.wait <= 0:
+                return False
+
+            log.msg('LocalityPolicy: waiting up to %d seconds for a warm worker for %s' %
+                    (self.wait, builder.name))
+
+            # Nothing would look for a worker again once the wait is over, unless some other build
+            # finishes in the meantime.
+            retry = self._reactor.callLater(self.wait, builder.botmaster.maybeStartBuildsForBuilder,
+                                            builder.name)
+            self._waiting[builder.name] = (now, retry)
+
+        return now - self._waiting[builder.name][0] < self.wait
+
+    def _stop_waiting(self, name):
+        since, retry = self._waiting.pop(name, (None, None))
+
+        if retry is not None and retry.active():
+            retry.cancel()
+
+
+def running_builds(slave):
+    """Returns the number of builds running on a worker."""
+    return len([sb for sb in slave.slavebuilders.values() if sb.isBusy()])
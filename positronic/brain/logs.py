@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains helpers to read build logs without loading them in memory all at once.
+"""
+
+import os
+from collections import deque
+
+from buildbot.status.logfile import HTMLLogFile, STDERR, STDOUT
+
+
+# How much of a log file we read, at first, from its end. The window doubles until it contains
+# enough lines.
+TAIL_WINDOW = 64 * 1024
+
+
+def tail_lines(log, n, channels=(STDOUT, STDERR)):
+    """Returns the last `n` lines of text of a build log, without line terminators.
+
+    This is equivalent to `log.getText().splitlines()[-n:]`, but memory usage is bounded by the size
+    of the returned lines instead of the size of the whole log. Finished, uncompressed logs are read
+    backwards from their end, so only the tail of the file is ever read; other logs are streamed.
+    """
+    if n <= 0:
+        return []
+
+    if isinstance(log, HTMLLogFile):
+        # These are kept in memory anyway.
+        return log.getText().splitlines()[-n:]
+
+    filename = log.getFilename() if log.isFinished() else None
+
+    if filename and os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            return tail_netstrings(f, n, channels)
+
+    return list(tail_text(log.getChunks(list(channels), onlyText=True), n))
+
+
+def tail_text(chunks, n):
+    """Returns a deque with the last `n` lines of text split across the given chunks."""
+    lines = deque(maxlen=n)
+    partial = ''
+
+    for text in chunks:
+        parts = (partial + text).splitlines(True)
+        partial = ''
+
+        # The last line may continue in the next chunk. This includes a trailing '\r', which may be
+        # followed by a '\n'.
+        if parts and not parts[-1].endswith('\n'):
+            partial = parts.pop()
+
+        lines.extend(p.splitlines()[0] for p in parts)
+
+    if partial:
+        lines.extend(partial.splitlines())
+
+    return lines
+
+
+def tail_netstrings(f, n, channels):
+    """Returns the last `n` lines of text of a log file, reading it backwards from its end.
+
+    Log files are sequences of netstrings, each containing the channel (a single digit) followed by
+    text. Since a netstring can't be parsed backwards, we read a window at the end of the file and
+    look for the first position from which a sequence of netstrings ends exactly at the end of the
+    file. If the window doesn't contain enough lines, we try again with a larger one.
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    window = TAIL_WINDOW
+
+    while True:
+        start = max(0, size - window)
+
+        f.seek(start)
+        data = f.read(size - start)
+
+        chunks = [text for channel, text in parse_netstrings(data, start == 0)
+                  if channel in channels]
+
+        # Unless we're at the start of the file, the first line may be truncated: we need one more.
+        lines = tail_text(chunks, n + 1)
+
+        if start == 0 or len(lines) > n:
+            return list(lines)[-n:]
+
+        window *= 2
+
+
+def parse_netstrings(data, complete):
+    """Returns (channel, text) pairs for the netstrings at the end of `data`.
+
+    If `complete` is true, `data` must start with a netstring. Otherwise, it is the tail of a log and
+    may start in the middle of a netstring, so we only return the longest sequence of netstrings
+    ending exactly at the end of `data`.
+    """
+    ends = {}
+
+    # Map each candidate start position to the end of the netstring starting there, if valid.
+    # Netstrings can only start at the beginning of data or right after a comma.
+    candidates = [0] + [i + 1 for i, c in enumerate(data) if c == ',']
+
+    for i in candidates:
+        colon = data.find(':', i, i + 12)
+
+        if colon <= i or not data[i:colon].isdigit() or not data[colon + 1:colon + 2].isdigit():
+            continue
+
+        end = colon + 1 + int(data[i:colon])
+
+        if end < len(data) and data[end] == ',':
+            ends[i] = end + 1
+
+    # Find the earliest start from which netstrings follow each other up to the end of data.
+    valid = set([len(data)])
+
+    for i in sorted(ends, reverse=True):
+        if ends[i] in valid:
+            valid.add(i)
+
+    i = 0 if complete else min(valid)
+
+    if i not in valid or i == len(data):
+        return []
+
+    chunks = []
+
+    while i < len(data):
+        colon = data.find(':', i)
+        chunks.append((int(data[colon + 1]), data[colon + 2:ends[i] - 1]))
+        i = ends[i]
+
+    return chunks
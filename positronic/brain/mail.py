@@ -24,11 +24,12 @@ import datetime
 
 from buildbot.status.builder import Results
 from buildbot.process.buildstep import SUCCESS
-from jinja2 import Environment, PackageLoader
+
+from positronic.brain.logs import tail_lines
+from positronic.brain.templating import TEMPLATES_ENV
 
 
 LOG_MAX_LINES = 250
-TEMPLATES_ENV = Environment(loader=PackageLoader('positronic.brain', 'templates'))
 
 
 # This function was copied (with some minor edits) from:
@@ -50,7 +51,7 @@ def html_message_formatter(_, name, build, results, master_status):
 
     if failed_logs:
         failed_log = failed_logs[0]
-        failed_log_lines = failed_log.getText().splitlines()[-LOG_MAX_LINES:]
+        failed_log_lines = tail_lines(failed_log, LOG_MAX_LINES)
 
         if failed_log_lines:
             log = {
@@ -92,3 +93,24 @@ def html_message_formatter(_, name, build, results, master_status):
         'subject': subject,
         'type': 'html',
     }
+
+
+def digest_message_formatter(title, builds):
+    """Provide the message summarizing a batch of builds, sent to administrators in digest mode.
+
+    Arguments:
+
+    - title: The title of this BuildBot instance.
+    - builds: A list of dictionaries describing each build, with the 'builder', 'number', 'result',
+      'url', 'worker', 'reason' and 'finished' keys.
+
+    """
+    failed = len([b for b in builds if b['result'] in ('failure', 'exception')])
+
+    body = TEMPLATES_ENV.get_template('digest.jinja2').render(builds=builds, failed=failed)
+
+    return {
+        'body': body,
+        'subject': '[%s] %d builds, %d failed' % (title, len(builds), failed),
+        'type': 'html',
+    }
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the artifact manifest: a persistent index of the artifacts stored on the master
+for a builder, so that we don't have to rescan the file system every time we need to know what's
+there.
+"""
+
+import json
+import os
+import time
+from os import listdir, walk
+from os.path import basename, dirname, exists, isdir, islink, join
+from shutil import rmtree
+
+
+# Changes to the root directory which happen within this many seconds from the last time the
+# manifest has been synchronized with the file system may go unnoticed by just comparing
+# modification times (file system timestamps have limited resolution), so in that case we always
+# resynchronize.
+MTIME_SLACK = 2
+
+
+class ArtifactManifest(object):
+    """An index of the artifacts stored for a single builder.
+
+    The manifest maps each build number to a dictionary with the following keys:
+
+    - size: The total size in bytes of all files in the build directory.
+    - inodes: A dictionary mapping the inode number of each file to its size. Files hard linked
+      from other builds, such as unchanged files of delta uploads, share their inode with them, so
+      that retention counts their disk space only once (see `positronic.brain.retention`).
+    - files: The number of files in the build directory.
+    - empty: Whether the build directory is empty.
+    - mtime: The modification time of the build directory.
+    - result: The result of the build, if known.
+    - blobs: The digests of the files linked to the blob store, if any.
+    - linked_size: The total size in bytes of the files linked to the blob store.
+    - hashes: A dictionary mapping each file to its SHA-1 digest, if known.
+
+    The manifest is kept in sync with the builder's artifacts directory by looking at its
+    modification time: when it changes, only directories which have been added or removed since the
+    last synchronization are scanned. The total size of all builds is kept up to date as builds come
+    and go, so that it never needs a walk of the whole directory.
+
+    Arguments:
+
+    - root: The artifacts directory of the builder, containing one directory per build.
+    - path: Where the manifest is stored. If None, the manifest lives in memory only.
+    - blobs: A BlobStore. If given, files of new builds are deduplicated into it as they are
+      discovered, and blobs are freed when the builds referencing them are removed.
+
+    """
+
+    VERSION = 2
+
+    def __init__(self, root, path=None, blobs=None):
+        self.root = root
+        self.path = path
+        self.blobs = blobs
+        self.builds = {}
+        self.size = 0
+
+        self._dirty = False
+        self._loaded = False
+        self._root_mtime = None
+        self._synced_at = None
+
+    def __contains__(self, number):
+        return number in self.builds
+
+    def __getitem__(self, number):
+        return self.builds[number]
+
+    def numbers(self):
+        """Returns all build numbers in increasing order."""
+        return sorted(self.builds)
+
+    def set_result(self, number, result):
+        if number in self.builds and self.builds[number].get('result') != result:
+            self.builds[number]['result'] = result
+            self._dirty = True
+
+    def refresh(self):
+        """Makes sure the manifest reflects what's on disk.
+
+        The manifest is loaded from disk on first use, and resynchronized with the artifacts
+        directory only if it is missing or stale.
+        """
+        if not self._loaded:
+            self.load()
+
+        if self.is_stale():
+            self.sync()
+
+    def is_stale(self):
+        if self._root_mtime is None:
+            return True
+
+        mtime = root_mtime(self.root)
+
+        return mtime != self._root_mtime or mtime >= self._synced_at - MTIME_SLACK
+
+    def set_hashes(self, number, hashes):
+        if number in self.builds:
+            self.builds[number]['hashes'] = hashes
+            self._dirty = True
+
+    def sync(self):
+        """Adds build directories missing from the manifest and drops those which went away.
+
+        This function asserts that the root directory does not contain files and that all directory
+        names can be converted to integers. Each directory name should correspond to a build number
+        for that particular builder.
+        """
+        synced_at = time.time()
+        mtime = root_mtime(self.root)
+        numbers = set(map(int, listdir(self.root))) if mtime is not None else set()
+
+        for number in set(self.builds) - numbers:
+            self._forget(number)
+
+        for number in numbers - set(self.builds):
+            path = join(self.root, str(number))
+
+            # We only want directories.
+            assert isdir(path)
+
+            if self.blobs:
+                digests, linked_size = self.blobs.ingest(path)
+            else:
+                digests, linked_size = [], 0
+
+            self.builds[number] = scan_build(path)
+            self.builds[number]['blobs'] = digests
+            self.builds[number]['linked_size'] = linked_size
+            self.size += self.builds[number]['size']
+
+        self._root_mtime = mtime
+        self._synced_at = synced_at
+        self._dirty = True
+
+    def remove(self, number):
+        """Removes the artifacts of a build from disk and from the manifest.
+
+        Returns the number of bytes freed.
+        """
+        path = join(self.root, str(number))
+
+        # Files hard linked elsewhere, such as to the blob store or by other builds, are not freed.
+        bytes_freed = unlinked_size(path)
+        rmtree(path)
+
+        build = self._forget(number)
+
+        if self.blobs and build.get('blobs'):
+            bytes_freed += self.blobs.release(build['blobs'])
+
+        return bytes_freed
+
+    def _forget(self, number):
+        build = self.builds.pop(number)
+        self.size -= build['size']
+        self._dirty = True
+
+        return build
+
+    def load(self):
+        self._loaded = True
+
+        if not self.path or not exists(self.path):
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except ValueError:
+            # A corrupted manifest is as good as a missing one.
+            return
+
+        if data.get('version') != self.VERSION:
+            return
+
+        self.builds = dict((int(n), b) for n, b in data['builds'].items())
+        self.size = sum(b['size'] for b in self.builds.values())
+        self._root_mtime = data['root_mtime']
+        self._synced_at = data['synced_at']
+
+    def save(self):
+        """Writes the manifest to disk, if anything changed since it was last loaded or saved."""
+        if not self.path or not self._dirty:
+            return
+
+        if not isdir(dirname(self.path)):
+            os.makedirs(dirname(self.path))
+
+        data = {
+            'version': self.VERSION,
+            'builds': self.builds,
+            'root_mtime': self._root_mtime,
+            'synced_at': self._synced_at,
+        }
+
+        # Write and rename, so that a crash never leaves a half-written manifest behind.
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+
+        os.rename(tmp_path, self.path)
+
+        self._dirty = False
+
+
+def manifest_path(root):
+    """Returns where the manifest of the given builder artifacts directory is stored.
+
+    Manifests are kept outside of the builder's directory, since writing them there would change its
+    modification time.
+    """
+    return join(dirname(root), '.manifests', basename(root) + '.json')
+
+
+def root_mtime(root):
+    try:
+        return os.stat(root).st_mtime
+    except OSError:
+        return None
+
+
+def scan_build(path):
+    """Returns the manifest entry for the given build directory."""
+    size = 0
+    files = 0
+    inodes = {}
+
+    for dirpath, _, filenames in walk(path):
+        for f in filenames:
+            p = join(dirpath, f)
+
+            files += 1
+
+            if not islink(p):
+                st = os.stat(p)
+                size += st.st_size
+                inodes[str(st.st_ino)] = st.st_size
+
+    return {
+        'size': size,
+        'files': files,
+        'empty': not listdir(path),
+        'mtime': os.stat(path).st_mtime,
+        'inodes': inodes,
+    }
+
+
+def unlinked_size(path):
+    """Returns the total size of the files in a directory tree which have no other hard link."""
+    size = 0
+
+    for dirpath, _, filenames in walk(path):
+        for f in filenames:
+            p = join(dirpath, f)
+
+            if not islink(p):
+                st = os.stat(p)
+
+                if st.st_nlink == 1:
+                    size += st.st_size
+
+    return size
@@ -41,6 +41,47 @@ def patch_build_step():
     BuildStep.warnOnWarnings = True
 
 
+def patch_web_templates():
+    """
+    Makes the Jinja2 environment of the web interface share the bytecode cache of email templates
+    (see `positronic.brain.templating`) and compile all its templates when it is created, instead
+    of when pages are first requested.
+    """
+    from buildbot.status.web import baseweb
+
+    from positronic.brain.templating import TEMPLATES_ENV, precompile
+
+    create_jinja_env = baseweb.createJinjaEnv
+
+    def createJinjaEnv(*args, **kwargs):
+        env = create_jinja_env(*args, **kwargs)
+        env.bytecode_cache = TEMPLATES_ENV.bytecode_cache
+
+        if env.bytecode_cache is not None:
+            precompile(env)
+
+        return env
+
+    baseweb.createJinjaEnv = createJinjaEnv
+
+
+def patch_change_hooks():
+    """
+    Installs the 'svn' dialect of the web change hook (see `positronic.brain.status.web.svn_hook`),
+    since BuildBot only looks for dialects inside the `buildbot.status.web.hooks` package.
+    """
+    import sys
+
+    from buildbot.status.web import hooks
+
+    from positronic.brain.status.web import svn_hook
+
+    sys.modules['buildbot.status.web.hooks.svn'] = svn_hook
+    hooks.svn = svn_hook
+
+
 def patch_all():
     """Applies all patches."""
-    patch_build_step()
\ No newline at end of file
+    patch_build_step()
+    patch_web_templates()
+    patch_change_hooks()
\ No newline at end of file
@@ -0,0 +1,586 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the mail notifier used by the master, which renders and delivers emails without
+blocking the reactor thread.
+"""
+
+import datetime
+import smtplib
+import socket
+import threading
+import time
+from collections import deque
+
+from buildbot import config
+from buildbot.process.metrics import MetricCountEvent, MetricTimeEvent
+from buildbot.status.builder import EXCEPTION, FAILURE, SUCCESS, WARNINGS, Results
+from buildbot.status.mail import MailNotifier, VALID_EMAIL
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from positronic.brain.config import BrainConfig
+from positronic.brain.mail import digest_message_formatter
+
+
+# Mail queues by their settings, see get_mail_queue().
+MAIL_QUEUES = {}
+
+# Messages are rendered here, since formatters read logs from disk.
+RENDER_POOL = ThreadPool(minthreads=0, maxthreads=2, name='mail-render')
+
+
+class MailQueueFull(Exception):
+    """Raised when a message is dropped because too many messages are waiting to be delivered."""
+
+
+class MailQueue(object):
+    """Delivers emails through a small pool of persistent SMTP connections.
+
+    Messages wait in a bounded queue and are delivered by at most `max_connections` threads, each
+    reusing an already open SMTP connection when possible. Failed deliveries are retried with an
+    exponential backoff.
+
+    Arguments:
+
+    - relayhost: The SMTP server used to send emails.
+    - port: The port of the SMTP server.
+    - use_tls: Whether to use STARTTLS.
+    - user: The user name used to authenticate with the SMTP server, if any.
+    - password: The password used to authenticate with the SMTP server.
+    - max_connections: The maximum number of SMTP connections open at the same time.
+    - max_queue: The maximum number of messages waiting to be delivered. Further messages are
+      dropped.
+    - max_retries: How many times the delivery of a message is retried before giving up.
+    - backoff: The time in seconds before the first retry. It doubles at each further retry.
+    - idle_timeout: The time in seconds after which idle connections are closed instead of reused.
+
+    """
+
+    def __init__(self, relayhost='localhost', port=25, use_tls=False, user=None, password=None,
+                 max_connections=2, max_queue=1000, max_retries=3, backoff=5, idle_timeout=60):
+        self.relayhost = relayhost
+        self.port = port
+        self.use_tls = use_tls
+        self.user = user
+        self.password = password
+        self.max_connections = max_connections
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+
+        self.pool = ThreadPool(minthreads=0, maxthreads=max_connections, name='mail-queue')
+        self.clock = reactor
+        self.sent = 0
+        self.failures = 0
+
+        # (sender, recipients, message, attempt, queue time, Deferred) for messages to deliver.
+        self._pending = deque()
+        # The number of deliveries in progress.
+        self._active = 0
+        # (connection, last use time) for idle SMTP connections. Only used by pool threads.
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        """The number of messages waiting to be delivered."""
+        return len(self._pending)
+
+    def send(self, sender, recipients, message):
+        """Queues a message for delivery.
+
+        Returns a Deferred which fires when the message has been delivered, or fails if it was
+        dropped or couldn't be delivered.
+        """
+        d = defer.Deferred()
+
+        if len(self._pending) >= self.max_queue:
+            MetricCountEvent.log('positronic.mail.dropped', 1)
+            d.errback(MailQueueFull('dropping mail to %s: too many messages queued' %
+                                    ', '.join(recipients)))
+            return d
+
+        self._pending.append((sender, recipients, message, 0, self.clock.seconds(), d))
+        self._maybe_send()
+
+        return d
+
+    def stop(self):
+        """Stops the delivery threads and closes idle connections."""
+        if self.pool.started:
+            self.pool.stop()
+
+        while self._connections:
+            self._close(self._connections.pop()[0])
+
+    def _maybe_send(self):
+        while self._pending and self._active < self.max_connections:
+            item = self._pending.popleft()
+            sender, recipients, message, _, queued, _ = item
+
+            self._active += 1
+            MetricTimeEvent.log('positronic.mail.queue_latency', self.clock.seconds() - queued)
+
+            d = self._defer(self._deliver, sender, recipients, message)
+            d.addBoth(self._delivered, item)
+
+        self._report()
+
+    def _delivered(self, result, item):
+        sender, recipients, message, attempt, queued, d = item
+        self._active -= 1
+
+        if not isinstance(result, Failure):
+            self.sent += 1
+            d.callback(result)
+        elif attempt < self.max_retries:
+            MetricCountEvent.log('positronic.mail.retries', 1)
+            log.msg('mail to %s failed (%s), retrying' % (', '.join(recipients), result.value))
+
+            self.clock.callLater(self.backoff * 2 ** attempt, self._retry,
+                                 (sender, recipients, message, attempt + 1, queued, d))
+        else:
+            self.failures += 1
+            MetricCountEvent.log('positronic.mail.failures', 1)
+            d.errback(result)
+
+        self._maybe_send()
+
+    def _retry(self, item):
+        # Retries don't count against the size of the queue, since they were already accepted.
+        self._pending.appendleft(item)
+        self._maybe_send()
+
+    def _report(self):
+        MetricCountEvent.log('positronic.mail.queue_depth', self.queue_depth, absolute=True)
+
+    def _defer(self, fn, *args):
+        if not self.pool.started:
+            self.pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+        return threads.deferToThreadPool(reactor, self.pool, fn, *args)
+
+    def _deliver(self, sender, recipients, message):
+        """Sends a message, reusing an idle connection if possible. Runs in a pool thread."""
+        smtp = self._acquire()
+
+        try:
+            try:
+                refused = smtp.sendmail(sender, recipients, message)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                # The server may have closed an idle connection: try again once with a new one.
+                self._close(smtp)
+                smtp = self._connect()
+                refused = smtp.sendmail(sender, recipients, message)
+        except Exception:
+            self._close(smtp)
+            raise
+
+        self._release(smtp)
+
+        return refused
+
+    def _acquire(self):
+        now = time.time()
+
+        with self._lock:
+            while self._connections:
+                smtp, last_used = self._connections.pop()
+
+                if now - last_used < self.idle_timeout:
+                    return smtp
+
+                self._close(smtp)
+
+        return self._connect()
+
+    def _release(self, smtp):
+        with self._lock:
+            self._connections.append((smtp, time.time()))
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.relayhost, self.port)
+
+        if self.use_tls:
+            smtp.starttls()
+
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+
+        return smtp
+
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            smtp.close()
+
+
+class AsyncMailNotifier(MailNotifier):
+    """A MailNotifier which renders messages in a pool of threads and delivers them through the mail
+    queue returned by get_mail_queue().
+
+    It accepts the same arguments as MailNotifier, except for SMTP settings, which are configured
+    with `smtp()`. Messages are built like MailNotifier does, except that the rendered messages and
+    the recipients are passed along with each message, so that messages sent at the same time don't
+    mix up.
+    """
+
+    def buildMessage(self, name, builds, results):
+        d = self._defer_timed(self._render, builds)
+        d.addCallback(self._build_rendered_message, name, builds, results)
+        d.addErrback(log.err, 'failed to send mail for %s' % name)
+
+        return d
+
+    def extra_recipients(self, builds):
+        """Returns the recipients of the email about the given builds, besides interested users."""
+        return self.extraRecipients
+
+    def sendMessage(self, m, recipients):
+        return get_mail_queue().send(self.fromaddr, recipients, m.as_string())
+
+    def _render(self, builds):
+        """Renders the messages of the given builds. Runs in a pool thread."""
+        return [MailNotifier.buildMessageDict(self, b.getBuilder().name, b, b.results)
+                for b in builds]
+
+    def _build_rendered_message(self, msgdicts, name, builds, results):
+        # As in MailNotifier.buildMessage(), from messages rendered beforehand.
+        patches = []
+        logs = []
+        msgdict = {'body': ''}
+
+        for build, rendered in zip(builds, msgdicts):
+            if self.addPatch:
+                patches.extend(ss.patch for ss in build.getSourceStamps() if ss.patch)
+
+            if self.addLogs:
+                logs.extend(build.getLogs())
+
+            msgdict['body'] += rendered['body'] + '\n\n'
+            msgdict['type'] = rendered['type']
+
+            if 'subject' in rendered:
+                msgdict['subject'] = rendered['subject']
+
+        extra_recipients = self.extra_recipients(builds)
+
+        d = defer.maybeDeferred(self.createEmail, msgdict, name, self.master_status.getTitle(),
+                                results, builds, patches, logs)
+        d.addCallback(self._find_recipients, builds, extra_recipients)
+
+        return d
+
+    def _find_recipients(self, m, builds, extra_recipients):
+        if self.sendToInterestedUsers:
+            d = defer.gatherResults([self.useLookup(b) if self.lookup else self.useUsers(b)
+                                     for b in builds])
+        else:
+            d = defer.succeed([])
+
+        d.addCallback(self._send_to_recipients, m, extra_recipients)
+
+        return d
+
+    def _send_to_recipients(self, rlist, m, extra_recipients):
+        # As in MailNotifier._gotRecipients(), with the given extra recipients.
+        to_recipients = set()
+        cc_recipients = set()
+
+        for r in sum(rlist, []):
+            # The lookup didn't like this address.
+            if r is None:
+                continue
+
+            # Git can give emails like 'User' <user@foo.com>@foo.com.
+            if r.count('@') > 1:
+                r = r[:r.rindex('@')]
+
+            if VALID_EMAIL.search(r):
+                to_recipients.add(r)
+            else:
+                log.msg('invalid email: %r' % (r,))
+
+        # Interested users can tell from the CC list whether others were notified as well.
+        if self.sendToInterestedUsers and to_recipients:
+            cc_recipients.update(extra_recipients)
+        else:
+            to_recipients.update(extra_recipients)
+
+        m['To'] = ', '.join(sorted(to_recipients))
+
+        if cc_recipients:
+            m['CC'] = ', '.join(sorted(cc_recipients))
+
+        return self.sendMessage(m, list(to_recipients | cc_recipients))
+
+    def _defer(self, fn, *args):
+        if not RENDER_POOL.started:
+            RENDER_POOL.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', RENDER_POOL.stop)
+
+        return threads.deferToThreadPool(reactor, RENDER_POOL, fn, *args)
+
+    def _defer_timed(self, fn, *args):
+        """Renders with `fn` in a pool thread, logging the time taken from the reactor thread."""
+        d = self._defer(timed, fn, *args)
+        d.addCallback(self._log_render_time)
+
+        return d
+
+    def _log_render_time(self, timing):
+        # Metrics are not thread safe.
+        result, elapsed = timing
+        MetricTimeEvent.log('positronic.mail.render_time', elapsed)
+
+        return result
+
+
+class MailDigest(object):
+    """Collects the results of builds to send them as a single summary email.
+
+    Arguments:
+
+    - interval: The maximum time in seconds between a build and the email reporting it.
+    - max_builds: The maximum number of builds in a single email. When reached, the email is sent
+      right away.
+    - immediate_failures: Also send the usual email for each failed build, as soon as it finishes.
+
+    """
+
+    def __init__(self, interval=3600, max_builds=100, immediate_failures=True):
+        self.interval = interval
+        self.max_builds = max_builds
+        self.immediate_failures = immediate_failures
+
+        # Summaries of the builds to report.
+        self.builds = []
+        # The delayed call sending the next email, if any.
+        self.timer = None
+
+
+class MailRoute(object):
+    """The recipients of the emails about a set of builders.
+
+    Arguments:
+
+    - recipients: The email addresses receiving the emails.
+    - mode: The results of the builds reported, as in MailNotifier.
+    - digest: A MailDigest, to send summaries instead of an email for each build.
+
+    """
+
+    def __init__(self, recipients, mode, digest=None):
+        self.recipients = tuple(recipients)
+        self.mode = frozenset(mode)
+        self.digest = digest
+
+    def is_immediate(self, results):
+        """Whether builds with the given results should be reported as soon as they finish."""
+        return (self.digest is None or
+                (self.digest.immediate_failures and results in (FAILURE, EXCEPTION)))
+
+
+class RoutedMailNotifier(AsyncMailNotifier):
+    """A single notifier which sends the emails of all builders, according to a routing table.
+
+    Routes are added with add_route(). When a build finishes, its message is rendered once and sent
+    to the recipients of all matching routes, each one receiving it only once. Routes with a digest
+    receive periodic summaries instead. It accepts the same arguments as AsyncMailNotifier, except
+    for those selecting builds and recipients.
+    """
+
+    def __init__(self, **kwargs):
+        AsyncMailNotifier.__init__(self, mode='all', sendToInterestedUsers=False, **kwargs)
+
+        # Builder name -> routes for that builder.
+        self.routes = {}
+        # Routes matching all builders.
+        self.global_routes = []
+        self.clock = reactor
+
+    def add_route(self, recipients, builders=None, mode='all', digest=None):
+        """Sends emails about the given builders to the given recipients.
+
+        Returns the new MailRoute.
+
+        Arguments:
+
+        - recipients: The email addresses receiving the emails.
+        - builders: The names of the builders of interest, or None for all builders.
+        - mode: When to send emails, as in MailNotifier: 'all' or a list of 'change', 'failing',
+          'passing', 'problem', 'warnings' and 'exception'.
+        - digest: A MailDigest, to send summaries instead of an email for each build.
+
+        """
+        for r in recipients:
+            if not VALID_EMAIL.search(r):
+                config.error('recipient %r is not a valid email' % (r,))
+
+        if mode == 'all':
+            mode = ('failing', 'passing', 'warnings', 'exception')
+
+        for m in mode:
+            if m not in self.possible_modes:
+                config.error('mode %s is not a valid mode' % (m,))
+
+        route = MailRoute(recipients, mode, digest)
+
+        if builders is None:
+            self.global_routes.append(route)
+        else:
+            for name in builders:
+                self.routes.setdefault(name, []).append(route)
+
+        return route
+
+    def matching_routes(self, build, results):
+        """Returns the routes which should report a finished build."""
+        previous = []
+
+        for route in self.routes.get(build.getBuilder().name, []) + self.global_routes:
+            # Loading the previous build may hit the disk, so do it only when needed.
+            if not previous and route.mode & set(['change', 'problem']):
+                previous.append(self.getPreviousBuild(build))
+
+            if self._is_needed(route.mode, results, previous[0] if previous else None):
+                yield route
+
+    def recipients(self, build, results):
+        """Returns the sorted list of recipients of the email about a finished build."""
+        recipients = set()
+
+        for route in self.matching_routes(build, results):
+            if route.is_immediate(results):
+                recipients.update(route.recipients)
+
+        return sorted(recipients)
+
+    def extra_recipients(self, builds):
+        recipients = set()
+
+        for b in builds:
+            recipients.update(self.recipients(b, b.results))
+
+        return sorted(recipients)
+
+    def isMailNeeded(self, build, results):
+        return bool(self.recipients(build, results))
+
+    def buildFinished(self, name, build, results):
+        for route in self.matching_routes(build, results):
+            if route.digest is not None:
+                self._add_to_digest(route, build, results)
+
+        return AsyncMailNotifier.buildFinished(self, name, build, results)
+
+    def stopService(self):
+        # Don't lose the builds waiting in digests.
+        flushed = [self.flush_digest(route)
+                   for route in set(sum(self.routes.values(), self.global_routes))
+                   if route.digest is not None and route.digest.builds]
+
+        d = defer.gatherResults(flushed)
+        d.addCallback(lambda _: AsyncMailNotifier.stopService(self))
+
+        return d
+
+    def flush_digest(self, route):
+        """Sends the summary of the builds collected by the digest of a route.
+
+        Returns a Deferred which fires when the email has been sent.
+        """
+        digest = route.digest
+
+        if digest.timer is not None and digest.timer.active():
+            digest.timer.cancel()
+
+        builds, digest.builds, digest.timer = digest.builds, [], None
+        title = self.master_status.getTitle()
+
+        d = self._defer_timed(digest_message_formatter, title, builds)
+        d.addCallback(self.createEmail, '', title, FAILURE if any(
+            b['result'] in ('failure', 'exception') for b in builds) else SUCCESS)
+        d.addCallback(self._send_digest, route)
+        d.addErrback(log.err, 'failed to send mail digest')
+
+        return d
+
+    def _add_to_digest(self, route, build, results):
+        digest = route.digest
+        finished = build.getTimes()[1]
+
+        digest.builds.append({
+            'builder': build.getBuilder().name,
+            'finished': datetime.datetime.fromtimestamp(finished).ctime() if finished else '',
+            'number': build.getNumber(),
+            'reason': build.getReason(),
+            'result': Results[results],
+            'url': self.master_status.getURLForThing(build),
+            'worker': build.getSlavename(),
+        })
+
+        if len(digest.builds) >= digest.max_builds:
+            self.flush_digest(route)
+        elif digest.timer is None:
+            digest.timer = self.clock.callLater(digest.interval, self.flush_digest, route)
+
+    def _send_digest(self, m, route):
+        m['To'] = ', '.join(route.recipients)
+        return self.sendMessage(m, list(route.recipients))
+
+    def _is_needed(self, mode, results, previous):
+        previous_results = previous.getResults() if previous else None
+
+        return bool(('change' in mode and previous and previous_results != results) or
+                    ('failing' in mode and results == FAILURE) or
+                    ('passing' in mode and results == SUCCESS) or
+                    ('problem' in mode and results == FAILURE and previous and
+                     previous_results != FAILURE) or
+                    ('warnings' in mode and results == WARNINGS) or
+                    ('exception' in mode and results == EXCEPTION))
+
+
+def timed(fn, *args):
+    """Calls a function, returning its result and the time it took in seconds."""
+    start = time.time()
+    result = fn(*args)
+
+    return result, time.time() - start
+
+
+def get_mail_queue():
+    """Returns the mail queue for the current SMTP settings.
+
+    Queues are created lazily and then kept in memory for the lifetime of the master, so that their
+    connections are reused across builds.
+    """
+    settings = BrainConfig['smtp']
+    key = tuple(sorted(settings.items()))
+
+    if key not in MAIL_QUEUES:
+        MAIL_QUEUES[key] = MailQueue(**settings)
+
+    return MAIL_QUEUES[key]
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the build step running a group of commands concurrently on a worker, used by
+`FreestyleJob.parallel()`.
+"""
+
+import json
+import os.path
+
+from buildbot import config
+from buildbot.process.buildstep import BuildStep, BuildStepFailed, RemoteShellCommand
+from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, worst_status
+
+from positronic.brain.transfer import WORKER_BOOTSTRAP, worker_script
+
+# Where workers write the output of each command, relative to the working directory.
+LOG_DIR = os.path.join('..', 'parallel-logs')
+
+# The flags of each command, defaulting to those of BuildStep (see `monkeypatch.patch_build_step`).
+COMMAND_FLAGS = ('haltOnFailure', 'flunkOnFailure', 'warnOnFailure')
+
+
+class ParallelCommands(BuildStep):
+    """Runs several commands at once on a worker, each with its own log.
+
+    The output of each command goes to a log named after it, while the 'stdio' log tells when each
+    command started and finished. Running commands requires a Python interpreter on the worker (see
+    the 'worker_python' property).
+
+    The result of the step combines those of its commands as if they were separate steps: a failing
+    command fails the step if its flunkOnFailure flag is set, or else makes it a warning if its
+    warnOnFailure flag is set. If a command failing the step also has haltOnFailure set, commands
+    which haven't started yet are skipped, and so are the following steps of the build.
+
+    Arguments:
+
+    - commands: A list of dictionaries with the 'command' to run (a list of arguments), its 'env'
+      and optionally its 'name' and flags ('haltOnFailure', 'flunkOnFailure', 'warnOnFailure').
+    - limit: How many commands can run at the same time, or None to run all of them at once.
+    - workdir: Where commands are run, relative to the build directory.
+
+    """
+
+    name = 'parallel'
+
+    renderables = ['commands']
+
+    def __init__(self, commands, limit=None, workdir=None, **kwargs):
+        BuildStep.__init__(self, **kwargs)
+
+        if limit is not None and limit < 1:
+            config.error("'limit' must be at least 1, got %r" % (limit,))
+
+        self.commands = []
+        names = set()
+
+        for command in commands:
+            command = dict(command)
+            command.setdefault('env', {})
+
+            for flag in COMMAND_FLAGS:
+                command.setdefault(flag, getattr(BuildStep, flag))
+
+            name = command.get('name') or ' '.join(str(a) for a in command['command'])[:50]
+            command['name'] = unique_name(name, names)
+            names.add(command['name'])
+
+            self.commands.append(command)
+
+        self.limit = limit
+        self.workdir = workdir
+        self.cmd = None
+
+    def setDefaultWorkdir(self, workdir):
+        if self.workdir is None:
+            self.workdir = workdir
+
+    def start(self):
+        self.step_status.setText(['running', '%d commands' % len(self.commands)])
+
+        logfiles = {}
+        remote_commands = []
+
+        for i, command in enumerate(self.commands):
+            logfiles[command['name']] = os.path.join(LOG_DIR, '%d.log' % i)
+            remote_commands.append({
+                'command': command['command'],
+                'env': command['env'],
+                'log': logfiles[command['name']],
+                'halt': command['haltOnFailure'] and command['flunkOnFailure'],
+            })
+
+        self.cmd = RemoteShellCommand(
+            workdir=self.workdir,
+            command=[self.getProperty('worker_python', 'python'), '-c', WORKER_BOOTSTRAP],
+            initialStdin=worker_script('parallel.py', 'run_parallel', remote_commands, self.limit),
+            logfiles=logfiles,
+            collectStdout=True,
+            logEnviron=False)
+        self.cmd.useLog(self.addLog('stdio'), False)
+
+        for command in self.commands:
+            self.cmd.useLog(self.addLog(command['name']), True)
+
+        d = self.runCommand(self.cmd)
+
+        @d.addCallback
+        def check(_):
+            if self.cmd.didFail():
+                raise BuildStepFailed()
+
+            try:
+                return json.loads(self.cmd.stdout.strip().splitlines()[-1])
+            except (IndexError, ValueError):
+                raise BuildStepFailed()
+
+        d.addCallback(self.evaluate)
+        d.addCallback(self.finished)
+        d.addErrback(self.failed)
+
+    def evaluate(self, results):
+        """Returns the result of the step given the exit codes of its commands."""
+        result = SUCCESS
+        passed = 0
+        skipped = 0
+
+        # The flags of the step as a whole decide how the build goes on.
+        self.flunkOnFailure = True
+        self.warnOnFailure = False
+        self.warnOnWarnings = True
+        self.flunkOnWarnings = False
+        self.haltOnFailure = False
+
+        for command, outcome in zip(self.commands, results):
+            if outcome['rc'] is None:
+                skipped += 1
+                continue
+
+            if outcome['rc'] == 0:
+                passed += 1
+                continue
+
+            if command['flunkOnFailure']:
+                result = worst_status(result, FAILURE)
+                self.haltOnFailure = self.haltOnFailure or command['haltOnFailure']
+            elif command['warnOnFailure']:
+                result = worst_status(result, WARNINGS)
+
+        text = ['%d/%d commands passed' % (passed, len(self.commands))]
+
+        if skipped:
+            text.append('%d skipped' % skipped)
+
+        self.step_status.setText(text)
+
+        return result
+
+    def interrupt(self, reason):
+        BuildStep.interrupt(self, reason)
+
+        if self.cmd:
+            return self.cmd.interrupt(reason)
+
+
+def unique_name(name, names):
+    """Returns name, or name followed by a number if it's already in names."""
+    unique = name
+    n = 2
+
+    while unique in names:
+        unique = '%s (%d)' % (name, n)
+        n += 1
+
+    return unique
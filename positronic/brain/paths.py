@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains a matcher to select changes by the paths of their files.
+"""
+
+import fnmatch
+import posixpath
+import re
+
+
+# Characters making a path component a glob pattern.
+GLOB_CHARS = re.compile(r'[*?[]')
+
+# Matches any number of path components, followed by a separator.
+ANY_DIRECTORIES = r'(?:[^/]+/)*'
+
+
+class PathNode(object):
+    """A node of a trie of path patterns, each node matching a path component.
+
+    Arguments:
+
+    - terminal: Whether a pattern ends at this node.
+
+    """
+
+    __slots__ = ('children', 'globs', 'recursive', 'terminal', 'values')
+
+    def __init__(self, terminal=False):
+        # Literal component -> node.
+        self.children = {}
+        # Glob component -> node.
+        self.globs = {}
+        # The node following a '**' component, which matches any number of components.
+        self.recursive = None
+        self.terminal = terminal
+        # The values associated to the patterns ending here, see PathIndex.
+        self.values = set()
+
+    def add(self, parts, value=None):
+        """Adds the pattern made of the given components, optionally associated to a value."""
+        node = self
+
+        for part in parts:
+            if part == '**':
+                if node.recursive is None:
+                    node.recursive = PathNode()
+                node = node.recursive
+            elif GLOB_CHARS.search(part):
+                node = node.globs.setdefault(part, PathNode())
+            else:
+                node = node.children.setdefault(part, PathNode())
+
+        node.terminal = True
+
+        if value is not None:
+            node.values.add(value)
+
+    def collect(self, parts, found):
+        """Adds to `found` the values of all patterns matching the path made of `parts`, or one of
+        its parent directories."""
+        stack = [(self, 0)]
+        seen = set()
+
+        while stack:
+            node, i = stack.pop()
+            found.update(node.values)
+
+            # As in regex(), '**' is followed by at least one component.
+            if node.recursive is not None:
+                for j in xrange(i, len(parts)):
+                    if (node.recursive, j) not in seen:
+                        seen.add((node.recursive, j))
+                        stack.append((node.recursive, j))
+
+            if i == len(parts):
+                continue
+
+            child = node.children.get(parts[i])
+
+            if child is not None:
+                stack.append((child, i + 1))
+
+            for part, child in node.globs.iteritems():
+                if fnmatch.fnmatchcase(parts[i], part):
+                    stack.append((child, i + 1))
+
+    def regex(self):
+        """Returns a regular expression matching paths, starting at a component boundary, which are
+        matched by the patterns below this node or are inside a directory matched by them.
+
+        The expression follows the structure of the trie: each literal component is compared at
+        most once, so matching a path costs time proportional to its depth.
+        """
+        if self.terminal:
+            return ''
+
+        alternatives = [re.escape(part) + child.tail() for part, child in
+                        sorted(self.children.items())]
+        alternatives += [glob_regex(part) + child.tail() for part, child in
+                         sorted(self.globs.items())]
+
+        if self.recursive is not None:
+            alternatives.append(ANY_DIRECTORIES + self.recursive.regex())
+
+        if not alternatives:
+            # Nothing can match.
+            return '(?!)'
+
+        return '(?:%s)' % '|'.join(alternatives)
+
+    def tail(self):
+        # What follows a component matching this node.
+        return r'(?:/|\Z)' if self.terminal else '/' + self.regex()
+
+    def is_empty(self):
+        return not (self.terminal or self.children or self.globs or self.recursive)
+
+
+class PathMatcher(object):
+    """Matches file paths against a list of patterns.
+
+    A pattern matches a path if it matches the path itself or one of its parent directories, so a
+    directory name matches all files inside it. Path components may be glob patterns (e.g.
+    'src/*/tests' or '*.py'), and '**' matches any number of directories (e.g. 'src/**/*.h').
+    Patterns starting with '!' exclude the paths they match. If there are only exclusions, any
+    other path matches.
+
+    Patterns are compiled once into a trie, which is then turned into a regular expression sharing
+    common prefixes, so matching a path costs time proportional to its depth rather than to the
+    number of patterns. Instances can be used as `filter_fn` of a ChangeFilter, matching changes
+    with at least one matching file.
+
+    Arguments:
+
+    - patterns: A list of path patterns.
+
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+        include = PathNode()
+        exclude = PathNode()
+
+        for pattern in self.patterns:
+            if pattern.startswith('!'):
+                exclude.add(split_path(pattern[1:]))
+            else:
+                include.add(split_path(pattern))
+
+        # With only exclusions, everything else is included.
+        if include.is_empty():
+            include.terminal = True
+
+        self.include = re.compile(include.regex()).match
+        self.exclude = None if exclude.is_empty() else re.compile(exclude.regex()).match
+
+    def matches(self, path):
+        """Returns whether a file path matches."""
+        path = normalize_path(path)
+
+        return bool(self.include(path)) and not (self.exclude and self.exclude(path))
+
+    def __call__(self, change):
+        # This runs for each file of each change, so avoid all calls we can.
+        include = self.include
+        exclude = self.exclude
+
+        for path in change.files:
+            path = normalize_path(path)
+
+            if include(path) and not (exclude and exclude(path)):
+                return True
+
+        return False
+
+
+class PathIndex(object):
+    """Finds which of many sets of path patterns match a list of paths.
+
+    Each set of patterns, associated to a value, follows the rules of PathMatcher. All of them are
+    stored in the same trie, so the cost of a lookup depends on the number and depth of the paths,
+    not on the number of pattern sets.
+    """
+
+    def __init__(self):
+        self.include = PathNode()
+        self.exclude = PathNode()
+        # Values whose patterns are all exclusions.
+        self.include_all = set()
+
+    def add(self, patterns, value):
+        """Associates the given patterns to a value."""
+        includes = [p for p in patterns if not p.startswith('!')]
+
+        for pattern in patterns:
+            if pattern.startswith('!'):
+                self.exclude.add(split_path(pattern[1:]), value)
+            else:
+                self.include.add(split_path(pattern), value)
+
+        if not includes:
+            self.include_all.add(value)
+
+    def lookup(self, paths):
+        """Returns the set of values whose patterns match at least one of the given paths."""
+        found = set()
+
+        for path in paths:
+            parts = split_path(path)
+            included = set(self.include_all)
+            excluded = set()
+
+            self.include.collect(parts, included)
+
+            if included - found:
+                self.exclude.collect(parts, excluded)
+                found.update(included - excluded)
+
+        return found
+
+
+def glob_regex(part):
+    """Translates a glob pattern for a single path component into a regular expression."""
+    regex = []
+    i = 0
+
+    while i < len(part):
+        c = part[i]
+        i += 1
+
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[':
+            # As in fnmatch, a ']' right after '[' or '[!' is part of the set.
+            end = i + 1 if part[i:i + 1] == '!' else i
+            end = part.find(']', end + 1 if part[end:end + 1] == ']' else end)
+
+            if end < 0:
+                regex.append(r'\[')
+            else:
+                chars = part[i:end].replace('\\', r'\\')
+                i = end + 1
+
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                elif chars.startswith('^'):
+                    chars = '\\' + chars
+
+                regex.append('[%s]' % chars)
+        else:
+            regex.append(re.escape(c))
+
+    return ''.join(regex)
+
+
+def normalize_path(path):
+    """Normalizes a repository path, removing leading and trailing slashes."""
+    # Paths from change sources are usually normalized already, and normpath() is slow.
+    if path.startswith(('/', '.')) or path.endswith('/') or '//' in path or '/.' in path:
+        path = posixpath.normpath(path.strip('/'))
+
+        if path == '.':
+            return ''
+
+    return path
+
+
+def split_path(path):
+    """Splits a repository path into its components, after normalizing it."""
+    path = normalize_path(path)
+
+    return path.split('/') if path else []
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the change source polling SVN repositories.
+"""
+
+import os.path
+from collections import OrderedDict
+from random import randrange
+
+from buildbot.changes.svnpoller import SVNPoller
+from twisted.internet import defer, reactor
+from twisted.python import log
+
+from positronic.brain.config import BrainConfig, BuildmasterConfig
+from positronic.brain.utils import hashify
+
+
+class SVNRepositoryPoller(SVNPoller):
+    """Polls all the watched branches of an SVN repository at once.
+
+    A single `svn log` of the repository URL fetches the history of all branches, which is then
+    split by branch: changes get the URL of their branch as repository, and paths relative to it.
+    Branches are registered with add_branch(); paths outside of them are ignored.
+
+    All revisions since the last poll are fetched, however many they are. The poll interval adapts
+    to the commit rate: it halves after a poll finding new revisions, and grows by half after a
+    poll finding none, always staying between `min_interval` and `max_interval`.
+
+    Once enable_push() is called the repository is not polled anymore: its post-commit hook sends
+    new revisions to the master instead (see `positronic.brain.status.web.svn_hook`).
+
+    Arguments:
+
+    - svnurl: The URL of the repository, or of the directory containing the branches.
+    - min_interval: The minimum time in seconds between polls.
+    - max_interval: The maximum time in seconds between polls.
+    - cachepath: A file where the last seen revision is stored, so that no change is missed across
+      restarts.
+
+    """
+
+    # The poll interval changes over time and split_file is a bound method.
+    compare_attrs = [a for a in SVNPoller.compare_attrs if a not in ('pollInterval', 'split_file')]
+    compare_attrs += ['branches', 'min_interval', 'max_interval', 'push']
+
+    # For tests.
+    _reactor = reactor
+
+    def __init__(self, svnurl, min_interval=60, max_interval=600, cachepath=None, **kwargs):
+        SVNPoller.__init__(self, svnurl, split_file=self.split_branch,
+                           pollInterval=min(max_interval, 300 + randrange(0, 60)),
+                           cachepath=cachepath, **kwargs)
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.branches = set()
+        self.push = False
+        self._timer = None
+        self._found = False
+
+    def add_branch(self, branch):
+        """Starts reporting changes made to a branch, given as a path relative to the URL."""
+        self.branches.add(branch.strip('/'))
+
+    def enable_push(self):
+        """Stops polling the repository, whose post-commit hook notifies the master instead."""
+        self.push = True
+
+    def split_branch(self, path):
+        """Returns the branch of a path, the path relative to it and the URL of the branch."""
+        parts = path.rstrip('/').split('/')
+
+        # The longest matching branch wins, in case branches are nested.
+        for i in xrange(len(parts), 0, -1):
+            branch = '/'.join(parts[:i])
+
+            if branch in self.branches:
+                return {
+                    'branch': branch,
+                    'path': '/'.join(parts[i:]) + ('/' if path.endswith('/') else ''),
+                    'repository': branch_url(self.svnurl, branch),
+                }
+
+        return None
+
+    def pushed_changes(self, root, revision, author, comments, files):
+        """Returns the changes made by a revision, as sent by the post-commit hook.
+
+        Arguments:
+
+        - root: The URL of the repository root.
+        - revision: The committed revision.
+        - author: The author of the revision.
+        - comments: The log message of the revision.
+        - files: The changed paths, relative to the repository root.
+
+        """
+        prefix = self.svnurl[len(root.rstrip('/')):].strip('/')
+        branches = OrderedDict()
+
+        for path in files:
+            if prefix:
+                if not path.startswith(prefix + '/'):
+                    continue
+
+                path = path[len(prefix) + 1:]
+
+            where = self.split_branch(path)
+
+            if where is not None:
+                branches.setdefault((where['branch'], where['repository']), []).append(
+                    where['path'])
+
+        return [
+            dict(author=author, comments=comments, files=paths, revision=revision, branch=branch,
+                 repository=repository)
+            for (branch, repository), paths in branches.iteritems()
+        ]
+
+    def get_logs(self, _):
+        args = ['log', '--xml', '--verbose', '--non-interactive']
+
+        if self.svnuser:
+            args.append('--username=%s' % self.svnuser)
+        if self.svnpasswd:
+            args.append('--password=%s' % self.svnpasswd)
+        if self.extra_args:
+            args.extend(self.extra_args)
+
+        # The first time we only need the last revision, after that we need all revisions since
+        # the last one we've seen.
+        if self.last_change is None:
+            args.append('--limit=1')
+        else:
+            args.append('--revision=HEAD:%d' % self.last_change)
+
+        args.append(self.svnurl)
+
+        return self.getProcessOutput(args)
+
+    def get_new_logentries(self, logentries):
+        new_logentries = SVNPoller.get_new_logentries(self, logentries)
+        self._found = bool(new_logentries)
+
+        return new_logentries
+
+    def startLoop(self):
+        if self.push:
+            log.msg('SVNRepositoryPoller: not polling %s, changes are pushed' % self.svnurl)
+            return
+
+        self._schedule()
+
+    def stopLoop(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+
+        self._timer = None
+
+    def _schedule(self):
+        self._timer = self._reactor.callLater(self.pollInterval, self._poll)
+
+    @defer.inlineCallbacks
+    def _poll(self):
+        self._found = False
+        yield self.doPoll()
+
+        if self._found:
+            self.pollInterval = max(self.min_interval, self.pollInterval / 2)
+        else:
+            self.pollInterval = min(self.max_interval, self.pollInterval * 3 / 2)
+
+        log.msg('SVNRepositoryPoller: next poll of %s in %d seconds' %
+                (self.svnurl, self.pollInterval))
+
+        # Unless we've been stopped in the meantime.
+        if self._timer is not None:
+            self._schedule()
+
+
+def branch_url(url, branch):
+    """Returns the URL of a branch of an SVN repository, as used by changes of its poller."""
+    return '%s/%s' % (url.rstrip('/'), branch.strip('/'))
+
+
+def get_svn_poller(url):
+    """Returns the poller of an SVN repository URL, adding it to the change sources if needed."""
+    url = url.rstrip('/')
+
+    for change_source in BuildmasterConfig['change_source']:
+        if isinstance(change_source, SVNRepositoryPoller) and change_source.svnurl == url:
+            return change_source
+
+    poller = SVNRepositoryPoller(
+        url, cachepath=os.path.join(BrainConfig['basedir'], 'svn-%s.rev' % hashify(url)))
+    BuildmasterConfig['change_source'].append(poller)
+
+    return poller
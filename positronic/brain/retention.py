@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the artifact retention engine, which decides which artifacts to remove from the
+master so that they don't fill up its disk.
+"""
+
+import heapq
+import os
+import threading
+import time
+from os import listdir
+from os.path import isdir, join
+
+from buildbot.status.results import SUCCESS, WARNINGS
+
+from positronic.brain.blobstore import BlobStore
+from positronic.brain.config import BrainConfig
+from positronic.brain.manifest import ArtifactManifest, manifest_path
+
+
+# Artifacts directory -> RetentionEngine
+RETENTION_ENGINES = {}
+
+
+class RetentionPolicy(object):
+    """Describes which artifacts to keep on the master.
+
+    Empty artifact directories are always removed. Policies which are set to None are disabled.
+
+    Sizes are disk usage: files hard linked by several builds, such as the unchanged files of delta
+    uploads or the artifacts of shards collected by their parent build, are counted once, and they
+    only count as freed when the last build linking them is removed (see DiskUsage).
+
+    Arguments:
+
+    - max_artifacts: The maximum number of builds to keep for each builder.
+    - max_bytes: The maximum size in bytes of all artifacts, across all builders.
+    - max_builder_bytes: The maximum size in bytes of all artifacts of a single builder.
+    - max_age: The maximum age in seconds of artifacts.
+    - keep_last_successful: Never remove the artifacts of the last successful build of a builder.
+    - evict: Which builds to remove first when over budget: either 'oldest' (by creation time) or
+      'lru' (least recently accessed).
+
+    """
+
+    def __init__(self, max_artifacts=5, max_bytes=None, max_builder_bytes=None, max_age=None,
+                 keep_last_successful=True, evict='oldest'):
+        assert max_artifacts is None or max_artifacts > 0
+        assert evict in ('oldest', 'lru')
+
+        self.max_artifacts = max_artifacts
+        self.max_bytes = max_bytes
+        self.max_builder_bytes = max_builder_bytes
+        self.max_age = max_age
+        self.keep_last_successful = keep_last_successful
+        self.evict = evict
+
+    def evictions(self, manifests, now):
+        """Returns a list of (manifest, build number) pairs of builds to remove.
+
+        Only the sizes recorded in the manifests are used, no file system walk is needed.
+        """
+        evicted = set()
+        # Running size accounting, updated as we pick builds to remove.
+        usage = DiskUsage(manifests)
+
+        def evict(m, n):
+            evicted.add((m, n))
+            usage.remove(m, n)
+
+        candidates = []
+
+        for m in manifests:
+            numbers = m.numbers()
+            protected = self._protected(m, numbers)
+            removable = [n for n in numbers if n not in protected]
+            too_many = set(numbers[:-self.max_artifacts]) if self.max_artifacts else set()
+
+            for n in removable:
+                if m[n]['empty'] or n in too_many:
+                    evict(m, n)
+                elif self.max_age is not None and m[n]['mtime'] < now - self.max_age:
+                    evict(m, n)
+
+            removable = [(self._key(m, n), n) for n in removable if (m, n) not in evicted]
+
+            if self.max_builder_bytes is not None:
+                removable.sort()
+
+                while removable and usage.builder_size(m) > self.max_builder_bytes:
+                    evict(m, removable.pop(0)[1])
+
+            candidates.extend((key, m.root, n, m) for key, n in removable)
+
+        if self.max_bytes is not None:
+            heapq.heapify(candidates)
+
+            while candidates and usage.size > self.max_bytes:
+                _, _, n, m = heapq.heappop(candidates)
+                evict(m, n)
+
+        return sorted(evicted, key=lambda e: (e[0].root, e[1]))
+
+    def _protected(self, manifest, numbers):
+        if not self.keep_last_successful:
+            return set()
+
+        for n in reversed(numbers):
+            # Builds which upload artifacts usually succeeded, since a failing step halts the build.
+            if not manifest[n]['empty'] and manifest[n].get('result', SUCCESS) in (SUCCESS, WARNINGS):
+                return set([n])
+
+        return set()
+
+    def _key(self, manifest, number):
+        if self.evict == 'lru':
+            try:
+                return os.stat(join(manifest.root, str(number))).st_atime
+            except OSError:
+                pass
+
+        return manifest[number]['mtime']
+
+
+class DiskUsage(object):
+    """Tracks the disk space used by builds, counting files shared by several builds once.
+
+    Files are identified by the inodes recorded in the manifests, so hard links count once whether
+    they are shared by builds of the same builder or of different ones. Builds recorded without
+    inodes count their whole size.
+
+    Arguments:
+
+    - manifests: The ArtifactManifest of each builder.
+
+    """
+
+    def __init__(self, manifests):
+        # Inode -> size, and how many builds link it overall and in each manifest.
+        self.inode_sizes = {}
+        self.refs = {}
+        self.builder_refs = {}
+
+        self.size = 0
+        self.builder_sizes = {}
+
+        for m in manifests:
+            self.builder_refs[m] = {}
+            self.builder_sizes[m] = 0
+
+            for n in m.numbers():
+                for inode, size in self._inodes(m, n).items():
+                    self.inode_sizes[inode] = size
+
+                    if not self.refs.get(inode):
+                        self.size += size
+
+                    if not self.builder_refs[m].get(inode):
+                        self.builder_sizes[m] += size
+
+                    self.refs[inode] = self.refs.get(inode, 0) + 1
+                    self.builder_refs[m][inode] = self.builder_refs[m].get(inode, 0) + 1
+
+    def builder_size(self, manifest):
+        """Returns the disk space used by the builds of a builder."""
+        return self.builder_sizes[manifest]
+
+    def remove(self, manifest, number):
+        """Accounts for the removal of a build."""
+        for inode in self._inodes(manifest, number):
+            self.refs[inode] -= 1
+            self.builder_refs[manifest][inode] -= 1
+
+            if not self.refs[inode]:
+                self.size -= self.inode_sizes[inode]
+
+            if not self.builder_refs[manifest][inode]:
+                self.builder_sizes[manifest] -= self.inode_sizes[inode]
+
+    def _inodes(self, manifest, number):
+        build = manifest[number]
+
+        if 'inodes' in build:
+            return build['inodes']
+
+        # A unique key standing for all files of the build.
+        return {'%s/%d' % (manifest.root, number): build['size']}
+
+
+class RetentionEngine(object):
+    """Enforces a retention policy on the artifacts of all builders stored in a directory.
+
+    Each builder is expected to store its artifacts in a sub-directory named after it, containing
+    one directory per build. Directories whose name starts with a dot are ignored.
+
+    Manifests are only accessed while holding `lock`: `run()` is meant to be called by the
+    artifact janitor, and other threads must use `hashes()` or hold the lock themselves, such as
+    while linking files into build directories.
+
+    Arguments:
+
+    - root: The directory containing the artifacts of all builders.
+    - policy: The RetentionPolicy to enforce.
+    - blobs: An optional BlobStore used to deduplicate artifacts.
+
+    """
+
+    def __init__(self, root, policy, blobs=None):
+        self.root = root
+        self.policy = policy
+        self.blobs = blobs
+        self.manifests = {}
+
+        self.lock = threading.RLock()
+
+        self._discovered = False
+        self._updates = []
+
+    @property
+    def size(self):
+        """The disk space in bytes used by all artifacts known to the engine."""
+        with self.lock:
+            return DiskUsage(self.manifests.values()).size
+
+    def manifest(self, builder):
+        if builder not in self.manifests:
+            builder_root = join(self.root, builder)
+            self.manifests[builder] = ArtifactManifest(
+                builder_root, manifest_path(builder_root), self.blobs)
+
+        return self.manifests[builder]
+
+    def record_result(self, builder, number, result):
+        """Records the result of a build, to be stored in its manifest at the next run.
+
+        This can be safely called while the engine is running.
+        """
+        self._updates.append((builder, 'set_result', (number, result)))
+
+    def record_hashes(self, builder, number, hashes):
+        """Records the hashes of the files of a build, to be stored in its manifest at the next run.
+
+        This can be safely called while the engine is running.
+        """
+        self._updates.append((builder, 'set_hashes', (number, hashes)))
+
+    def hashes(self, builder, number):
+        """Returns the hashes of the files of a build recorded in its manifest, if any.
+
+        The manifest is loaded from disk if needed. This blocks while the engine is running, so it
+        must not be called from the reactor thread.
+        """
+        # Hashes recorded since the last run are not in the manifest yet.
+        for update in reversed(list(self._updates)):
+            if update[:2] == (builder, 'set_hashes') and update[2][0] == number:
+                return update[2][1]
+
+        with self.lock:
+            manifest = self.manifest(builder)
+            manifest.refresh()
+
+            if number in manifest:
+                return manifest[number].get('hashes', {})
+
+            return {}
+
+    def run(self):
+        """Removes all artifacts which should not be kept according to the policy.
+
+        Returns the number of bytes freed.
+        """
+        with self.lock:
+            return self._run()
+
+    def _run(self):
+        if not self._discovered:
+            # Builders which haven't run since the master started still occupy disk space.
+            if isdir(self.root):
+                for builder in listdir(self.root):
+                    if not builder.startswith('.') and isdir(join(self.root, builder)):
+                        self.manifest(builder)
+
+            self._discovered = True
+
+        for builder in list(self.manifests):
+            self.manifests[builder].refresh()
+
+        while self._updates:
+            builder, method, args = self._updates.pop(0)
+            getattr(self.manifest(builder), method)(*args)
+
+        bytes_freed = 0
+        changed = set()
+
+        for m, n in self.policy.evictions(self.manifests.values(), time.time()):
+            bytes_freed += m.remove(n)
+            changed.add(m)
+
+        for m in self.manifests.values():
+            # Removing directories changed the root's modification time, resync to pick it up.
+            if m in changed:
+                m.sync()
+
+            m.save()
+
+        return bytes_freed
+
+
+def get_retention_engine():
+    """Returns the retention engine for the artifacts directory, configured with the current policy.
+
+    Engines are created lazily and then kept in memory for the lifetime of the master, so that they
+    don't have to rediscover builders and reload manifests.
+    """
+    root = BrainConfig['artifactsDir']
+
+    if root not in RETENTION_ENGINES:
+        blobs = BlobStore(join(root, '.blobs')) if BrainConfig['artifactsDedup'] else None
+        RETENTION_ENGINES[root] = RetentionEngine(root, BrainConfig['artifactRetention'], blobs)
+
+    engine = RETENTION_ENGINES[root]
+    engine.policy = BrainConfig['artifactRetention']
+
+    return engine
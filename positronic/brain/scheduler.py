@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the scheduler which starts builds when changes come in.
+"""
+
+from collections import defaultdict
+
+from buildbot import util
+from buildbot.process.buildrequest import BuildRequest
+from buildbot.process.metrics import MetricCountEvent, MetricTimeEvent
+from buildbot.schedulers.basic import BaseBasicScheduler
+from twisted.internet import defer
+from twisted.python import log
+
+from positronic.brain.artifact import has_reached_artifact_upload
+from positronic.brain.paths import PathIndex
+
+
+class Debounce(util.ComparableMixin):
+    """Decides how long to wait for more changes before starting a build.
+
+    A lone change is built after `min_delay` seconds. Each further change coming in before the
+    build starts doubles the delay, up to `max_delay`, so that bursts of commits are coalesced in a
+    single build. No change waits more than `max_wait` seconds, however many changes follow it.
+
+    Arguments:
+
+    - min_delay: The delay after the first change, in seconds.
+    - max_delay: The longest delay after any change, in seconds.
+    - max_wait: The longest time a change waits for its build to start, in seconds.
+
+    """
+
+    compare_attrs = ['min_delay', 'max_delay', 'max_wait']
+
+    def __init__(self, min_delay=5, max_delay=60, max_wait=300):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+
+    def delay(self, changes, waited):
+        """Returns the delay after the last one of `changes` changes, the first of which came in
+        `waited` seconds ago."""
+        delay = min(self.max_delay, self.min_delay * 2 ** (changes - 1))
+
+        return max(0, min(delay, self.max_wait - waited))
+
+
+class ChangeRouter(BaseBasicScheduler):
+    """A single scheduler starting the builders interested in each change.
+
+    Builders are routed changes coming from a given repository (see add_repository()) or touching
+    given paths (see add_paths()). Each change is classified once, looking up its repository and
+    paths in indexes, so the work done for a change doesn't depend on the number of builders. The
+last change built by each builder is kept in the scheduler state, so that changes still classified
+when the master restarts are only routed to the builders which haven't built them yet.
+
+    Builds start once no change came in for a while, as decided by a Debounce policy. Each builder
+    has its own timer and may have its own policy (see set_debounce()). Repositories may have a
+    shorter timer, for instance when their changes are pushed as soon as they are committed. When
+    a timer fires, changes from each repository and branch are built in a buildset of their own.
+
+    Builders may also drop their builds of older changes once a build of newer changes from the
+    same repository is requested (see set_cancel_superseded()).
+
+    Arguments:
+
+    - name: The name of the scheduler.
+    - treeStableTimer: The longest time to wait, in seconds, for more changes before starting a
+      build. Only used when `debounce` is not given.
+    - debounce: The Debounce policy of builders which don't have their own.
+
+    """
+
+    compare_attrs = BaseBasicScheduler.compare_attrs + (
+        'repositories', 'stable_timers', 'paths', 'debounce', 'builder_debounce',
+        'cancel_superseded')
+
+    def __init__(self, name, treeStableTimer=60, debounce=None, **kwargs):
+        BaseBasicScheduler.__init__(self, name=name, treeStableTimer=treeStableTimer,
+                                    builderNames=[], **kwargs)
+
+        self.debounce = debounce or Debounce(max_delay=treeStableTimer or 0)
+        # Builder name -> Debounce, if not the default one.
+        self.builder_debounce = {}
+        # Builder name -> whether running builds are interrupted as well as queued ones, for
+        # builders which cancel superseded builds.
+        self.cancel_superseded = {}
+
+        # Repository URL -> names of builders.
+        self.repositories = {}
+        # Repository URL -> tree stable timer of its changes, if not the default one.
+        self.stable_timers = {}
+        # Builder name -> path patterns.
+        self.paths = {}
+        self.path_index = PathIndex()
+
+        # Builder name -> ids of the changes which will be built when its timer fires, mapped to
+        # their repositories and branches.
+        self._pending = defaultdict(dict)
+        # Builder name -> when the first of its pending changes came in.
+        self._waiting_since = {}
+        # Builder name -> id of the last change it was started for.
+        self._last_built = {}
+
+    def add_repository(self, repository, builder, treeStableTimer=None):
+        """Starts a builder for all changes coming from a repository.
+
+        If `treeStableTimer` is given, builds for changes coming from the repository start at most
+        that many seconds after them, whatever the Debounce policy says.
+        """
+        self.repositories.setdefault(repository, set()).add(builder)
+        self._add_builder(builder)
+
+        if treeStableTimer is not None:
+            self.stable_timers[repository] = treeStableTimer
+
+    def add_paths(self, patterns, builder):
+        """Starts a builder for changes touching the given paths, as matched by PathMatcher."""
+        self.paths[builder] = self.paths.get(builder, ()) + tuple(patterns)
+        self.path_index.add(patterns, builder)
+        self._add_builder(builder)
+
+    def set_debounce(self, builder, debounce):
+        """Sets the Debounce policy of a builder."""
+        self.builder_debounce[builder] = debounce
+
+    def set_cancel_superseded(self, builder, running=False):
+        """Cancels queued builds of a builder which only carry changes older than a new build.
+
+        If `running` is true, running builds are interrupted as well, unless they have already
+        reached the artifact upload step.
+        """
+        self.cancel_superseded[builder] = running
+
+    def route(self, change):
+        """Returns the names of the builders interested in a change, which haven't built it yet."""
+        builders = set(self.repositories.get(change.repository, ()))
+
+        if self.paths:
+            builders.update(self.path_index.lookup(change.files))
+
+        return set(b for b in builders if change.number > self._last_built.get(b, 0))
+
+    def getChangeFilter(self, branch, branches, change_filter, categories):
+        # Changes are filtered by route().
+        return None
+
+    @util.deferredLocked('_stable_timers_lock')
+    @defer.inlineCallbacks
+    def gotChange(self, change, important):
+        builders = self.route(change)
+
+        if not builders:
+            return
+
+        # A single classification, regardless of how many builders are interested.
+        yield self.master.db.schedulers.classifyChanges(self.objectid, {change.number: important})
+
+        now = self._reactor.seconds()
+
+        for builder in builders:
+            self._pending[builder][change.number] = (change.repository, change.branch)
+            self._waiting_since.setdefault(builder, now)
+
+            if not important and not self._stable_timers[builder]:
+                continue
+
+            if self._stable_timers[builder]:
+                self._stable_timers[builder].cancel()
+
+            debounce = self.builder_debounce.get(builder, self.debounce)
+            delay = debounce.delay(len(self._pending[builder]), now - self._waiting_since[builder])
+
+            if change.repository in self.stable_timers:
+                delay = min(delay, self.stable_timers[change.repository])
+
+            self._stable_timers[builder] = self._reactor.callLater(delay, self._fire_timer, builder)
+
+    @defer.inlineCallbacks
+    def scanExistingClassifiedChanges(self):
+        last_built = yield self.getState('last_built', {})
+
+        for builder, changeid in last_built.iteritems():
+            self._last_built[builder] = max(changeid, self._last_built.get(builder, 0))
+
+        yield BaseBasicScheduler.scanExistingClassifiedChanges(self)
+
+    def _fire_timer(self, builder):
+        d = self.stableTimerFired(builder)
+        d.addErrback(log.err, 'while firing stable timer')
+
+    @util.deferredLocked('_stable_timers_lock')
+    @defer.inlineCallbacks
+    def stableTimerFired(self, builder):
+        # The service has been stopped.
+        if not self._stable_timers[builder]:
+            return
+
+        del self._stable_timers[builder]
+        changes = self._pending.pop(builder, {})
+        changeids = sorted(changes)
+        waiting_since = self._waiting_since.pop(builder, None)
+
+        if not changeids:
+            return
+
+        # BuildBot makes a single source stamp of all the changes of a codebase.
+        sources = defaultdict(list)
+
+        for changeid in changeids:
+            sources[changes[changeid]].append(changeid)
+
+        waited = self._reactor.seconds() - waiting_since
+        MetricTimeEvent.log('positronic.scheduler.wait_time', waited)
+        MetricCountEvent.log('positronic.scheduler.changes_coalesced',
+                             len(changeids) - len(sources))
+
+        for ids in sorted(sources.values()):
+            yield self.addBuildsetForChanges(reason='scheduler', changeids=ids,
+                                             builderNames=[builder])
+
+        self._last_built[builder] = changeids[-1]
+        yield self.setState('last_built', self._last_built)
+
+        if builder in self.cancel_superseded:
+            for source, ids in sources.iteritems():
+                d = self._cancel_superseded(builder, source, ids[0])
+                yield d.addErrback(log.err, 'while cancelling superseded builds')
+
+        # Classifications are needed until all builders interested in a change have been started.
+        pending = [min(ids) for ids in self._pending.values() if ids]
+        less_than = min(pending) if pending else changeids[-1] + 1
+
+        yield self.master.db.schedulers.flushChangeClassifications(self.objectid,
+                                                                   less_than=less_than)
+
+    @defer.inlineCallbacks
+    def _cancel_superseded(self, builder, source, changeid):
+        brdicts = yield self.master.db.buildrequests.getBuildRequests(buildername=builder,
+                                                                      claimed=False)
+
+        for brdict in brdicts:
+            request = yield BuildRequest.fromBrdict(self.master, brdict)
+
+            if is_superseded(request, source, changeid):
+                log.msg('ChangeRouter: cancelling superseded build request %d of %s' %
+                        (request.id, builder))
+                yield request.cancelBuildRequest()
+                MetricCountEvent.log('positronic.scheduler.requests_cancelled', 1)
+
+        if not self.cancel_superseded[builder]:
+            return
+
+        running = self.master.botmaster.builders.get(builder)
+
+        for build in list(running.building) if running else ():
+            if has_reached_artifact_upload(build):
+                continue
+
+            if all(is_superseded(r, source, changeid) for r in build.requests):
+                log.msg('ChangeRouter: interrupting superseded build of %s' % builder)
+                build.stopBuild('Superseded by a build of newer changes')
+                MetricCountEvent.log('positronic.scheduler.builds_interrupted', 1)
+
+    def getPendingBuildTimes(self):
+        return [timer.getTime() for timer in self._stable_timers.values()
+                if timer and timer.active()]
+
+    def _add_builder(self, builder):
+        if builder not in self.builderNames:
+            self.builderNames.append(builder)
+
+
+def is_superseded(request, source, changeid):
+    """Returns whether a build request only carries changes from the given (repository, branch)
+    source, older than the change with id `changeid`.
+
+    Requests without changes, such as forced builds, are never superseded.
+    """
+    sources = [s for s in request.sources.values() if s.changes]
+
+    return (bool(sources) and
+            all((s.repository, s.branch) == source for s in sources) and
+            all(c.number < changeid for s in sources for c in s.changes))
+
+
+def merge_requests(builder, req1, req2):
+    """A `mergeRequests` function merging queued build requests whose changes are compatible.
+
+    This is what BuildBot does by default: requests for the same repository and branch are merged
+    in a single build of all their changes. Merged requests are counted in the metrics.
+    """
+    if not req1.canBeMergedWith(req2):
+        return False
+
+    MetricCountEvent.log('positronic.scheduler.requests_merged', 1)
+
+    return True
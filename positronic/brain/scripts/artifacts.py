@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Helpers run on worker nodes to deal with artifacts.
+
+This script is sent to the worker's Python interpreter through its standard input, followed by a
+call to one of the functions below, so it MUST only depend on the standard library and work with
+both Python 2 and Python 3.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+
+def list_files(root, hashes=False):
+    """Writes to stdout a JSON object mapping each file in root to its size and modification time.
+
+    If hashes is true, the SHA-1 digest of each file is listed as well. Paths are relative to root
+    and always use forward slashes. Symbolic links are reported with a size of -1, so that they are
+    never considered unchanged.
+    """
+    files = {}
+
+    for dirpath, _, filenames in os.walk(root):
+        for f in filenames:
+            p = os.path.join(dirpath, f)
+            name = os.path.relpath(p, root).replace(os.sep, '/')
+
+            if os.path.islink(p):
+                files[name] = [-1, 0, '']
+            else:
+                st = os.stat(p)
+                files[name] = [st.st_size, int(st.st_mtime), file_digest(p) if hashes else '']
+
+    sys.stdout.write(json.dumps(files))
+
+
+def file_digest(p):
+    h = hashlib.sha1()
+
+    with open(p, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def stage(root, dest, files):
+    """Copies the given files from root to dest, preserving their modification time."""
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+
+    os.makedirs(dest)
+
+    for name in files:
+        src = os.path.join(root, *name.split('/'))
+        dst = os.path.join(dest, *name.split('/'))
+
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+
+        if os.path.islink(src):
+            # Python 2 doesn't support symbolic links on Windows, so targets are copied there.
+            if hasattr(os, 'symlink'):
+                os.symlink(os.readlink(src), dst)
+            else:
+                shutil.copy2(src, dst)
+
+            continue
+
+        try:
+            os.link(src, dst)
+        except (AttributeError, OSError):
+            shutil.copy2(src, dst)
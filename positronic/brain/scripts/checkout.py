@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Helpers run on worker nodes to check out sources.
+
+This script is sent to the worker's Python interpreter through its standard input, followed by a
+call to one of the functions below, so it MUST only depend on the standard library and work with
+both Python 2 and Python 3.
+"""
+
+import hashlib
+import json  # Used by the call appended to this script, see worker_script().
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def svn_shared(cache, url, revision, dest, link):
+    """Puts a revision of an SVN URL in dest, taking it from a cache shared by all builders.
+
+    The cache holds a working copy of each URL, which is updated to the requested revision (or
+    HEAD, if None) and then copied to dest, without its '.svn' directory. With link 'hardlink'
+    files are hard links to those of the cache, so builds MUST NOT modify them in place. With link
+    'copy' files are copied, using copy-on-write clones where the file system supports them.
+
+    Builds updating the cache at the same time are serialized with a lock, except on Windows.
+    """
+    if not os.path.isdir(cache):
+        os.makedirs(cache)
+
+    wc = os.path.join(cache, hashlib.sha1(url.encode('utf-8')).hexdigest())
+    rev = ['-r', revision] if revision else []
+
+    lock = open(wc + '.lock', 'a')
+
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        started = time.time()
+
+        if os.path.isdir(os.path.join(wc, '.svn')):
+            run(['svn', 'update', '--non-interactive'] + rev + [wc])
+        else:
+            run(['svn', 'checkout', '--non-interactive'] + rev + [url, wc])
+
+        sys.stdout.write('cache updated in %.1f seconds\n' % (time.time() - started))
+        started = time.time()
+
+        # Copying while holding the lock, so that no other build updates the cache meanwhile.
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+
+        copy_tree(wc, dest, link)
+
+        sys.stdout.write('%s copied in %.1f seconds\n' % (dest, time.time() - started))
+    finally:
+        lock.close()
+
+
+def copy_tree(src, dest, link):
+    """Copies a working copy to dest, except for its '.svn' directory.
+
+    Hard links and copy-on-write clones are made by GNU cp: without it, files are just copied.
+    """
+    if link == 'hardlink':
+        options = ['-al']
+    else:
+        options = ['-a', '--reflink=auto']
+
+    try:
+        copied = subprocess.call(['cp'] + options + [src, dest]) == 0
+    except OSError:
+        copied = False
+
+    if copied:
+        shutil.rmtree(os.path.join(dest, '.svn'), ignore_errors=True)
+        return
+
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+
+    shutil.copytree(src, dest, symlinks=True, ignore=shutil.ignore_patterns('.svn'))
+
+
+def git_reference(workdir, reference):
+    """Makes the git repository in workdir borrow objects from a reference repository.
+
+    The repository is created if needed, so that fetching into it only downloads the objects which
+    are missing from the reference repository.
+    """
+    if not os.path.isdir(os.path.join(workdir, '.git')):
+        run(['git', 'init', workdir])
+
+    objects = os.path.join(os.path.abspath(reference), '.git', 'objects')
+
+    if not os.path.isdir(objects):
+        objects = os.path.join(os.path.abspath(reference), 'objects')
+
+    with open(os.path.join(workdir, '.git', 'objects', 'info', 'alternates'), 'w') as f:
+        f.write(objects + '\n')
+
+
+def run(args):
+    """Runs a command, failing if it fails."""
+    sys.stdout.write(' '.join(args) + '\n')
+    sys.stdout.flush()
+
+    if subprocess.call(args) != 0:
+        sys.stderr.write('%s failed\n' % args[0])
+        sys.exit(1)
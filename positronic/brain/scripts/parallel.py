@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Helpers run on worker nodes to run several commands at once.
+
+This script is sent to the worker's Python interpreter through its standard input, followed by a
+call to one of the functions below, so it MUST only depend on the standard library and work with
+both Python 2 and Python 3.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+# How often to check whether commands have finished, in seconds.
+POLL_INTERVAL = 0.1
+
+
+def run_parallel(commands, limit):
+    """Runs commands concurrently, at most `limit` at a time (or all at once, if None).
+
+    Each command is a dictionary with its 'command' (a list of arguments), its 'env' (variables
+    added to the environment), the 'log' file receiving its output and whether it should 'halt'
+    the group if it fails: then commands which haven't started yet are skipped.
+
+    A line per command is written to stdout when it starts and finishes, followed by a JSON list
+    with the exit code and duration of each command, in the same order. Exit codes of skipped
+    commands are None.
+    """
+    pending = list(range(len(commands)))
+    running = {}
+    results = [{'rc': None, 'duration': 0} for _ in commands]
+    halted = False
+
+    while running or (pending and not halted):
+        while pending and not halted and (limit is None or len(running) < limit):
+            i = pending.pop(0)
+            running[i] = (start(commands[i]), time.time())
+            report('started %s' % ' '.join(commands[i]['command']))
+
+        time.sleep(POLL_INTERVAL)
+
+        for i, (process, started) in list(running.items()):
+            rc = process.poll()
+
+            if rc is None:
+                continue
+
+            del running[i]
+            process.log.close()
+            results[i] = {'rc': rc, 'duration': round(time.time() - started, 3)}
+            report('%s exited with %d after %.1f seconds' % (
+                ' '.join(commands[i]['command']), rc, results[i]['duration']))
+
+            if rc != 0 and commands[i]['halt'] and not halted:
+                halted = True
+
+                if pending:
+                    report('skipping %d commands' % len(pending))
+
+    sys.stdout.write(json.dumps(results) + '\n')
+
+
+def start(command):
+    """Starts a command, sending its output to its log file."""
+    env = dict(os.environ)
+    env.update((native(k), native(v)) for k, v in command['env'].items())
+
+    log_dir = os.path.dirname(command['log'])
+
+    if log_dir and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    log = open(command['log'], 'wb')
+
+    try:
+        process = subprocess.Popen([native(a) for a in command['command']], env=env,
+                                   stdin=open(os.devnull), stdout=log, stderr=subprocess.STDOUT)
+    except OSError as e:
+        log.write(('%s\n' % e).encode('utf-8'))
+        process = FailedProcess()
+
+    process.log = log
+
+    return process
+
+
+def report(message):
+    sys.stdout.write('[%s] %s\n' % (time.strftime('%H:%M:%S'), message))
+    sys.stdout.flush()
+
+
+def native(s):
+    """Returns a string as the native str type, as expected by subprocess."""
+    if sys.version_info[0] < 3 and type(s).__name__ == 'unicode':
+        return s.encode('utf-8')
+
+    return str(s)
+
+
+class FailedProcess(object):
+    """Stands for a command which could not be started."""
+
+    def poll(self):
+        return 127
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+SVN post-commit hook notifying a positronic brain of new revisions.
+
+Copy this script on the SVN server and call it from the `hooks/post-commit` script of the
+repository:
+
+    #!/bin/sh
+    python /path/to/svn_post_commit.py https://buildbot.example.com/ svn://svn.example.com/repo "$1" "$2"
+
+The first argument is the URL of the BuildBot master, the second one is the URL of the repository
+root, as seen by the master. The last two ones are the path of the repository on the server and
+the committed revision, as passed to post-commit hooks by SVN. Jobs watching the repository must
+enable push notifications (see `FreestyleJob.watch()`).
+
+This script is run on the SVN server, so it MUST only depend on the standard library and work with
+both Python 2 and Python 3.
+"""
+
+import json
+import subprocess
+import sys
+
+try:
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+except ImportError:
+    from urllib import urlencode
+    from urllib2 import urlopen
+
+# How long to wait for the master, in seconds. A slow master must not slow down commits.
+TIMEOUT = 10
+
+
+def svnlook(command, repos, revision):
+    """Returns the output of an svnlook subcommand for a revision."""
+    output = subprocess.check_output(['svnlook', command, '-r', revision, repos])
+
+    return output.decode('utf-8')
+
+
+def changed_paths(output):
+    """Returns the paths listed in the output of `svnlook changed`."""
+    # Each line is made of four status columns followed by the path.
+    return [line[4:] for line in output.splitlines() if line[4:]]
+
+
+def notify(master_url, repository, repos, revision):
+    """Sends a revision of a repository to the change hook of the master."""
+    data = urlencode({
+        'repository': repository.rstrip('/'),
+        'revision': revision,
+        'author': svnlook('author', repos, revision).strip(),
+        'comments': svnlook('log', repos, revision).strip(),
+        'files': json.dumps(changed_paths(svnlook('changed', repos, revision))),
+    })
+
+    url = master_url.rstrip('/') + '/change_hook/svn'
+    urlopen(url, data.encode('utf-8'), TIMEOUT).close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 5:
+        sys.stderr.write('usage: %s MASTER_URL REPOSITORY_URL REPOS REV\n' % sys.argv[0])
+        sys.exit(2)
+
+    try:
+        notify(*sys.argv[1:])
+    except Exception as e:
+        # SVN shows the output of failed post-commit hooks to the committer.
+        sys.stderr.write('Could not notify %s of revision %s: %s\n' % (sys.argv[1], sys.argv[4], e))
+        sys.exit(1)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+The 'svn' dialect of the web change hook, receiving revisions from the post-commit hook of SVN
+repositories (see `positronic/brain/scripts/svn_post_commit.py`).
+
+BuildBot only loads dialects from `buildbot.status.web.hooks`, where this module is installed by
+`positronic.brain.monkeypatch.patch_change_hooks()`.
+"""
+
+from buildbot.util import json
+
+from positronic.brain.poller import SVNRepositoryPoller
+
+
+def getChanges(request, options=None):
+    """Returns the changes made by the revision described by the request.
+
+    The request carries the URL of the repository root, the revision, its author and log message,
+    and a JSON list of the changed paths, relative to the repository root. Only pollers which have
+    push enabled are considered, so that no change is reported twice.
+    """
+    root = request_arg(request, 'repository')
+    revision = request_arg(request, 'revision')
+
+    if not root or not revision:
+        raise ValueError('Both repository and revision are required')
+
+    root = root.rstrip('/')
+    author = request_arg(request, 'author')
+    comments = request_arg(request, 'comments')
+    files = json.loads(request_arg(request, 'files') or '[]')
+
+    changes = []
+
+    for poller in request.site.buildbot_service.master.change_svc:
+        if not isinstance(poller, SVNRepositoryPoller) or not poller.push:
+            continue
+
+        if poller.svnurl == root or poller.svnurl.startswith(root + '/'):
+            changes.extend(poller.pushed_changes(root, revision, author, comments, files))
+
+    return changes, 'svn'
+
+
+def request_arg(request, name):
+    """Returns the first value of a request argument, or None if it is missing."""
+    values = request.args.get(name)
+
+    return values[0] if values else None
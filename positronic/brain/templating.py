@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the Jinja2 environment used to render emails, and helpers to share compiled
+templates across master restarts.
+"""
+
+import os
+import os.path
+
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+
+
+# The number of compiled templates kept in memory by each environment, least recently used first
+# to go.
+TEMPLATES_CACHE_SIZE = 100
+
+# Templates never change while the master runs, so we don't check their modification time each
+# time they are used.
+TEMPLATES_ENV = Environment(loader=PackageLoader('positronic.brain', 'templates'),
+                            cache_size=TEMPLATES_CACHE_SIZE,
+                            auto_reload=False)
+
+
+def setup_templates(basedir):
+    """Stores the bytecode of compiled templates in the master's base directory and compiles all
+    email templates.
+
+    Compiled templates are kept on disk, so that restarts and reconfigurations only load them
+    instead of parsing and compiling them again.
+    """
+    path = os.path.join(basedir, 'templates_cache')
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    # Templates already in memory were compiled without a bytecode cache and would never be stored.
+    TEMPLATES_ENV.bytecode_cache = FileSystemBytecodeCache(path)
+    TEMPLATES_ENV.cache.clear()
+    precompile(TEMPLATES_ENV)
+
+
+def precompile(env):
+    """Compiles all templates of a Jinja2 environment, returning their number."""
+    names = env.list_templates()
+
+    for name in names:
+        env.get_template(name)
+
+    return len(names)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+
+from positronic.brain.blobstore import BlobStore, file_digest
+from positronic.brain.manifest import ArtifactManifest
+
+
+def test_ingest_links_identical_files(tmpdir):
+    store = BlobStore(str(tmpdir.join('.blobs')))
+
+    build1 = create_files(str(tmpdir.join('1')), {'a': 'same', 'b': 'different 1'})
+    build2 = create_files(str(tmpdir.join('2')), {'a': 'same', 'b': 'different 2'})
+
+    digests1, linked_size1 = store.ingest(build1)
+    digests2, linked_size2 = store.ingest(build2)
+
+    assert len(digests1) == len(digests2) == 2
+    assert linked_size1 == linked_size2 == 15
+    assert os.path.samefile(os.path.join(build1, 'a'), os.path.join(build2, 'a'))
+    assert not os.path.samefile(os.path.join(build1, 'b'), os.path.join(build2, 'b'))
+
+    # Pool + two builds.
+    assert os.stat(store.path(file_digest(os.path.join(build1, 'a')))).st_nlink == 3
+
+
+def test_ingest_twice(tmpdir):
+    store = BlobStore(str(tmpdir.join('.blobs')))
+    build = create_files(str(tmpdir.join('1')), {'a': 'content'})
+
+    assert store.ingest(build) == store.ingest(build)
+    assert os.stat(os.path.join(build, 'a')).st_nlink == 2
+
+
+def test_release(tmpdir):
+    store = BlobStore(str(tmpdir.join('.blobs')))
+
+    build1 = create_files(str(tmpdir.join('1')), {'a': 'same'})
+    build2 = create_files(str(tmpdir.join('2')), {'a': 'same'})
+
+    digests, _ = store.ingest(build1)
+    store.ingest(build2)
+
+    os.remove(os.path.join(build1, 'a'))
+
+    assert store.release(digests) == 0
+    assert os.path.exists(store.path(digests[0]))
+
+    os.remove(os.path.join(build2, 'a'))
+
+    assert store.release(digests) == 4
+    assert not os.path.exists(store.path(digests[0]))
+
+
+def test_manifest_with_blob_store(tmpdir):
+    root = str(tmpdir.join('builder'))
+    store = BlobStore(str(tmpdir.join('.blobs')))
+
+    create_files(os.path.join(root, '1'), {'a': 'same', 'b': 'unique'})
+    create_files(os.path.join(root, '2'), {'a': 'same'})
+
+    manifest = ArtifactManifest(root, blobs=store)
+    manifest.refresh()
+
+    assert manifest[1]['linked_size'] == 10
+    assert manifest.size == 14
+
+    # Only 'b' is freed, 'a' is still used by build 2.
+    assert manifest.remove(1) == 6
+    assert manifest.remove(2) == 4
+
+
+#
+# Support Functions
+#
+
+def create_files(root, files):
+    os.makedirs(root)
+
+    for name, content in files.items():
+        with open(os.path.join(root, name), 'w') as f:
+            f.write(content)
+
+    return root
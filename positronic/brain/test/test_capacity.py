@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from buildbot.process.properties import Properties
+from mock import MagicMock
+
+from positronic.brain.capacity import RESOURCES_PROPERTY, ResourceDemand, resources_in_use
+
+
+def test_resources_in_use():
+    slave = make_slave({'cpu': 8}, [
+        ('a', ResourceDemand({'cpu': 4, 'memory': 2}), True),
+        ('b', ResourceDemand({'cpu': 2}), True),
+        ('c', ResourceDemand({'cpu': 2}), False),
+        ('d', None, True),
+    ])
+
+    assert resources_in_use(slave) == {'cpu': 6, 'memory': 2}
+
+
+def test_can_start_build():
+    slave = make_slave({'cpu': 8, 'disk_heavy': 1}, [
+        ('a', ResourceDemand({'cpu': 4, 'disk_heavy': 1}), True),
+    ])
+
+    assert can_start(ResourceDemand({'cpu': 4}), slave)
+    assert not can_start(ResourceDemand({'cpu': 5}), slave)
+    assert not can_start(ResourceDemand({'cpu': 1, 'disk_heavy': 1}), slave)
+
+    # Resources the worker doesn't declare are not limited.
+    assert can_start(ResourceDemand({'memory': 1000}), slave)
+    assert can_start(ResourceDemand({}), slave)
+
+
+def test_compare():
+    assert ResourceDemand({'cpu': 4}) == ResourceDemand({'cpu': 4})
+    assert ResourceDemand({'cpu': 4}) != ResourceDemand({'cpu': 2})
+
+
+# Support Functions
+
+
+def make_slave(resources, builders):
+    slave = MagicMock()
+    slave.properties = Properties()
+    slave.properties.setProperty(RESOURCES_PROPERTY, resources, 'test')
+    slave.slavebuilders = {}
+
+    for name, demand, busy in builders:
+        slavebuilder = MagicMock()
+        slavebuilder.builder.config.canStartBuild = demand
+        slavebuilder.isBusy.return_value = busy
+        slave.slavebuilders[name] = slavebuilder
+
+    return slave
+
+
+def can_start(demand, slave):
+    slavebuilder = MagicMock()
+    slavebuilder.slave = slave
+
+    return demand(MagicMock(), slavebuilder, MagicMock())
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import subprocess
+import sys
+
+import pytest
+from buildbot.config import ConfigErrors
+
+from positronic.brain.checkout import GitReference, SharedSVNCheckout, TimedCheckoutMixin, \
+    TimedGit, TimedSVN, git_checkout_steps, svn_checkout_steps
+from positronic.brain.transfer import WORKER_BOOTSTRAP, worker_script
+
+
+def test_svn_checkout_steps():
+    step, = svn_checkout_steps('src', 'svn://example.com/trunk')
+    assert isinstance(step, TimedSVN)
+    assert (step.mode, step.method) == ('full', 'clean')
+
+    step, = svn_checkout_steps('src', 'svn://example.com/trunk', 'incremental')
+    assert (step.mode, step.method) == ('incremental', None)
+
+    step, = svn_checkout_steps('src', 'svn://example.com/trunk', 'export')
+    assert (step.mode, step.method) == ('full', 'export')
+
+    step, = svn_checkout_steps('src', 'svn://example.com/trunk', 'shared', 'hardlink')
+    assert isinstance(step, SharedSVNCheckout)
+    assert (step.dest, step.repourl, step.link) == ('src', 'svn://example.com/trunk', 'hardlink')
+
+    with pytest.raises(ConfigErrors):
+        svn_checkout_steps('src', 'svn://example.com/trunk', 'bogus')
+
+    with pytest.raises(ConfigErrors):
+        svn_checkout_steps('src', 'svn://example.com/trunk', 'shared', 'symlink')
+
+
+def test_git_checkout_steps():
+    step, = git_checkout_steps('src', 'git://example.com/repo', 'master')
+    assert isinstance(step, TimedGit)
+    assert (step.mode, step.method, step.shallow) == ('incremental', None, False)
+
+    step, = git_checkout_steps('src', 'git://example.com/repo', 'master', 'shallow')
+    assert (step.mode, step.method, step.shallow) == ('full', 'clobber', True)
+
+    reference, step = git_checkout_steps('src', 'git://example.com/repo', 'master', 'clean',
+                                         '/srv/git/repo.git')
+    assert isinstance(reference, GitReference)
+    assert reference.reference == '/srv/git/repo.git'
+    assert (step.mode, step.method) == ('full', 'clean')
+
+    with pytest.raises(ConfigErrors):
+        git_checkout_steps('src', 'git://example.com/repo', 'master', 'shallow', '/srv/repo.git')
+
+    with pytest.raises(ConfigErrors):
+        git_checkout_steps('src', 'git://example.com/repo', 'master', 'bogus')
+
+
+def test_checkout_duration():
+    step = TimedStep()
+    step.startStep(None)
+    step.finished(0)
+    step.startStep(None)
+    step.finished(0)
+
+    assert 0 <= step.properties['checkout_duration'] < 1
+    assert step.results == [0, 0]
+
+
+def test_worker_script_copy_tree(tmpdir):
+    src = tmpdir.join('cache')
+    src.join('.svn', 'wc.db').write('db', ensure=True)
+    src.join('dir', 'a').write('abc', ensure=True)
+
+    run_worker_script(str(tmpdir), 'copy_tree', 'cache', 'copy', 'copy')
+    run_worker_script(str(tmpdir), 'copy_tree', 'cache', 'link', 'hardlink')
+
+    for dest in ('copy', 'link'):
+        assert tmpdir.join(dest, 'dir', 'a').read() == 'abc'
+        assert not tmpdir.join(dest, '.svn').check()
+
+    assert not os.path.samefile(str(src.join('dir', 'a')), str(tmpdir.join('copy', 'dir', 'a')))
+    assert os.path.samefile(str(src.join('dir', 'a')), str(tmpdir.join('link', 'dir', 'a')))
+
+
+def test_worker_script_git_reference(tmpdir):
+    subprocess.check_call(['git', 'init', '-q', '--bare', str(tmpdir.join('reference.git'))])
+
+    run_worker_script(str(tmpdir), 'git_reference', 'work', 'reference.git')
+
+    alternates = tmpdir.join('work', '.git', 'objects', 'info', 'alternates')
+    assert alternates.read() == str(tmpdir.join('reference.git', 'objects')) + '\n'
+
+    # Running it again is harmless.
+    run_worker_script(str(tmpdir), 'git_reference', 'work', 'reference.git')
+    assert alternates.read() == str(tmpdir.join('reference.git', 'objects')) + '\n'
+
+
+# Support Functions
+
+
+class FakeStep(object):
+
+    def __init__(self):
+        self.properties = {}
+        self.results = []
+
+    def startStep(self, remote):
+        pass
+
+    def finished(self, results):
+        self.results.append(results)
+
+    def getProperty(self, name, default=None):
+        return self.properties.get(name, default)
+
+    def setProperty(self, name, value, source):
+        self.properties[name] = value
+
+
+class TimedStep(TimedCheckoutMixin, FakeStep):
+    pass
+
+
+def run_worker_script(cwd, function, *args):
+    p = subprocess.Popen([sys.executable, '-c', WORKER_BOOTSTRAP], cwd=cwd,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = p.communicate(worker_script('checkout.py', function, *args))
+
+    assert p.returncode == 0
+
+    return out
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+
+from mock import MagicMock, patch
+from twisted.internet import defer
+
+from positronic.brain.durations import BUILD_KEY, DurationStore, junit_durations, \
+    lpt_partition, prioritize_builders, record_build
+from positronic.brain.trigger import MatrixTrigger
+
+
+JUNIT_REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuite tests="4">
+  <testcase classname="tests.test_a" file="tests/test_a.py" name="test_1" time="1.5"/>
+  <testcase classname="tests.test_a" file="tests/test_a.py" name="test_2" time="2.5"/>
+  <testcase classname="tests.test_b.TestB" name="test_3" time="3"/>
+  <testcase classname="tests.test_b.TestB" name="test_4"/>
+</testsuite>
+"""
+
+
+def test_record(tmpdir):
+    path = str(tmpdir.join('durations.json'))
+    store = DurationStore(path, horizon=10)
+
+    store.record('builder', 1, {BUILD_KEY: 100, 'test:a': 10, 'test:b': 20})
+    store.record('builder', 2, {BUILD_KEY: 200, 'test:a': 30})
+
+    assert store.expected('builder', BUILD_KEY) == 150
+    assert store.expected('other', BUILD_KEY) is None
+    assert store.expected('other', BUILD_KEY, 0) == 0
+    assert store.durations('builder', 'test:') == {'a': 20, 'b': 20}
+
+    # Keys not reported within the horizon are forgotten.
+    store.record('builder', 11, {BUILD_KEY: 150})
+    assert store.durations('builder', 'test:') == {'a': 20}
+
+    reloaded = DurationStore(path)
+    assert reloaded.expected('builder', BUILD_KEY) == 150
+    assert reloaded.durations('builder', 'test:') == {'a': 20}
+
+
+def test_lookups_dont_wait_for_writes(tmpdir):
+    path = str(tmpdir.join('durations.json'))
+    store = DurationStore(path)
+
+    # Hold the store while it is being written.
+    with store._save_lock:
+        recording = threading.Thread(target=store.record, args=('builder', 1, {BUILD_KEY: 100}))
+        recording.start()
+
+        while store._changes == 0:
+            time.sleep(0.01)
+
+        assert store.expected('builder', BUILD_KEY) == 100
+
+    recording.join()
+
+    assert DurationStore(path).expected('builder', BUILD_KEY) == 100
+
+
+def test_corrupted_store(tmpdir):
+    tmpdir.join('durations.json').write('{')
+
+    store = DurationStore(str(tmpdir.join('durations.json')))
+
+    assert store.expected('builder', BUILD_KEY) is None
+
+
+def test_junit_durations(tmpdir):
+    tmpdir.join('reports', 'junit.xml').write(JUNIT_REPORT, ensure=True)
+    tmpdir.join('reports', 'broken.xml').write('<testsuite><testcase', ensure=True)
+    tmpdir.join('data.xml').write('<data time="10"/>')
+
+    assert junit_durations(str(tmpdir)) == {'tests/test_a.py': 4, 'tests.test_b.TestB': 3}
+
+
+def test_record_build(tmpdir):
+    tmpdir.join('junit.xml').write(JUNIT_REPORT)
+    store = DurationStore()
+
+    with patch('positronic.brain.durations.get_duration_store', return_value=store):
+        record_build('builder', 1, str(tmpdir), {BUILD_KEY: 60, 'step:make': 40})
+
+    assert store.expected('builder', 'step:make') == 40
+    assert store.durations('builder', 'test:') == {'tests/test_a.py': 4, 'tests.test_b.TestB': 3}
+
+
+def test_lpt_partition():
+    durations = {'a': 7, 'b': 5, 'c': 4, 'd': 3, 'e': 3, 'f': 2}
+
+    partition = lpt_partition(durations, 3)
+
+    assert partition == [['a', 'f'], ['b', 'e'], ['c', 'd']]
+    assert [sum(durations[i] for i in p) for p in partition] == [9, 8, 7]
+
+    assert lpt_partition({}, 2) == [[], []]
+    assert lpt_partition({'a': 1}, 3) == [['a'], [], []]
+
+
+def test_prioritize_builders():
+    store = DurationStore()
+    store.record('long', 1, {BUILD_KEY: 3600})
+    store.record('short', 1, {BUILD_KEY: 60})
+
+    builders = [make_builder('unknown', 10), make_builder('short', 20),
+                make_builder('long', 30), make_builder('short-new', None),
+                make_builder('short-old', 5)]
+    store.record('short-new', 1, {BUILD_KEY: 60})
+    store.record('short-old', 1, {BUILD_KEY: 60})
+
+    with patch('positronic.brain.durations.get_duration_store', return_value=store):
+        d = prioritize_builders(None, builders)
+
+    assert [b.name for b in d.result] == ['long', 'short-old', 'short', 'short-new', 'unknown']
+
+
+def test_split_tests():
+    store = DurationStore()
+    store.record('shards', 1, {'test:a': 7, 'test:b': 5, 'test:c': 4, 'step:make': 100})
+
+    trigger = MatrixTrigger(cells=dict(('shard-%d' % i, ('trigger', {})) for i in range(2)),
+                            balance='shards')
+    trigger.addCompleteLog = MagicMock()
+
+    with patch('positronic.brain.trigger.get_duration_store', return_value=store):
+        assert trigger.split_tests() == {'shard-0': ['a'], 'shard-1': ['b', 'c']}
+
+    log = trigger.addCompleteLog.call_args[0]
+    assert log == ('balance', 'shard-0      1 tests       7 s\nshard-1      2 tests       9 s\n')
+
+
+# Support Functions
+
+
+def make_builder(name, oldest):
+    builder = MagicMock()
+    builder.name = name
+    builder.getOldestRequestTime.return_value = defer.succeed(oldest)
+
+    return builder
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from twisted.internet import defer
+
+from positronic.brain.janitor import ArtifactJanitor
+
+
+class ManualJanitor(ArtifactJanitor):
+    """A janitor which runs jobs only when told so, without threads."""
+
+    def __init__(self):
+        super(ManualJanitor, self).__init__()
+        self.jobs = []
+
+    def _defer(self, fn, *args):
+        d = defer.Deferred()
+        self.jobs.append((d, fn, args))
+        return d
+
+    def run_next(self):
+        d, fn, args = self.jobs.pop(0)
+        defer.maybeDeferred(fn, *args).chainDeferred(d)
+
+
+def freed(n):
+    return n
+
+
+def test_submit_runs_job():
+    janitor = ManualJanitor()
+    results = []
+
+    janitor.submit('builder', freed, 10).addCallback(results.append)
+    janitor.run_next()
+
+    assert results == [10]
+    assert janitor.bytes_freed == 10
+    assert janitor.queue_depth == 0
+
+
+def test_submit_coalesces_queued_jobs():
+    janitor = ManualJanitor()
+    results = []
+
+    # The first job starts right away, the others wait for it and are merged into a single job.
+    for n in (1, 2, 3):
+        janitor.submit('builder', freed, n).addCallback(results.append)
+
+    assert len(janitor.jobs) == 1
+    assert janitor.queue_depth == 1
+
+    janitor.run_next()
+
+    assert results == [1]
+    assert len(janitor.jobs) == 1
+    assert janitor.queue_depth == 0
+
+    janitor.run_next()
+
+    assert results == [1, 3, 3]
+    assert janitor.bytes_freed == 4
+
+
+def test_submit_different_roots_run_concurrently():
+    janitor = ManualJanitor()
+
+    janitor.submit('builder1', freed, 1)
+    janitor.submit('builder2', freed, 2)
+
+    assert len(janitor.jobs) == 2
+    assert janitor.queue_depth == 0
+
+
+def test_submit_failure():
+    janitor = ManualJanitor()
+    failures = []
+
+    def broken():
+        raise OSError('broken')
+
+    janitor.submit('builder', broken).addErrback(failures.append)
+    janitor.run_next()
+
+    assert len(failures) == 1
+    assert failures[0].check(OSError)
+    assert janitor.bytes_freed == 0
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from mock import MagicMock
+from twisted.internet import task
+
+from positronic.brain.locality import LocalityPolicy, running_builds
+
+
+def test_prefers_most_recent_worker():
+    policy = make_policy()
+    builder = make_builder(['w2', 'w1', 'w2'])
+    w1, w2, w3 = make_slavebuilder('w1'), make_slavebuilder('w2'), make_slavebuilder('w3')
+
+    assert policy(builder, [w1, w2, w3]) is w2
+    assert policy(builder, [w1, w3]) is w1
+
+
+def test_no_history_picks_least_loaded():
+    policy = make_policy()
+    builder = make_builder([])
+    w1, w2 = make_slavebuilder('w1', running=2), make_slavebuilder('w2', running=1)
+
+    assert policy(builder, [w1, w2]) is w2
+    assert policy(builder, []) is None
+
+
+def test_waits_for_warm_worker():
+    policy = make_policy(wait=60)
+    builder = make_builder(['w1'])
+    w2 = make_slavebuilder('w2')
+
+    assert policy(builder, [w2]) is None
+    policy._reactor.advance(30)
+    assert policy(builder, [w2]) is None
+    assert not builder.botmaster.maybeStartBuildsForBuilder.called
+
+    # The distributor is kicked once the wait is over, and the build goes to a cold worker.
+    policy._reactor.advance(30)
+    builder.botmaster.maybeStartBuildsForBuilder.assert_called_once_with('builder')
+    assert policy(builder, [w2]) is w2
+
+    # The next build waits again.
+    assert policy(builder, [w2]) is None
+
+
+def test_warm_worker_stops_waiting():
+    policy = make_policy(wait=60)
+    builder = make_builder(['w1'])
+    w1, w2 = make_slavebuilder('w1'), make_slavebuilder('w2')
+
+    assert policy(builder, [w2]) is None
+    assert policy(builder, [w1, w2]) is w1
+    assert not policy._reactor.getDelayedCalls()
+
+
+def test_running_builds():
+    assert running_builds(make_slavebuilder('w1', running=3).slave) == 3
+
+
+# Support Functions
+
+
+def make_policy(wait=0):
+    policy = LocalityPolicy(wait=wait)
+    policy._reactor = task.Clock()
+
+    return policy
+
+
+def make_builder(slavenames):
+    builder = MagicMock()
+    builder.name = 'builder'
+    builds = [MagicMock(getSlavename=MagicMock(return_value=n)) for n in slavenames]
+    builder.builder_status.generateFinishedBuilds.return_value = builds
+
+    return builder
+
+
+def make_slavebuilder(name, running=0):
+    slavebuilder = MagicMock()
+    slavebuilder.slave.slavename = name
+    slavebuilder.slave.slavebuilders = dict(
+        ('b%d' % i, MagicMock(isBusy=MagicMock(return_value=i < running))) for i in xrange(5))
+
+    return slavebuilder
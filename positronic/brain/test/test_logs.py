@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from StringIO import StringIO
+import random
+
+from mock import patch, MagicMock
+
+from buildbot.status.logfile import HEADER, STDERR, STDOUT
+
+from positronic.brain.logs import parse_netstrings, tail_lines, tail_netstrings, tail_text
+
+
+def test_tail_text():
+    assert list(tail_text([], 3)) == []
+    assert list(tail_text(['a\nb', 'c\nd\n'], 3)) == ['a', 'bc', 'd']
+    assert list(tail_text(['a\nb', 'c\nd\n'], 2)) == ['bc', 'd']
+    assert list(tail_text(['a\r', '\nb\r', 'c'], 5)) == ['a', 'b', 'c']
+    assert list(tail_text(['\n\n', '\n'], 5)) == ['', '', '']
+
+
+def test_tail_text_matches_splitlines():
+    rnd = random.Random(42)
+
+    for _ in range(200):
+        text = ''.join(rnd.choice('ab\r\n') for _ in range(rnd.randint(0, 40)))
+        chunks = split_randomly(rnd, text)
+
+        for n in (1, 3, 100):
+            assert list(tail_text(chunks, n)) == text.splitlines()[-n:]
+
+
+def test_parse_netstrings():
+    data = netstrings([(STDOUT, 'hello'), (STDERR, 'world,2:0,!')])
+
+    assert parse_netstrings(data, True) == [(STDOUT, 'hello'), (STDERR, 'world,2:0,!')]
+
+    # Starting in the middle of a netstring we can only parse the following ones.
+    assert parse_netstrings(data[3:], False) == [(STDERR, 'world,2:0,!')]
+
+    # A comma inside the text doesn't fool us, since the chain would not end at the end of data.
+    assert parse_netstrings(data[len('6:0hello,') + 5:], False) == []
+
+    assert parse_netstrings('', True) == []
+    assert parse_netstrings('garbage', False) == []
+
+
+@patch('positronic.brain.logs.TAIL_WINDOW', 16)
+def test_tail_netstrings():
+    rnd = random.Random(1)
+
+    for _ in range(50):
+        entries = [(rnd.choice([STDOUT, STDERR, HEADER]), random_text(rnd))
+                   for _ in range(rnd.randint(0, 30))]
+        text = ''.join(t for c, t in entries if c != HEADER)
+
+        for n in (1, 5, 1000):
+            f = StringIO(netstrings(entries))
+            assert tail_netstrings(f, n, (STDOUT, STDERR)) == text.splitlines()[-n:]
+
+
+@patch('positronic.brain.logs.TAIL_WINDOW', 16)
+def test_tail_netstrings_reads_only_the_tail():
+    lines = ['line %d' % i for i in range(10000)]
+    f = CountingFile(netstrings([(STDOUT, l + '\n') for l in lines]))
+
+    assert tail_netstrings(f, 2, (STDOUT, STDERR)) == lines[-2:]
+    assert f.bytes_read < 1024
+
+
+def test_tail_lines_from_file(tmpdir):
+    path = tmpdir.join('stdio')
+    path.write(netstrings([(HEADER, 'command\n'), (STDOUT, 'a\nb\n'), (STDERR, 'c\n')]))
+
+    log = MagicMock()
+    log.isFinished.return_value = True
+    log.getFilename.return_value = str(path)
+
+    assert tail_lines(log, 2) == ['b', 'c']
+    assert tail_lines(log, 0) == []
+    assert not log.getChunks.called
+
+
+def test_tail_lines_streams_unfinished_logs():
+    log = MagicMock()
+    log.isFinished.return_value = False
+    log.getChunks.return_value = iter(['a\nb', '\nc\n'])
+
+    assert tail_lines(log, 2) == ['b', 'c']
+    log.getChunks.assert_called_once_with([STDOUT, STDERR], onlyText=True)
+
+
+def test_tail_lines_streams_compressed_logs(tmpdir):
+    log = MagicMock()
+    log.isFinished.return_value = True
+    log.getFilename.return_value = str(tmpdir.join('stdio'))
+    log.getChunks.return_value = iter(['a\nb\n'])
+
+    assert tail_lines(log, 1) == ['b']
+
+
+# Support Functions
+
+
+def netstrings(entries):
+    return ''.join('%d:%d%s,' % (len(text) + 1, channel, text) for channel, text in entries)
+
+
+def random_text(rnd):
+    return ''.join(rnd.choice('ab,:1\r\n') for _ in range(rnd.randint(1, 12)))
+
+
+def split_randomly(rnd, text):
+    cuts = sorted(rnd.randint(0, len(text)) for _ in range(rnd.randint(0, 4)))
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+class CountingFile(StringIO):
+
+    bytes_read = 0
+
+    def read(self, n=-1):
+        data = StringIO.read(self, n)
+        self.bytes_read += len(data)
+        return data
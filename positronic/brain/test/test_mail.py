@@ -21,7 +21,7 @@ import pytest
 
 from buildbot.process.buildstep import SUCCESS, FAILURE
 
-from positronic.brain.mail import html_message_formatter
+from positronic.brain.mail import digest_message_formatter, html_message_formatter
 
 
 EXPECTED_EMPTY_MESSAGE = """<!-- ============== -->
@@ -141,7 +141,8 @@ def test_html_message_formatter_empty_message(build_status, status):
 @patch('buildbot.status.master.Status')
 def test_html_message_formatter_log_failure_but_results_success(build_status, log_file, status):
     # Mock
-    log_file.getText.return_value = 'A failed build step'
+    log_file.isFinished.return_value = False
+    log_file.getChunks.return_value = ['A failed build step']
     log_file.step.results = FAILURE
 
     build_status.getLogs.return_value = [log_file]
@@ -164,7 +165,8 @@ def test_html_message_formatter_failed_log(build_status, log_file, status):
     log_file.getName.return_value = 'stdio'
     log_file.getStep.return_value = MagicMock()
     log_file.getStep().getName = MagicMock(return_value='step')
-    log_file.getText.return_value = 'A failed build step'
+    log_file.isFinished.return_value = False
+    log_file.getChunks.return_value = ['A failed build step']
     log_file.step.results = FAILURE
 
     build_status.getLogs.return_value = [log_file]
@@ -183,3 +185,20 @@ def test_html_message_formatter_failed_log(build_status, log_file, status):
         'subject': '[test-build] FAILURE on worker',
         'type': 'html',
     }
+
+
+def test_digest_message_formatter():
+    builds = [
+        {'builder': 'a', 'number': 1, 'result': 'success', 'url': 'http://localhost:8080/build/1',
+         'worker': 'worker', 'reason': 'running a test', 'finished': 'Mon Jan  5 10:00:00 2015'},
+        {'builder': 'b', 'number': 7, 'result': 'failure', 'url': 'http://localhost:8080/build/7',
+         'worker': 'worker', 'reason': 'running a test', 'finished': 'Mon Jan  5 10:05:00 2015'},
+    ]
+
+    ret = digest_message_formatter('BuildBot', builds)
+
+    assert ret['subject'] == '[BuildBot] 2 builds, 1 failed'
+    assert ret['type'] == 'html'
+    assert '<h3>2 builds finished, 1 failed</h3>' in ret['body']
+    assert '<a href="http://localhost:8080/build/7">#7</a>' in ret['body']
+    assert '<strong>FAILURE</strong>' in ret['body']
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+
+import pytest
+from mock import patch
+
+from positronic.brain.manifest import ArtifactManifest, manifest_path, scan_build
+
+
+def test_refresh_scans_builds(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x' * 10, 'b/c': 'y' * 5})
+    create_build(root, 2, {})
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    assert manifest.numbers() == [1, 2]
+    assert manifest[1]['size'] == 15
+    assert manifest[1]['files'] == 2
+    assert not manifest[1]['empty']
+    assert manifest[2]['empty']
+    assert manifest.size == 15
+
+
+def test_refresh_picks_up_added_and_removed_builds(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x'})
+    create_build(root, 2, {'a': 'x'})
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    shutil.rmtree(os.path.join(root, '1'))
+    create_build(root, 3, {'a': 'xy'})
+    manifest.refresh()
+
+    assert manifest.numbers() == [2, 3]
+    assert manifest.size == 3
+
+
+def test_refresh_does_not_rescan_known_builds(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x'})
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    create_build(root, 2, {'a': 'x'})
+
+    with patch('positronic.brain.manifest.scan_build', wraps=scan_build) as scan:
+        manifest.refresh()
+
+    scan.assert_called_once_with(os.path.join(root, '2'))
+
+
+def test_refresh_skips_listing_when_not_stale(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x'})
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    with patch('positronic.brain.manifest.time') as time:
+        time.time.return_value = os.stat(root).st_mtime + 60
+        manifest.sync()
+
+    with patch('positronic.brain.manifest.listdir') as listdir:
+        manifest.refresh()
+
+    assert not listdir.called
+
+
+def test_save_and_load(tmpdir):
+    root = str(tmpdir.mkdir('builder'))
+    path = manifest_path(root)
+
+    create_build(root, 1, {'a': 'x'})
+
+    manifest = ArtifactManifest(root, path)
+    manifest.refresh()
+    manifest.save()
+
+    assert path == str(tmpdir.join('.manifests', 'builder.json'))
+
+    loaded = ArtifactManifest(root, path)
+    loaded.load()
+
+    assert loaded.builds == manifest.builds
+    assert loaded.size == manifest.size
+
+
+def test_set_result(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x'})
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+    manifest.set_result(1, 0)
+    manifest.set_result(2, 0)
+
+    assert manifest[1]['result'] == 0
+    assert 2 not in manifest
+
+
+def test_load_corrupted_manifest(tmpdir):
+    root = str(tmpdir.mkdir('builder'))
+    path = str(tmpdir.join('manifest.json'))
+
+    create_build(root, 1, {'a': 'x'})
+
+    with open(path, 'w') as f:
+        f.write('{ not json')
+
+    manifest = ArtifactManifest(root, path)
+    manifest.refresh()
+
+    assert manifest.numbers() == [1]
+
+
+def test_load_other_version(tmpdir):
+    root = str(tmpdir.mkdir('builder'))
+    path = str(tmpdir.join('manifest.json'))
+
+    with open(path, 'w') as f:
+        json.dump({'version': 0, 'builds': {'1': {}}}, f)
+
+    manifest = ArtifactManifest(root, path)
+    manifest.refresh()
+
+    assert manifest.numbers() == []
+
+
+def test_remove(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x' * 3})
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    assert manifest.remove(1) == 3
+    assert manifest.size == 0
+    assert 1 not in manifest
+    assert not os.path.exists(os.path.join(root, '1'))
+
+
+def test_remove_linked_files(tmpdir):
+    root = str(tmpdir)
+
+    create_build(root, 1, {'a': 'x' * 3, 'b': 'x' * 5})
+    os.makedirs(os.path.join(root, '2'))
+    os.link(os.path.join(root, '1', 'a'), os.path.join(root, '2', 'a'))
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    assert manifest[1]['inodes'][str(os.stat(os.path.join(root, '1', 'a')).st_ino)] == 3
+    assert set(manifest[2]['inodes']) < set(manifest[1]['inodes'])
+
+    # The file linked by build 2 stays on disk.
+    assert manifest.remove(1) == 5
+    assert manifest.remove(2) == 3
+
+
+def test_sync_not_integer(tmpdir):
+    root = str(tmpdir)
+
+    os.makedirs(os.path.join(root, 'dir1'))
+    os.makedirs(os.path.join(root, 'dir2'))
+
+    with pytest.raises(ValueError):
+        ArtifactManifest(root).sync()
+
+
+def test_sync_not_dir(tmpdir):
+    root = str(tmpdir)
+
+    for number in range(4):
+        create_build(root, number, {'keep': 'a'})
+
+    with open(os.path.join(root, '5'), 'w') as f:
+        f.write('I am a file and should not be here')
+
+    with pytest.raises(AssertionError):
+        ArtifactManifest(root).sync()
+
+
+def test_missing_root(tmpdir):
+    manifest = ArtifactManifest(str(tmpdir.join('missing')))
+    manifest.refresh()
+
+    assert manifest.numbers() == []
+
+
+#
+# Support Functions
+#
+
+def create_build(root, number, files):
+    build_dir = os.path.join(root, str(number))
+    os.makedirs(build_dir)
+
+    for name, content in files.items():
+        p = os.path.join(build_dir, name)
+
+        if not os.path.isdir(os.path.dirname(p)):
+            os.makedirs(os.path.dirname(p))
+
+        with open(p, 'w') as f:
+            f.write(content)
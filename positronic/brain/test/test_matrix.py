@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+
+import pytest
+from buildbot.config import ConfigErrors
+from buildbot.status.results import FAILURE, SUCCESS
+from mock import MagicMock, patch
+from twisted.internet import defer
+
+from positronic.brain.job.freestyle import FreestyleJob
+from positronic.brain.job.matrix import MatrixJob
+from positronic.brain.manifest import ArtifactManifest
+from positronic.brain.retention import DiskUsage
+from positronic.brain.trigger import MERGED_LOG_LINES, MatrixTrigger, link_trees
+
+
+AXES = [
+    ('platform', ['linux', 'windows']),
+    ('compiler', ['gcc', 'msvc']),
+    ('build type', {'debug': {'CFLAGS': '-O0'}, 'release': None}),
+]
+
+
+def test_cells():
+    job = MatrixJob('test-cells', AXES, ['worker'])
+
+    assert sorted(job.cells) == [
+        'linux-gcc-debug', 'linux-gcc-release', 'linux-msvc-debug', 'linux-msvc-release',
+        'windows-gcc-debug', 'windows-gcc-release', 'windows-msvc-debug', 'windows-msvc-release',
+    ]
+    assert job.cells['linux-gcc-debug'].name == 'test-cells-linux-gcc-debug'
+    assert job.cells['linux-gcc-debug'].env == {
+        'PLATFORM': 'linux', 'COMPILER': 'gcc', 'BUILD_TYPE': 'debug', 'CFLAGS': '-O0'}
+    assert job.cells['windows-msvc-release'].env == {
+        'PLATFORM': 'windows', 'COMPILER': 'msvc', 'BUILD_TYPE': 'release'}
+
+
+def test_cells_env():
+    env = {'CFLAGS': '-Wall', 'PLATFORM': 'other', 'A': '1'}
+    job = MatrixJob('test-env', AXES, ['worker'], env=env)
+
+    assert job.cells['linux-gcc-debug'].env == {
+        'PLATFORM': 'linux', 'COMPILER': 'gcc', 'BUILD_TYPE': 'debug', 'CFLAGS': '-O0', 'A': '1'}
+    assert job.cells['linux-gcc-release'].env['CFLAGS'] == '-Wall'
+
+
+def test_cells_of_numbers():
+    job = MatrixJob('test-numbers', [('python', [2.7, 3.4])], ['worker'])
+
+    assert sorted(job.cells) == ['2.7', '3.4']
+    assert job.cells['2.7'].env == {'PYTHON': '2.7'}
+
+
+def test_include_exclude():
+    workers = {'linux': ['linux-worker'], 'windows': ['windows-worker']}
+
+    job = MatrixJob('test-include', AXES, lambda cell: workers[cell['platform']],
+                    include=lambda cell: (cell['platform'] == 'windows') ==
+                                         (cell['compiler'] == 'msvc'),
+                    exclude=lambda cell: cell['build type'] == 'release')
+
+    assert sorted(job.cells) == ['linux-gcc-debug', 'windows-msvc-debug']
+    assert job.cells['windows-msvc-debug'].workers == ['windows-worker']
+
+    with pytest.raises(ConfigErrors):
+        MatrixJob('test-empty', AXES, ['worker'], include=lambda cell: False)
+
+
+def test_trigger_step():
+    job = MatrixJob('test-trigger', AXES[:1], ['worker'], fail_fast=True)
+    step = job.build.steps[-1]
+
+    assert step.factory is MatrixTrigger
+    assert step.kwargs['cells'] == {
+        'linux': ('test-trigger-linux-scheduler-trigger', {}),
+        'windows': ('test-trigger-windows-scheduler-trigger', {}),
+    }
+    assert step.kwargs['fail_fast']
+
+
+def test_command_env():
+    job = MatrixJob('test-env', AXES[:1], ['worker'])
+    job.command('make', env={'PLATFORM': 'other', 'A': '1'})
+
+    step = job.cells['linux'].build.steps[-1]
+    env = step.kwargs['env']
+
+    assert env['PLATFORM'] == 'other'
+    assert env['A'] == '1'
+    assert env['CI'] == '1'
+    assert job.cells['windows'].build.steps[-1].kwargs['env']['PLATFORM'] == 'other'
+
+
+def test_parallel_error():
+    job = MatrixJob('test-parallel', AXES[:1], ['worker'])
+    steps = len(job.cells['linux'].build.steps)
+
+    with pytest.raises(ValueError):
+        with job.parallel():
+            job.command('make', 'lint')
+            raise ValueError()
+
+    # Cells don't add the commands of the failed block.
+    assert len(job.cells['linux'].build.steps) == steps
+    assert job.cells['linux'].parallel_commands is None
+
+
+def test_fail_fast_cancels_siblings():
+    trigger = make_trigger(fail_fast=True)
+    b, c = trigger.schedulers['b-trigger'], trigger.schedulers['c-trigger']
+    b.requests['matrix/1/b'] = {'builder-b': 2}
+    c.requests['matrix/1/c'] = {'builder-c': 3}
+
+    master = trigger.build.builder.botmaster.parent
+    master.db.buildrequests.getBuildRequest.side_effect = lambda brid: defer.succeed(
+        {'brid': brid, 'complete': False, 'claimed': brid == 3})
+
+    running = MagicMock()
+    running.requests = [MagicMock(id=3)]
+    master.botmaster.builders.get.return_value.building = [running]
+
+    trigger.cell_finished((SUCCESS, {'builder-a': 1}), 'a')
+    assert not master.db.buildrequests.getBuildRequest.called
+
+    trigger.cell_finished((FAILURE, {'builder-b': 2}), 'b')
+
+    master.db.buildrequests.getBuildRequest.assert_called_once_with(3)
+    assert running.stopBuild.called
+
+
+def test_summary():
+    trigger = make_trigger()
+    trigger.cell_results = {'a': (SUCCESS, 10), 'b': (FAILURE, 20)}
+    trigger.summarize()
+
+    log = trigger.addCompleteLog.call_args[0]
+    assert log[0] == 'summary'
+    assert log[1] == 'a  success        10 s\nb  failure        20 s\nc  exception       0 s\n'
+
+    trigger.setProperty.assert_called_once_with('matrix_results', {
+        'a': {'result': 'success', 'duration': 10},
+        'b': {'result': 'failure', 'duration': 20},
+        'c': {'result': 'exception', 'duration': 0},
+    }, 'MatrixTrigger')
+
+
+def test_sharded_command():
+    job = FreestyleJob('test-sharded', ['worker-1', 'worker-2'], env={'A': '1'})
+    job.command('make')
+    job.sharded_command(3, 'make', 'check', env={'B': '2'})
+    job.command('make', 'install')
+
+    shards, = job.shard_jobs
+    assert shards.name == 'test-sharded-shards'
+    assert shards.workers == ['worker-1', 'worker-2']
+    assert not shards.builder_config.mergeRequests
+
+    make, check = shards.build.steps[shards.first_step:]
+    assert make.kwargs['command'] == ['make']
+    assert check.kwargs['command'] == ['make', 'check']
+    assert check.kwargs['name'] == 'shard'
+    assert check.kwargs['env']['A'] == '1'
+    assert check.kwargs['env']['B'] == '2'
+    assert check.kwargs['env']['SHARD_COUNT'] == '3'
+    assert 'SHARD_INDEX' in check.kwargs['env']
+
+    trigger = job.build.steps[-2]
+    assert trigger.factory is MatrixTrigger
+    assert trigger.kwargs['cells'] == {
+        'shard-0': ('test-sharded-shards-scheduler-trigger', {'shard_index': 0}),
+        'shard-1': ('test-sharded-shards-scheduler-trigger', {'shard_index': 1}),
+        'shard-2': ('test-sharded-shards-scheduler-trigger', {'shard_index': 2}),
+    }
+    assert trigger.kwargs['merge_logs'] == 'shard'
+    assert trigger.kwargs['collect_artifacts']
+
+    # Later shards don't trigger earlier ones.
+    job.sharded_command(2, 'make', 'slow-check')
+    assert job.shard_jobs[1].name == 'test-sharded-shards-2'
+    assert not [s for s in job.shard_jobs[1].build.steps if s.factory is MatrixTrigger]
+
+    with pytest.raises(ConfigErrors):
+        job.sharded_command(0, 'make', 'check')
+
+
+def test_copy_logs():
+    trigger = make_trigger()
+    trigger.merge_logs = 'shard'
+
+    status = trigger.build.builder.botmaster.parent.status
+    build = status.getBuilder.return_value.getBuild.return_value
+    build.getSteps.return_value = [make_step_status('make', 'built'),
+                                   make_step_status('shard', 'tested')]
+
+    with patch('positronic.brain.trigger.threads.deferToThread', defer.maybeDeferred):
+        trigger.copy_logs([('a', 'shards', 1)])
+
+    trigger.addCompleteLog.assert_called_once_with('a', 'tested\n')
+    status.getBuilder.return_value.getBuild.assert_called_once_with(1)
+
+
+def test_copy_logs_tail():
+    trigger = make_trigger()
+    trigger.merge_logs = 'shard'
+
+    status = trigger.build.builder.botmaster.parent.status
+    build = status.getBuilder.return_value.getBuild.return_value
+    build.getSteps.return_value = [make_step_status('shard', 'x\n' * MERGED_LOG_LINES + 'last\n')]
+
+    with patch('positronic.brain.trigger.threads.deferToThread', defer.maybeDeferred):
+        trigger.copy_logs([('a', 'shards', 1)])
+
+    text = trigger.addCompleteLog.call_args[0][1]
+    assert len(text.splitlines()) == MERGED_LOG_LINES
+    assert text.endswith('x\nlast\n')
+
+
+def test_link_trees(tmpdir):
+    tmpdir.join('shards', '1', 'report.xml').write('a', ensure=True)
+    tmpdir.join('shards', '2', 'logs', 'test.log').write('b', ensure=True)
+
+    link_trees([(str(tmpdir.join('shards', '1')), str(tmpdir.join('build', 'shard-0'))),
+                (str(tmpdir.join('shards', '2')), str(tmpdir.join('build', 'shard-1'))),
+                (str(tmpdir.join('shards', '3')), str(tmpdir.join('build', 'shard-2')))])
+
+    assert tmpdir.join('build', 'shard-0', 'report.xml').read() == 'a'
+    assert tmpdir.join('build', 'shard-1', 'logs', 'test.log').read() == 'b'
+    assert not tmpdir.join('build', 'shard-2').check()
+
+
+def test_linked_artifacts_count_once(tmpdir):
+    tmpdir.join('shards', '1', 'report.xml').write('x' * 10, ensure=True)
+    tmpdir.join('build', '1', 'artifact').write('x' * 5, ensure=True)
+
+    link_trees([(str(tmpdir.join('shards', '1')), str(tmpdir.join('build', '1', 'shard-0')))],
+               threading.Lock())
+
+    shards = ArtifactManifest(str(tmpdir.join('shards')))
+    build = ArtifactManifest(str(tmpdir.join('build')))
+    shards.refresh()
+    build.refresh()
+
+    assert DiskUsage([shards, build]).size == 15
+
+    # The parent build keeps the artifacts of its shards alive, and accounted for.
+    assert shards.remove(1) == 0
+    assert DiskUsage([shards, build]).size == 15
+
+
+# Support Functions
+
+
+def make_trigger(fail_fast=False):
+    trigger = MatrixTrigger(cells=dict((c, (c + '-trigger', {})) for c in 'abc'),
+                            fail_fast=fail_fast)
+    trigger.build = MagicMock()
+    trigger.started = 0
+    trigger.schedulers = dict((c + '-trigger', make_scheduler(c)) for c in 'abc')
+    trigger.matrix_build = lambda cell: 'matrix/1/' + cell
+    trigger.addCompleteLog = MagicMock()
+    trigger.setProperty = MagicMock()
+    trigger.step_status = MagicMock()
+
+    return trigger
+
+
+def make_scheduler(cell):
+    scheduler = MagicMock()
+    scheduler.name = cell + '-trigger'
+    scheduler.requests = {}
+
+    return scheduler
+
+
+def make_step_status(name, text):
+    step_log = MagicMock()
+    step_log.getName.return_value = 'stdio'
+    step_log.isFinished.return_value = False
+    step_log.getChunks.return_value = [text]
+
+    step = MagicMock()
+    step.getName.return_value = name
+    step.getLogs.return_value = [step_log]
+
+    return step
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncore
+import smtpd
+import threading
+
+from mock import MagicMock, patch
+import pytest
+
+from buildbot.config import ConfigErrors
+from buildbot.process.buildstep import FAILURE, SUCCESS
+from twisted.internet import defer, task
+
+from positronic.brain.notifier import (AsyncMailNotifier, MailDigest, MailQueue, MailQueueFull,
+                                       RoutedMailNotifier)
+
+
+class ManualMailQueue(MailQueue):
+    """A mail queue which delivers messages only when told so, without threads."""
+
+    def __init__(self, **kwargs):
+        super(ManualMailQueue, self).__init__(**kwargs)
+        self.clock = task.Clock()
+        self.jobs = []
+        self.delivered = []
+        self.broken = False
+
+    def _defer(self, fn, *args):
+        d = defer.Deferred()
+        self.jobs.append((d, args))
+        return d
+
+    def _deliver(self, sender, recipients, message):
+        if self.broken:
+            raise IOError('connection refused')
+
+        self.delivered.append((sender, recipients, message))
+        return {}
+
+    def run_next(self):
+        d, args = self.jobs.pop(0)
+        defer.maybeDeferred(self._deliver, *args).chainDeferred(d)
+
+
+class SyncMailNotifier(AsyncMailNotifier):
+    """A notifier which renders messages in the calling thread."""
+
+    def _defer(self, fn, *args):
+        return defer.maybeDeferred(fn, *args)
+
+
+class SyncRoutedMailNotifier(RoutedMailNotifier):
+    """A routed notifier which renders messages in the calling thread."""
+
+    def _defer(self, fn, *args):
+        return defer.maybeDeferred(fn, *args)
+
+
+def test_send_limits_concurrent_deliveries():
+    queue = ManualMailQueue(max_connections=2)
+    results = []
+
+    for i in range(3):
+        queue.send('bot@example.com', ['dev@example.com'], 'message %d' % i).addCallback(
+            results.append)
+
+    assert len(queue.jobs) == 2
+    assert queue.queue_depth == 1
+
+    queue.run_next()
+
+    assert len(queue.jobs) == 2
+    assert queue.queue_depth == 0
+
+    queue.run_next()
+    queue.run_next()
+
+    assert results == [{}, {}, {}]
+    assert [m for _, _, m in queue.delivered] == ['message 0', 'message 1', 'message 2']
+    assert queue.sent == 3
+
+
+def test_send_drops_messages_when_full():
+    queue = ManualMailQueue(max_connections=1, max_queue=1)
+    failures = []
+
+    for i in range(3):
+        queue.send('bot@example.com', ['dev@example.com'], 'message').addErrback(failures.append)
+
+    assert len(queue.jobs) == 1
+    assert queue.queue_depth == 1
+    assert len(failures) == 1
+    assert failures[0].check(MailQueueFull)
+
+
+def test_send_retries_with_backoff():
+    queue = ManualMailQueue(max_retries=2, backoff=10)
+    queue.broken = True
+    results = []
+
+    queue.send('bot@example.com', ['dev@example.com'], 'message').addCallback(results.append)
+    queue.run_next()
+
+    # The first retry waits 10 seconds.
+    queue.clock.advance(9)
+    assert not queue.jobs
+    queue.clock.advance(1)
+    queue.run_next()
+
+    # The second one waits 20 seconds.
+    queue.clock.advance(19)
+    assert not queue.jobs
+    queue.clock.advance(1)
+
+    queue.broken = False
+    queue.run_next()
+
+    assert results == [{}]
+    assert queue.failures == 0
+
+
+def test_send_gives_up():
+    queue = ManualMailQueue(max_retries=1, backoff=1)
+    queue.broken = True
+    failures = []
+
+    queue.send('bot@example.com', ['dev@example.com'], 'message').addErrback(failures.append)
+    queue.run_next()
+    queue.clock.advance(1)
+    queue.run_next()
+
+    assert len(failures) == 1
+    assert failures[0].check(IOError)
+    assert queue.failures == 1
+    assert not queue.clock.getDelayedCalls()
+
+
+def test_deliver_reuses_connections(smtp_server):
+    queue = MailQueue(port=smtp_server.port)
+
+    queue._deliver('bot@example.com', ['a@example.com'], 'Subject: 1\n\nfirst')
+    queue._deliver('bot@example.com', ['b@example.com'], 'Subject: 2\n\nsecond')
+    queue.stop()
+
+    assert smtp_server.connections == 1
+    assert [(r, d.split('\n')[-1]) for _, r, d in smtp_server.messages] == [
+        (['a@example.com'], 'first'),
+        (['b@example.com'], 'second'),
+    ]
+
+
+def test_deliver_reconnects(smtp_server):
+    queue = MailQueue(port=smtp_server.port)
+
+    queue._deliver('bot@example.com', ['a@example.com'], 'first')
+
+    # Simulate the server dropping the idle connection.
+    queue._connections[0][0].close()
+
+    queue._deliver('bot@example.com', ['a@example.com'], 'second')
+    queue.stop()
+
+    assert smtp_server.connections == 2
+    assert len(smtp_server.messages) == 2
+
+
+def test_deliver_closes_expired_connections(smtp_server):
+    queue = MailQueue(port=smtp_server.port, idle_timeout=0)
+
+    queue._deliver('bot@example.com', ['a@example.com'], 'first')
+    queue._deliver('bot@example.com', ['a@example.com'], 'second')
+    queue.stop()
+
+    assert smtp_server.connections == 2
+
+
+def test_notifier_renders_once_per_build():
+    formatter = MagicMock(return_value={'body': 'Build failed', 'type': 'plain'})
+    notifier = SyncMailNotifier(fromaddr='bot@example.com', extraRecipients=['dev@example.com'],
+                                messageFormatter=formatter, sendToInterestedUsers=False)
+    mock_notifier(notifier)
+
+    build = mock_build('builder', FAILURE)
+
+    notifier.buildMessage('builder', [build], FAILURE)
+
+    assert formatter.call_count == 1
+    assert notifier.sendMessage.call_count == 1
+
+    message, recipients = notifier.sendMessage.call_args[0]
+    assert recipients == ['dev@example.com']
+    assert message.get_payload() == 'Build failed\n\n'
+
+
+def test_routed_notifier_routes():
+    notifier = RoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['admin@example.com'])
+    notifier.add_route(['dev@example.com', 'admin@example.com'], builders=['a'],
+                       mode=['failing'])
+    notifier.add_route(['qa@example.com'], builders=['a', 'b'], mode=['change'])
+
+    previous = mock_build('a', SUCCESS)
+    notifier.getPreviousBuild = MagicMock(return_value=previous)
+
+    assert notifier.recipients(mock_build('a', FAILURE), FAILURE) == [
+        'admin@example.com', 'dev@example.com', 'qa@example.com']
+    assert notifier.recipients(mock_build('a', SUCCESS), SUCCESS) == ['admin@example.com']
+    assert notifier.recipients(mock_build('b', FAILURE), FAILURE) == [
+        'admin@example.com', 'qa@example.com']
+    assert notifier.recipients(mock_build('c', FAILURE), FAILURE) == ['admin@example.com']
+
+
+def test_routed_notifier_skips_previous_build():
+    notifier = RoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['dev@example.com'], builders=['a'], mode=['failing'])
+    notifier.getPreviousBuild = MagicMock()
+
+    assert not notifier.isMailNeeded(mock_build('a', SUCCESS), SUCCESS)
+    assert notifier.isMailNeeded(mock_build('a', FAILURE), FAILURE)
+    assert not notifier.getPreviousBuild.called
+
+
+def test_routed_notifier_renders_once():
+    formatter = MagicMock(return_value={'body': 'Build failed', 'type': 'plain'})
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com', messageFormatter=formatter)
+    notifier.add_route(['admin@example.com'])
+    notifier.add_route(['dev@example.com', 'admin@example.com'], builders=['a'],
+                       mode=['failing'])
+    mock_notifier(notifier)
+
+    notifier.buildFinished('a', mock_build('a', FAILURE), FAILURE)
+
+    assert formatter.call_count == 1
+    assert notifier.sendMessage.call_count == 1
+
+    message, recipients = notifier.sendMessage.call_args[0]
+    assert sorted(recipients) == ['admin@example.com', 'dev@example.com']
+    assert message['To'] == 'admin@example.com, dev@example.com'
+
+
+def test_routed_notifier_async_emails():
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['a@example.com'], builders=['a'])
+    notifier.add_route(['b@example.com'], builders=['b'])
+    mock_notifier(notifier)
+
+    # Emails are created asynchronously, as with extraHeaders.
+    created = []
+    create_email = notifier.createEmail
+
+    def createEmail(*args):
+        d = defer.Deferred()
+        created.append((d, args))
+        return d
+
+    notifier.createEmail = createEmail
+    notifier.buildFinished('a', mock_build('a', FAILURE), FAILURE)
+    notifier.buildFinished('b', mock_build('b', SUCCESS), SUCCESS)
+
+    for d, args in reversed(created):
+        create_email(*args).chainDeferred(d)
+
+    sent = [(m['To'], recipients) for (m, recipients), _ in notifier.sendMessage.call_args_list]
+    assert sent == [('b@example.com', ['b@example.com']), ('a@example.com', ['a@example.com'])]
+
+
+def test_routed_notifier_invalid_route():
+    notifier = RoutedMailNotifier(fromaddr='bot@example.com')
+
+    with pytest.raises(ConfigErrors):
+        notifier.add_route(['not an email'])
+
+    with pytest.raises(ConfigErrors):
+        notifier.add_route(['dev@example.com'], mode=['sometimes'])
+
+
+def test_digest_waits_interval():
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['admin@example.com'], digest=MailDigest(interval=60))
+    notifier.clock = task.Clock()
+    mock_notifier(notifier)
+
+    notifier.buildFinished('a', mock_build('a', SUCCESS), SUCCESS)
+    notifier.clock.advance(30)
+    notifier.buildFinished('b', mock_build('b', SUCCESS), SUCCESS)
+
+    assert not notifier.sendMessage.called
+
+    notifier.clock.advance(30)
+
+    assert notifier.sendMessage.call_count == 1
+
+    message, recipients = notifier.sendMessage.call_args[0]
+    assert recipients == ['admin@example.com']
+    assert message['To'] == 'admin@example.com'
+    assert message['Subject'] == '[BuildBot] 2 builds, 0 failed'
+    assert not notifier.clock.getDelayedCalls()
+
+
+def test_digest_max_builds():
+    digest = MailDigest(max_builds=2)
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['admin@example.com'], digest=digest)
+    notifier.clock = task.Clock()
+    mock_notifier(notifier)
+
+    for name in ('a', 'b', 'c'):
+        notifier.buildFinished(name, mock_build(name, SUCCESS), SUCCESS)
+
+    assert notifier.sendMessage.call_count == 1
+    assert [b['builder'] for b in digest.builds] == ['c']
+    assert len(notifier.clock.getDelayedCalls()) == 1
+
+
+def test_digest_immediate_failures():
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['admin@example.com'], digest=MailDigest(immediate_failures=True))
+    notifier.add_route(['boss@example.com'], digest=MailDigest(immediate_failures=False))
+    notifier.clock = task.Clock()
+    mock_notifier(notifier)
+
+    notifier.buildFinished('a', mock_build('a', SUCCESS), SUCCESS)
+
+    assert not notifier.sendMessage.called
+
+    notifier.buildFinished('a', mock_build('a', FAILURE), FAILURE)
+
+    assert notifier.sendMessage.call_count == 1
+    assert notifier.sendMessage.call_args[0][1] == ['admin@example.com']
+
+
+def test_digest_flushed_on_stop():
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['admin@example.com'], digest=MailDigest())
+    notifier.clock = task.Clock()
+    mock_notifier(notifier)
+
+    notifier.startService()
+    notifier.buildFinished('a', mock_build('a', SUCCESS), SUCCESS)
+    notifier.stopService()
+
+    assert notifier.sendMessage.call_count == 1
+    assert not notifier.clock.getDelayedCalls()
+
+
+def test_stop_waits_for_digests():
+    notifier = SyncRoutedMailNotifier(fromaddr='bot@example.com')
+    notifier.add_route(['admin@example.com'], digest=MailDigest())
+    notifier.clock = task.Clock()
+    mock_notifier(notifier)
+    sent = defer.Deferred()
+    notifier.sendMessage.return_value = sent
+
+    notifier.startService()
+    notifier.buildFinished('a', mock_build('a', SUCCESS), SUCCESS)
+    stopped = []
+    notifier.stopService().addCallback(stopped.append)
+
+    assert not stopped
+
+    sent.callback(None)
+
+    assert len(stopped) == 1
+
+
+def test_render_time_logged_by_caller():
+    notifier = SyncMailNotifier(fromaddr='bot@example.com')
+    result = []
+
+    with patch('positronic.brain.notifier.MetricTimeEvent') as metric:
+        notifier._defer_timed(lambda a, b: a + b, 1, 2).addCallback(result.append)
+
+    assert result == [3]
+    assert metric.log.call_args[0][0] == 'positronic.mail.render_time'
+
+
+# Support Functions
+
+
+def mock_notifier(notifier):
+    notifier.master_status = MagicMock()
+    notifier.master_status.getTitle.return_value = 'BuildBot'
+    notifier.master_status.getURLForThing.return_value = 'http://localhost:8080/build/1'
+    notifier.sendMessage = MagicMock(return_value=defer.succeed(None))
+
+
+def mock_build(builder, results):
+    build = MagicMock()
+    build.getBuilder().name = builder
+    build.getResults.return_value = results
+    build.getNumber.return_value = 1
+    build.getReason.return_value = 'running a test'
+    build.getSlavename.return_value = 'worker'
+    build.getSourceStamps.return_value = []
+    build.getTimes.return_value = (0, 0)
+    build.results = results
+
+    return build
+
+
+class RecordingSMTPServer(smtpd.SMTPServer):
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+
+    def handle_accept(self):
+        pair = self.accept()
+
+        if pair is not None:
+            self.connections += 1
+            smtpd.SMTPChannel(self, *pair)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+@pytest.fixture
+def smtp_server():
+    server = RecordingSMTPServer()
+    stopped = threading.Event()
+
+    def serve():
+        while not stopped.is_set():
+            asyncore.loop(timeout=0.01, count=1)
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+
+    yield server
+
+    stopped.set()
+    thread.join()
+    asyncore.close_all()
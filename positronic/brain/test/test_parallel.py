@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import subprocess
+import sys
+
+import pytest
+from buildbot.config import ConfigErrors
+from buildbot.status.results import FAILURE, SUCCESS, WARNINGS
+from mock import MagicMock
+
+from positronic.brain.job.freestyle import FreestyleJob
+from positronic.brain.job.matrix import MatrixJob
+from positronic.brain.parallel import ParallelCommands
+from positronic.brain.transfer import WORKER_BOOTSTRAP, worker_script
+
+
+def test_parallel_block():
+    job = FreestyleJob('test-parallel', ['worker'])
+    job.command('make')
+
+    with job.parallel(limit=2):
+        job.command('make', 'lint')
+        job.command('make', 'check', env={'A': '1'}, haltOnFailure=False)
+
+    job.command('make', 'install')
+
+    steps = job.build.steps
+    assert [s.factory.__name__ for s in steps[-3:]] == [
+        'ShellCommand', 'ParallelCommands', 'ShellCommand']
+
+    parallel = steps[-2].buildStep()
+    assert parallel.limit == 2
+    assert [c['command'] for c in parallel.commands] == [['make', 'lint'], ['make', 'check']]
+    assert parallel.commands[1]['env']['A'] == '1'
+    assert parallel.commands[1]['env']['CI'] == '1'
+    assert not parallel.commands[1]['haltOnFailure']
+
+    with pytest.raises(ConfigErrors):
+        with job.parallel():
+            job.command('make', timeout=10)
+
+
+def test_parallel_matrix():
+    job = MatrixJob('test-parallel-matrix', [('platform', ['linux', 'windows'])], ['worker'])
+
+    with job.parallel():
+        job.command('make', 'lint')
+        job.command('make', 'check')
+
+    for cell in job.cells.values():
+        assert cell.build.steps[-1].factory is ParallelCommands
+        assert len(cell.build.steps[-1].args[0]) == 2
+
+
+def test_command_names():
+    step = ParallelCommands([
+        {'command': ['make', 'check']},
+        {'command': ['make', 'check']},
+        {'command': ['make', 'docs'], 'name': 'docs'},
+    ])
+
+    assert [c['name'] for c in step.commands] == ['make check', 'make check (2)', 'docs']
+    assert step.commands[0]['haltOnFailure']
+    assert step.commands[0]['flunkOnFailure']
+    assert step.commands[0]['env'] == {}
+
+    with pytest.raises(ConfigErrors):
+        ParallelCommands([], limit=0)
+
+
+def test_evaluate():
+    step = make_step(
+        {'command': ['a']},
+        {'command': ['b'], 'flunkOnFailure': False, 'warnOnFailure': True},
+        {'command': ['c'], 'haltOnFailure': False},
+    )
+
+    assert step.evaluate(outcomes(0, 0, 0)) == SUCCESS
+    assert step.evaluate(outcomes(0, 1, 0)) == WARNINGS
+    assert not step.haltOnFailure
+
+    assert step.evaluate(outcomes(0, 1, 2)) == FAILURE
+    assert not step.haltOnFailure
+
+    assert step.evaluate(outcomes(1, 0, None)) == FAILURE
+    assert step.haltOnFailure
+    step.step_status.setText.assert_called_with(['1/3 commands passed', '1 skipped'])
+
+
+def test_worker_script(tmpdir):
+    commands = [
+        {'command': [sys.executable, '-c', 'import os; print(os.environ["A"])'],
+         'env': {'A': 'first'}, 'log': 'logs/0.log', 'halt': False},
+        {'command': [sys.executable, '-c', 'import sys; sys.exit(3)'],
+         'env': {}, 'log': 'logs/1.log', 'halt': False},
+        {'command': ['does-not-exist'], 'env': {}, 'log': 'logs/2.log', 'halt': False},
+    ]
+
+    results = run_worker_script(str(tmpdir), commands, None)
+
+    assert [r['rc'] for r in results] == [0, 3, 127]
+    assert tmpdir.join('logs', '0.log').read().strip() == 'first'
+    assert tmpdir.join('logs', '2.log').read()
+
+
+def test_worker_script_halt(tmpdir):
+    commands = [
+        {'command': [sys.executable, '-c', 'import sys; sys.exit(1)'],
+         'env': {}, 'log': '0.log', 'halt': True},
+        {'command': [sys.executable, '-c', 'pass'], 'env': {}, 'log': '1.log', 'halt': True},
+    ]
+
+    results = run_worker_script(str(tmpdir), commands, 1)
+
+    assert [r['rc'] for r in results] == [1, None]
+    assert not tmpdir.join('1.log').check()
+
+
+# Support Functions
+
+
+def make_step(*commands):
+    step = ParallelCommands(list(commands))
+    step.step_status = MagicMock()
+
+    return step
+
+
+def outcomes(*codes):
+    return [{'rc': rc, 'duration': 1} for rc in codes]
+
+
+def run_worker_script(cwd, commands, limit):
+    p = subprocess.Popen([sys.executable, '-c', WORKER_BOOTSTRAP], cwd=cwd,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = p.communicate(worker_script('parallel.py', 'run_parallel', commands, limit))
+
+    assert p.returncode == 0
+
+    return json.loads(out.strip().splitlines()[-1])
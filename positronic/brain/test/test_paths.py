@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import random
+
+from mock import MagicMock
+
+import fnmatch
+import re
+
+from positronic.brain.paths import PathIndex, PathMatcher, glob_regex, split_path
+from positronic.brain.utils import is_dir_in_change
+
+
+def test_split_path():
+    assert split_path('a/b/c.py') == ['a', 'b', 'c.py']
+    assert split_path('/a//b/./c.py') == ['a', 'b', 'c.py']
+    assert split_path('a/b/') == ['a', 'b']
+    assert split_path('/') == []
+
+
+def test_glob_regex():
+    for pattern in ('*.py', 'a?c', '[ab]*', '[!ab]*', '[]a]', '[!]a]', '[a-c]x', '[', 'a[b',
+                    'a.b', '[^a]', 'a+b'):
+        regex = re.compile(glob_regex(pattern) + r'\Z')
+
+        for name in ('a.py', 'abc', 'bcd', 'cde', ']', 'a', 'bx', '[', 'a[b', 'a.b', 'axb', '^',
+                     'a+b', 'x'):
+            assert bool(regex.match(name)) == fnmatch.fnmatchcase(name, pattern), (pattern, name)
+
+
+def test_directories():
+    m = PathMatcher(['test_dir1', 'lib/core/'])
+
+    assert m.matches('test_dir1/file1.py')
+    assert m.matches('test_dir1/sub/file1.py')
+    assert m.matches('lib/core/a.c')
+    assert not m.matches('test_dir/file1.py')
+    assert not m.matches('test_dir10/file1.py')
+    assert not m.matches('lib/a.c')
+    assert not m.matches('lib/core2/a.c')
+
+    # Single files can be watched too.
+    assert m.matches('test_dir1')
+
+
+def test_globs():
+    m = PathMatcher(['src/*/tests', '*.cfg', 'docs/**/*.rst'])
+
+    assert m.matches('src/foo/tests/test_foo.py')
+    assert not m.matches('src/foo/bar/tests/test_foo.py')
+    assert not m.matches('src/tests/test_foo.py')
+    assert m.matches('setup.cfg')
+    assert not m.matches('conf/setup.cfg')
+    assert m.matches('docs/index.rst')
+    assert m.matches('docs/api/v1/index.rst')
+    assert not m.matches('docs/api/v1/index.txt')
+    assert not m.matches('index.rst')
+
+
+def test_recursive_glob_anywhere():
+    m = PathMatcher(['**/*.h'])
+
+    assert m.matches('a.h')
+    assert m.matches('include/a/b/c.h')
+    assert not m.matches('include/a/b/c.c')
+
+
+def test_exclusions():
+    m = PathMatcher(['src', '!src/generated', '!**/*.md'])
+
+    assert m.matches('src/main.c')
+    assert not m.matches('src/generated/parser.c')
+    assert not m.matches('src/README.md')
+    assert not m.matches('docs/index.rst')
+
+
+def test_only_exclusions():
+    m = PathMatcher(['!docs'])
+
+    assert m.matches('src/main.c')
+    assert not m.matches('docs/index.rst')
+
+
+def test_change_filter():
+    m = PathMatcher(['test_dir1'])
+
+    assert m(mock_change(['test_dir2/file2.py', 'test_dir1/file1.py']))
+    assert not m(mock_change(['test_dir2/file2.py']))
+    assert not m(mock_change([]))
+
+
+def test_compatible_with_is_dir_in_change():
+    rnd = random.Random(0)
+    names = ['a', 'b', 'ab', 'c']
+
+    for _ in range(500):
+        files = ['/'.join(rnd.choice(names) for _ in range(rnd.randint(2, 4)))
+                 for _ in range(rnd.randint(1, 3))]
+        dirs = ['/'.join(rnd.choice(names) for _ in range(rnd.randint(1, 2)))
+                for _ in range(rnd.randint(1, 3))]
+        change = mock_change(files)
+
+        # PathMatcher also matches files named like a directory, which is_dir_in_change ignores.
+        if any(f in dirs for f in files):
+            continue
+
+        assert PathMatcher(dirs)(change) == is_dir_in_change(dirs, change)
+
+
+def test_path_index():
+    index = PathIndex()
+    index.add(['src', '!src/generated'], 'a')
+    index.add(['src/*/tests', 'docs/**/*.rst'], 'b')
+    index.add(['!docs'], 'c')
+
+    assert index.lookup([]) == set()
+    assert index.lookup(['src/main.c']) == set(['a', 'c'])
+    assert index.lookup(['src/generated/parser.c']) == set(['c'])
+    assert index.lookup(['src/foo/tests/test.c']) == set(['a', 'b', 'c'])
+    assert index.lookup(['docs/api/index.rst']) == set(['b'])
+    assert index.lookup(['docs/api/index.rst', 'src/generated/parser.c']) == set(['b', 'c'])
+
+
+def test_path_index_matches_path_matcher():
+    rnd = random.Random(0)
+    names = ['a', 'b', 'ab', '*', 'a*', '**', '!a', '!b']
+
+    for _ in range(300):
+        pattern_sets = [['/'.join(rnd.choice(names) for _ in range(rnd.randint(1, 3)))
+                         for _ in range(rnd.randint(1, 3))] for _ in range(4)]
+        pattern_sets = [[p if '!' not in p[1:] else p.replace('!', '') for p in patterns]
+                        for patterns in pattern_sets]
+        files = ['/'.join(rnd.choice('abc') for _ in range(rnd.randint(1, 4)))
+                 for _ in range(rnd.randint(1, 3))]
+
+        index = PathIndex()
+
+        for i, patterns in enumerate(pattern_sets):
+            index.add(patterns, i)
+
+        expected = set(i for i, patterns in enumerate(pattern_sets)
+                       if PathMatcher(patterns)(mock_change(files)))
+
+        assert index.lookup(files) == expected, (pattern_sets, files)
+
+
+# Support Functions
+
+
+def mock_change(files):
+    change = MagicMock()
+    change.files = files
+    return change
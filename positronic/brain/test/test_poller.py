@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from mock import MagicMock, patch
+from twisted.internet import defer, task
+
+from positronic.brain.config import BrainConfig, BuildmasterConfig
+from positronic.brain.job.freestyle import FreestyleJob
+from positronic.brain.poller import SVNRepositoryPoller, get_svn_poller
+
+
+def test_split_branch():
+    poller = SVNRepositoryPoller('svn://example.com/repo/')
+    poller.add_branch('trunk')
+    poller.add_branch('branches/1.0/')
+    poller.add_branch('branches/1.0/sub')
+
+    assert poller.split_branch('trunk/src/a.c') == {
+        'branch': 'trunk', 'path': 'src/a.c', 'repository': 'svn://example.com/repo/trunk'}
+    assert poller.split_branch('branches/1.0/src/') == {
+        'branch': 'branches/1.0', 'path': 'src/', 'repository': 'svn://example.com/repo/branches/1.0'}
+    assert poller.split_branch('branches/1.0/sub/a.c')['branch'] == 'branches/1.0/sub'
+    assert poller.split_branch('branches/2.0/a.c') is None
+    assert poller.split_branch('tags/1.0/a.c') is None
+
+
+def test_watch_normalizes_urls():
+    router = MagicMock()
+
+    with patch.dict(BrainConfig, {'basedir': '/tmp', 'changeRouter': router}), \
+            patch.dict(BuildmasterConfig, {'change_source': []}):
+        job = FreestyleJob('test-watch-slashes', ['worker'])
+        job.watch('svn://example.com/slashes/', '/trunk/')
+
+        poller = get_svn_poller('svn://example.com/slashes')
+
+    repository = router.add_repository.call_args[0][0]
+
+    assert repository == 'svn://example.com/slashes/trunk'
+    assert poller.split_branch('trunk/a.c')['repository'] == repository
+
+
+def test_pushed_changes():
+    poller = SVNRepositoryPoller('svn://example.com/root/project')
+    poller.add_branch('trunk')
+    poller.add_branch('branches/1.0')
+
+    changes = poller.pushed_changes('svn://example.com/root/', '42', 'dev', 'commit', [
+        'project/trunk/a.c',
+        'project/branches/1.0/b.c',
+        'project/trunk/src/',
+        'project/tags/1.0/',
+        'other/trunk/c.c',
+    ])
+
+    assert changes == [
+        dict(author='dev', comments='commit', files=['a.c', 'src/'], revision='42',
+             branch='trunk', repository='svn://example.com/root/project/trunk'),
+        dict(author='dev', comments='commit', files=['b.c'], revision='42',
+             branch='branches/1.0', repository='svn://example.com/root/project/branches/1.0'),
+    ]
+
+    changes = poller.pushed_changes('svn://example.com/root/project', '42', 'dev', 'commit',
+                                    ['trunk/a.c'])
+
+    assert [c['repository'] for c in changes] == ['svn://example.com/root/project/trunk']
+
+
+def test_push_disables_polling():
+    poller = make_poller()
+    poller.enable_push()
+
+    poller.startLoop()
+    poller._reactor.advance(600)
+
+    assert poller.args == []
+    assert not poller._reactor.getDelayedCalls()
+
+
+def test_poll_fetches_all_new_revisions():
+    poller = make_poller()
+
+    poller.output = log_xml((10, 'trunk/a.c'))
+    poller.poll()
+
+    assert '--limit=1' in poller.args[-1]
+    assert not poller.master.addChange.called
+
+    poller.output = log_xml((13, 'branches/1.0/b.c'), (12, 'tags/1.0/'), (11, 'trunk/a.c'),
+                            (10, 'trunk/a.c'))
+    poller.poll()
+
+    assert '--revision=HEAD:10' in poller.args[-1]
+    assert '--limit=1' not in poller.args[-1]
+    assert [(c[1]['revision'], c[1]['repository'], c[1]['files'])
+            for c in poller.master.addChange.call_args_list] == [
+        ('11', 'svn://example.com/repo/trunk', ['a.c']),
+        ('13', 'svn://example.com/repo/branches/1.0', ['b.c']),
+    ]
+
+
+def test_poll_interval_adapts():
+    poller = make_poller(min_interval=60, max_interval=600)
+    poller.pollInterval = 300
+    poller.output = log_xml((10, 'trunk/a.c'))
+
+    poller.startLoop()
+    poller._reactor.advance(300)
+
+    # No new revisions: we slow down, up to max_interval.
+    assert poller.pollInterval == 450
+    poller._reactor.advance(450)
+    assert poller.pollInterval == 600
+    poller._reactor.advance(600)
+    assert poller.pollInterval == 600
+
+    # New revisions: we speed up, down to min_interval.
+    poller.output = log_xml((11, 'trunk/a.c'), (10, 'trunk/a.c'))
+    poller._reactor.advance(600)
+    assert poller.pollInterval == 300
+
+    poller.output = log_xml((12, 'trunk/a.c'), (11, 'trunk/a.c'))
+    poller._reactor.advance(300)
+    poller.output = log_xml((13, 'trunk/a.c'), (12, 'trunk/a.c'))
+    poller._reactor.advance(150)
+    poller.output = log_xml((14, 'trunk/a.c'), (13, 'trunk/a.c'))
+    poller._reactor.advance(75)
+    assert poller.pollInterval == 60
+
+    poller.stopLoop()
+    assert not poller._reactor.getDelayedCalls()
+
+
+# Support Functions
+
+
+def make_poller(**kwargs):
+    poller = SVNRepositoryPoller('svn://example.com/repo', **kwargs)
+    poller.add_branch('trunk')
+    poller.add_branch('branches/1.0')
+    poller._prefix = ''
+    poller._reactor = task.Clock()
+    poller.master = MagicMock()
+    poller.master.addChange.return_value = defer.succeed(None)
+    poller.args = []
+
+    def getProcessOutput(args):
+        poller.args.append(' '.join(args))
+        return defer.succeed(poller.output)
+
+    poller.getProcessOutput = getProcessOutput
+
+    return poller
+
+
+def log_xml(*revisions):
+    entries = ''.join(
+        '<logentry revision="%d"><author>dev</author><date>2015-01-01T00:00:00.000000Z</date>'
+        '<paths><path kind="file" action="M">/%s</path></paths><msg>commit</msg></logentry>' %
+        (revision, path) for revision, path in revisions)
+
+    return '<?xml version="1.0"?><log>%s</log>' % entries
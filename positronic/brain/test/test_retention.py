@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+
+import pytest
+
+from buildbot.status.results import FAILURE
+
+from positronic.brain.manifest import ArtifactManifest
+from positronic.brain.retention import DiskUsage, RetentionEngine, RetentionPolicy
+
+
+NOW = 1000000
+
+
+def test_invalid_policy():
+    with pytest.raises(AssertionError):
+        RetentionPolicy(max_artifacts=0)
+
+    with pytest.raises(AssertionError):
+        RetentionPolicy(evict='random')
+
+
+def test_max_artifacts(tmpdir):
+    m = create_manifest(str(tmpdir), [10, 10, 10, 10])
+
+    assert evicted(RetentionPolicy(max_artifacts=2), [m]) == [0, 1]
+    assert evicted(RetentionPolicy(max_artifacts=None), [m]) == []
+
+
+def test_empty_builds(tmpdir):
+    m = create_manifest(str(tmpdir), [10, 0, 10])
+
+    assert evicted(RetentionPolicy(), [m]) == [1]
+
+
+def test_max_age(tmpdir):
+    m = create_manifest(str(tmpdir), [10, 10, 10], ages=[300, 200, 100])
+
+    assert evicted(RetentionPolicy(max_age=150), [m]) == [0, 1]
+
+
+def test_max_builder_bytes(tmpdir):
+    m = create_manifest(str(tmpdir), [10, 20, 30, 40])
+
+    assert evicted(RetentionPolicy(max_builder_bytes=75), [m]) == [0, 1]
+
+
+def test_max_bytes_evicts_oldest_across_builders(tmpdir):
+    m1 = create_manifest(str(tmpdir.join('a')), [10, 10], ages=[400, 100])
+    m2 = create_manifest(str(tmpdir.join('b')), [10, 10], ages=[300, 200])
+
+    policy = RetentionPolicy(max_bytes=25, keep_last_successful=False)
+    evictions = policy.evictions([m1, m2], NOW)
+
+    assert [(m.root, n) for m, n in evictions] == [(m1.root, 0), (m2.root, 0)]
+
+
+def test_max_bytes_lru(tmpdir):
+    m = create_manifest(str(tmpdir), [10, 10, 10], ages=[300, 200, 100])
+
+    # Build 0 has been accessed recently, while build 1 hasn't.
+    os.utime(os.path.join(m.root, '0'), (NOW - 10, NOW - 300))
+    os.utime(os.path.join(m.root, '1'), (NOW - 200, NOW - 200))
+
+    assert evicted(RetentionPolicy(max_bytes=20, evict='lru'), [m]) == [1]
+    assert evicted(RetentionPolicy(max_bytes=20, evict='oldest'), [m]) == [0]
+
+
+def test_linked_files_count_once(tmpdir):
+    m1 = create_manifest(str(tmpdir.join('a')), [10, 10], ages=[300, 200])
+    m2 = create_manifest(str(tmpdir.join('b')), [10], ages=[100])
+
+    # Build 1 of 'a' links the file of build 0, and the build of 'b' links both.
+    link(str(tmpdir.join('a', '0', 'artifact')), str(tmpdir.join('a', '1', 'artifact')))
+    link(str(tmpdir.join('a', '0', 'artifact')), str(tmpdir.join('b', '0', 'a0')))
+    m1 = refreshed(m1)
+    m2 = refreshed(m2)
+
+    usage = DiskUsage([m1, m2])
+    assert usage.builder_size(m1) == 10
+    assert usage.builder_size(m2) == 20
+    assert usage.size == 20
+
+    assert evicted(RetentionPolicy(max_builder_bytes=10, keep_last_successful=False), [m1]) == []
+    assert evicted(RetentionPolicy(max_bytes=20, keep_last_successful=False), [m1, m2]) == []
+
+    # Removing the builds of 'a' frees nothing, since 'b' still links their file.
+    assert evicted(RetentionPolicy(max_bytes=15, keep_last_successful=False), [m1, m2]) == [0, 1, 0]
+
+
+def test_keep_last_successful(tmpdir):
+    m = create_manifest(str(tmpdir), [10, 10, 10], ages=[300, 200, 100])
+    m.set_result(2, FAILURE)
+
+    assert evicted(RetentionPolicy(max_age=50), [m]) == [0, 2]
+    assert evicted(RetentionPolicy(max_age=50, keep_last_successful=False), [m]) == [0, 1, 2]
+
+
+def test_engine_run(tmpdir):
+    root = str(tmpdir)
+
+    create_manifest(os.path.join(root, 'a'), [10, 10, 10])
+    create_manifest(os.path.join(root, 'b'), [10, 10])
+    os.makedirs(os.path.join(root, '.manifests'))
+
+    engine = RetentionEngine(root, RetentionPolicy(max_artifacts=1))
+    engine.record_result('a', 2, FAILURE)
+
+    # Build 1 of 'a' is kept too, since it's the last successful one.
+    assert engine.run() == 20
+    assert sorted(engine.manifests) == ['a', 'b']
+    assert engine.manifests['a'].numbers() == [1, 2]
+    assert engine.manifests['a'][2]['result'] == FAILURE
+    assert engine.manifests['b'].numbers() == [1]
+    assert engine.size == 30
+
+    assert os.path.exists(os.path.join(root, '.manifests', 'a.json'))
+    assert not os.path.exists(os.path.join(root, 'a', '0'))
+
+
+def test_engine_hashes(tmpdir):
+    root = str(tmpdir)
+    create_manifest(os.path.join(root, 'a'), [10, 10])
+
+    engine = RetentionEngine(root, RetentionPolicy())
+    engine.record_hashes('a', 1, {'artifact': 'digest'})
+
+    assert engine.hashes('a', 1) == {'artifact': 'digest'}
+    assert engine.hashes('a', 0) == {}
+
+    engine.run()
+
+    # Hashes are loaded from disk after a restart.
+    restarted = RetentionEngine(root, RetentionPolicy())
+    assert restarted.hashes('a', 1) == {'artifact': 'digest'}
+    assert restarted.hashes('b', 1) == {}
+
+
+#
+# Support Functions
+#
+
+def create_manifest(root, sizes, ages=None):
+    """Creates one build per size, each with a file of that size, and returns its manifest."""
+    for n, size in enumerate(sizes):
+        p = os.path.join(root, str(n))
+        os.makedirs(p)
+
+        if size:
+            with open(os.path.join(p, 'artifact'), 'w') as f:
+                f.write('x' * size)
+
+        if ages:
+            os.utime(p, (NOW - ages[n], NOW - ages[n]))
+
+    manifest = ArtifactManifest(root)
+    manifest.refresh()
+
+    return manifest
+
+
+def evicted(policy, manifests):
+    return [n for _, n in policy.evictions(manifests, NOW)]
+
+
+def link(src, dest):
+    if os.path.exists(dest):
+        os.remove(dest)
+
+    os.link(src, dest)
+
+
+def refreshed(manifest):
+    fresh = ArtifactManifest(manifest.root)
+    fresh.refresh()
+
+    return fresh
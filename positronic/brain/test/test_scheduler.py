@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from buildbot.test.fake import fakedb
+from buildbot.test.util.scheduler import FakeMaster
+from mock import MagicMock
+from twisted.internet import defer, task
+
+from positronic.brain.scheduler import ChangeRouter, Debounce, is_superseded, merge_requests
+from positronic.brain.transfer import ArtifactUpload
+
+
+def test_route():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.add_repository('svn://example.com/trunk', 'b')
+    router.add_paths(['src'], 'b')
+    router.add_paths(['docs', '!docs/api'], 'c')
+
+    assert router.builderNames == ['a', 'b', 'c']
+    assert router.route(change(1, 'svn://example.com/trunk', ['README'])) == set(['a', 'b'])
+    assert router.route(change(1, 'svn://example.com/branch', ['src/a.c'])) == set(['b'])
+    assert router.route(change(1, 'svn://example.com/branch', ['docs/a.rst'])) == set(['c'])
+    assert router.route(change(1, 'svn://example.com/branch', ['docs/api/a.rst'])) == set()
+
+
+def test_classifies_changes_once():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.add_paths(['src'], 'b')
+
+    router.gotChange(change(1, 'svn://example.com/trunk', ['src/a.c']), True)
+    router.gotChange(change(2, 'svn://example.com/branch', ['README']), True)
+
+    assert router.master.db.schedulers.classifications == {42: {1: True}}
+
+
+def test_tree_stable_timer_per_builder():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.add_paths(['src'], 'b')
+
+    router.gotChange(change(1, 'svn://example.com/trunk', ['src/a.c']), True)
+    router._reactor.advance(30)
+    router.gotChange(change(2, 'svn://example.com/trunk', ['README']), True)
+
+    # Builder b is started 60 seconds after the first change, while a waits for the second one.
+    router._reactor.advance(30)
+
+    assert router.buildsets == [(['b'], [1])]
+    assert router.master.db.schedulers.classifications == {42: {1: True, 2: True}}
+
+    router._reactor.advance(30)
+
+    assert router.buildsets == [(['b'], [1]), (['a'], [1, 2])]
+    assert router.master.db.schedulers.classifications == {42: {}}
+
+
+def test_tree_stable_timer_per_repository():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a', treeStableTimer=2)
+    router.add_repository('svn://example.com/branch', 'a')
+
+    router.gotChange(change(1, 'svn://example.com/branch', ['README']), True)
+    router._reactor.advance(30)
+    router.gotChange(change(2, 'svn://example.com/trunk', ['README']), True)
+    router._reactor.advance(2)
+
+    # Changes from each repository are built in a buildset of their own.
+    assert router.buildsets == [(['a'], [1]), (['a'], [2])]
+
+
+def test_buildset_per_branch():
+    router = make_router()
+    router.add_repository('svn://example.com', 'a')
+
+    router.gotChange(change(1, 'svn://example.com', ['README'], branch='trunk'), True)
+    router.gotChange(change(2, 'svn://example.com', ['README'], branch='stable'), True)
+    router.gotChange(change(3, 'svn://example.com', ['README'], branch='trunk'), True)
+    router._reactor.advance(60)
+
+    assert router.buildsets == [(['a'], [1, 3]), (['a'], [2])]
+
+
+def test_restart_builds_changes_once():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.add_paths(['src'], 'b')
+
+    router.master.db.insertTestData([
+        fakedb.Change(changeid=1, repository='svn://example.com/trunk'),
+        fakedb.ChangeFile(changeid=1, filename='src/a.c'),
+    ])
+    router.gotChange(change(1, 'svn://example.com/trunk', ['src/a.c']), True)
+    router._reactor.advance(30)
+    router.gotChange(change(2, 'svn://example.com/trunk', ['README']), True)
+    router._reactor.advance(30)
+
+    assert router.buildsets == [(['b'], [1])]
+
+    # The master restarts while change 1 is still classified for builder a.
+    restarted = make_router()
+    restarted.master = router.master
+    restarted.add_repository('svn://example.com/trunk', 'a')
+    restarted.add_paths(['src'], 'b')
+    restarted.scanExistingClassifiedChanges()
+    restarted._reactor.advance(60)
+
+    assert restarted.buildsets == [(['a'], [1])]
+
+
+def test_unimportant_changes_dont_start_timers():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+
+    router.gotChange(change(1, 'svn://example.com/trunk', ['README']), False)
+    router._reactor.advance(60)
+
+    assert router.buildsets == []
+
+
+def test_debounce():
+    debounce = Debounce(min_delay=5, max_delay=60, max_wait=300)
+
+    assert debounce.delay(1, 0) == 5
+    assert debounce.delay(2, 3) == 10
+    assert debounce.delay(4, 30) == 40
+    assert debounce.delay(10, 100) == 60
+    assert debounce.delay(10, 280) == 20
+    assert debounce.delay(10, 400) == 0
+
+
+def test_lone_change_is_built_quickly():
+    router = make_router(Debounce(min_delay=5, max_delay=60))
+    router.add_repository('svn://example.com/trunk', 'a')
+
+    router.gotChange(change(1, 'svn://example.com/trunk', ['README']), True)
+    router._reactor.advance(5)
+
+    assert router.buildsets == [(['a'], [1])]
+
+
+def test_bursts_are_coalesced():
+    router = make_router(Debounce(min_delay=5, max_delay=60, max_wait=50))
+    router.add_repository('svn://example.com/trunk', 'a')
+
+    # Each change doubles the delay: 5, 10, 20, 40, then 60 seconds at most.
+    for number in xrange(1, 6):
+        router.gotChange(change(number, 'svn://example.com/trunk', ['README']), True)
+        router._reactor.advance(4)
+
+    assert router.buildsets == []
+
+    # The first change came in 20 seconds ago, and may wait 50 seconds at most.
+    router._reactor.advance(29)
+    assert router.buildsets == []
+
+    router._reactor.advance(1)
+    assert router.buildsets == [(['a'], [1, 2, 3, 4, 5])]
+
+
+def test_debounce_per_builder():
+    router = make_router(Debounce(min_delay=60, max_delay=60))
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.add_repository('svn://example.com/trunk', 'b')
+    router.set_debounce('b', Debounce(min_delay=1))
+
+    router.gotChange(change(1, 'svn://example.com/trunk', ['README']), True)
+    router._reactor.advance(1)
+
+    assert router.buildsets == [(['b'], [1])]
+
+
+def test_is_superseded():
+    trunk = ('svn://example.com/trunk', None)
+
+    assert is_superseded(request(('svn://example.com/trunk', [1, 2])), trunk, 3)
+    assert not is_superseded(request(('svn://example.com/trunk', [1, 3])), trunk, 3)
+    assert not is_superseded(request(('svn://example.com/branch', [1])), trunk, 3)
+    assert not is_superseded(request(('svn://example.com/trunk', [])), trunk, 3)
+    assert not is_superseded(request(('svn://example.com/trunk', [1], 'stable')), trunk, 3)
+
+
+def test_cancel_superseded_requests():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.set_cancel_superseded('a')
+
+    router.master.db.insertTestData([
+        fakedb.SourceStampSet(id=1),
+        fakedb.SourceStamp(id=1, sourcestampsetid=1, repository='svn://example.com/trunk',
+                           branch=None),
+        fakedb.Change(changeid=1, repository='svn://example.com/trunk'),
+        fakedb.SourceStampChange(sourcestampid=1, changeid=1),
+        fakedb.Buildset(id=1, sourcestampsetid=1),
+        fakedb.BuildRequest(id=1, buildsetid=1, buildername='a'),
+        # A forced build.
+        fakedb.SourceStampSet(id=2),
+        fakedb.SourceStamp(id=2, sourcestampsetid=2, repository='svn://example.com/trunk'),
+        fakedb.Buildset(id=2, sourcestampsetid=2),
+        fakedb.BuildRequest(id=2, buildsetid=2, buildername='a'),
+    ])
+
+    completed = []
+
+    def completeBuildRequests(brids, results):
+        completed.extend(brids)
+        return defer.succeed(None)
+
+    router.master.db.buildrequests.completeBuildRequests = completeBuildRequests
+
+    router.gotChange(change(2, 'svn://example.com/trunk', ['README']), True)
+    router._reactor.advance(60)
+
+    assert router.buildsets == [(['a'], [2])]
+    assert completed == [1]
+    assert not router.master.botmaster.builders.get.called
+
+
+def test_interrupt_superseded_builds():
+    router = make_router()
+    router.add_repository('svn://example.com/trunk', 'a')
+    router.set_cancel_superseded('a', running=True)
+
+    old = build([request(('svn://example.com/trunk', [1]))], [ArtifactUpload(slavesrc='a',
+                                                                             masterdest='b')])
+    uploading = build([request(('svn://example.com/trunk', [1]))], [])
+    forced = build([request(('svn://example.com/trunk', []))], [ArtifactUpload(slavesrc='a',
+                                                                               masterdest='b')])
+    router.master.botmaster.builders.get.return_value.building = [old, uploading, forced]
+
+    router.gotChange(change(2, 'svn://example.com/trunk', ['README']), True)
+    router._reactor.advance(60)
+
+    router.master.botmaster.builders.get.assert_called_with('a')
+    assert old.stopBuild.called
+    assert not uploading.stopBuild.called
+    assert not forced.stopBuild.called
+
+
+def test_merge_requests():
+    req1, req2 = MagicMock(), MagicMock()
+
+    req1.canBeMergedWith.return_value = True
+    assert merge_requests(None, req1, req2)
+    req1.canBeMergedWith.assert_called_with(req2)
+
+    req1.canBeMergedWith.return_value = False
+    assert not merge_requests(None, req1, req2)
+
+
+# Support Functions
+
+
+def make_router(debounce=Debounce(min_delay=60, max_delay=60)):
+    router = ChangeRouter(name='change-router', debounce=debounce)
+    router._reactor = task.Clock()
+    router.objectid = 42
+    router.master = FakeMaster('basedir', fakedb.FakeDBConnector(None))
+    router.master.botmaster = MagicMock()
+    router.master.maybeBuildsetComplete = lambda bsid: defer.succeed(None)
+    router.buildsets = []
+
+    def addBuildsetForChanges(reason, changeids, builderNames):
+        router.buildsets.append((builderNames, changeids))
+        return defer.succeed(None)
+
+    router.addBuildsetForChanges = addBuildsetForChanges
+
+    return router
+
+
+def change(number, repository, files, branch=None):
+    c = MagicMock()
+    c.number = number
+    c.repository = repository
+    c.branch = branch
+    c.files = files
+
+    return c
+
+
+def request(*sources):
+    r = MagicMock()
+    r.sources = {}
+
+    for i, source in enumerate(sources):
+        repository, changeids, branch = (source + (None,))[:3]
+        r.sources[str(i)] = MagicMock(repository=repository, branch=branch,
+                                      changes=[MagicMock(number=n) for n in changeids])
+
+    return r
+
+
+def build(requests, steps):
+    b = MagicMock()
+    b.requests = requests
+    b.steps = steps
+    b.currentStep = None
+
+    return b
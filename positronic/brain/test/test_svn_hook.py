@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+
+import pytest
+from mock import MagicMock
+
+from positronic.brain.poller import SVNRepositoryPoller
+from positronic.brain.status.web import svn_hook
+
+
+def test_get_changes():
+    pushed = SVNRepositoryPoller('svn://example.com/repo/project')
+    pushed.add_branch('trunk')
+    pushed.enable_push()
+
+    polled = SVNRepositoryPoller('svn://example.com/repo/other')
+    polled.add_branch('trunk')
+
+    request = make_request([pushed, polled], repository='svn://example.com/repo/', revision='7',
+                           author='dev', comments='Fix', files=json.dumps([
+                               'project/trunk/a.c', 'other/trunk/b.c']))
+
+    changes, src = svn_hook.getChanges(request)
+
+    assert src == 'svn'
+    assert changes == [dict(author='dev', comments='Fix', files=['a.c'], revision='7',
+                            branch='trunk', repository='svn://example.com/repo/project/trunk')]
+
+
+def test_get_changes_requires_revision():
+    with pytest.raises(ValueError):
+        svn_hook.getChanges(make_request([], repository='svn://example.com/repo'))
+
+
+def test_dialect_is_installed():
+    from twisted.python.reflect import namedModule
+
+    import positronic.brain  # noqa
+
+    assert namedModule('buildbot.status.web.hooks.svn') is svn_hook
+
+
+# Support Functions
+
+
+def make_request(change_sources, **args):
+    request = MagicMock()
+    request.args = dict((k, [v]) for k, v in args.items())
+    request.site.buildbot_service.master.change_svc = change_sources
+
+    return request
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from jinja2 import DictLoader, Environment
+
+from positronic.brain.templating import TEMPLATES_ENV, precompile, setup_templates
+
+
+def test_precompile():
+    env = Environment(loader=DictLoader({'a.html': '{{ a }}', 'b.html': '{{ b }}'}))
+
+    assert precompile(env) == 2
+    assert len(env.cache) == 2
+
+
+def test_setup_templates(tmpdir):
+    setup_templates(str(tmpdir))
+
+    try:
+        # The bytecode of all templates is on disk, ready for the next restart.
+        assert len(tmpdir.join('templates_cache').listdir()) == len(TEMPLATES_ENV.list_templates())
+
+        # Compiled templates are reused.
+        assert TEMPLATES_ENV.get_template('email.jinja2') is \
+            TEMPLATES_ENV.get_template('email.jinja2')
+    finally:
+        TEMPLATES_ENV.bytecode_cache = None
+
+
+def test_web_templates_share_bytecode_cache(tmpdir):
+    from buildbot.status.web import baseweb
+    from positronic.brain.monkeypatch import patch_web_templates
+
+    create_jinja_env = baseweb.createJinjaEnv
+    patch_web_templates()
+    setup_templates(str(tmpdir))
+
+    try:
+        env = baseweb.createJinjaEnv(jinja_loaders=[])
+
+        assert env.bytecode_cache is TEMPLATES_ENV.bytecode_cache
+        assert len(env.cache) == len(env.list_templates())
+    finally:
+        baseweb.createJinjaEnv = create_jinja_env
+        TEMPLATES_ENV.bytecode_cache = None
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+from mock import patch
+
+from positronic.brain.retention import RetentionEngine, RetentionPolicy
+from positronic.brain.transfer import WORKER_BOOTSTRAP, find_identical, find_identical_in_build, \
+    find_unchanged, link_files, link_unchanged, previous_build_dir, worker_script
+
+
+def test_previous_build_dir(tmpdir):
+    root = str(tmpdir)
+
+    for n in ('1', '3', '10'):
+        os.makedirs(os.path.join(root, n))
+
+    assert previous_build_dir(root, 10) == os.path.join(root, '3')
+    assert previous_build_dir(root, 3) == os.path.join(root, '1')
+    assert previous_build_dir(root, 1) is None
+    assert previous_build_dir(os.path.join(root, 'missing'), 1) is None
+
+
+def test_find_unchanged(tmpdir):
+    reference = str(tmpdir)
+
+    create_file(reference, 'same', 'abc', 1000)
+    create_file(reference, 'dir/same', 'abc', 1000)
+    create_file(reference, 'newer', 'abc', 1000)
+    create_file(reference, 'bigger', 'abc', 1000)
+
+    files = {
+        'same': (3, 1000, ''),
+        'dir/same': (3, 1000, ''),
+        'newer': (3, 2000, ''),
+        'bigger': (4, 1000, ''),
+        'missing': (3, 1000, ''),
+    }
+
+    assert find_unchanged(reference, files) == {'same': 3, 'dir/same': 3}
+
+
+def test_find_identical(tmpdir):
+    reference = str(tmpdir)
+
+    create_file(reference, 'same', 'abc', 1000)
+    create_file(reference, 'touched', 'abc', 1000)
+    create_file(reference, 'modified', 'abc', 1000)
+
+    files = {
+        'same': (3, 1000, sha1('abc')),
+        'touched': (3, 2000, sha1('abc')),
+        'modified': (3, 1000, sha1('xyz')),
+        'missing': (3, 1000, sha1('abc')),
+    }
+
+    assert find_identical(reference, files, {}) == {'same': 3, 'touched': 3}
+
+
+def test_find_identical_known_hashes(tmpdir):
+    reference = str(tmpdir)
+
+    create_file(reference, 'a', 'abc', 1000)
+
+    files = {'a': (3, 1000, sha1('abc'))}
+
+    # Files are not hashed again if their digest is known.
+    with patch('positronic.brain.transfer.file_digest') as file_digest:
+        assert find_identical(reference, files, {'a': sha1('abc')}) == {'a': 3}
+        assert find_identical(reference, files, {'a': sha1('xyz')}) == {}
+
+    assert not file_digest.called
+
+
+def test_find_identical_in_build(tmpdir):
+    reference = str(tmpdir.join('builder', '1'))
+    create_file(reference, 'a', 'abc', 1000)
+
+    engine = RetentionEngine(str(tmpdir), RetentionPolicy())
+    engine.record_hashes('builder', 1, {'a': sha1('abc')})
+    engine.run()
+
+    files = {'a': (3, 2000, sha1('abc'))}
+
+    # The manifest is loaded from disk, as after a restart of the master.
+    engine = RetentionEngine(str(tmpdir), RetentionPolicy())
+
+    with patch('positronic.brain.transfer.file_digest') as file_digest:
+        assert find_identical_in_build(engine, reference, files) == {'a': 3}
+
+    assert not file_digest.called
+
+
+def test_link_files(tmpdir):
+    reference = str(tmpdir.join('1'))
+    dest = str(tmpdir.join('2'))
+
+    create_file(reference, 'dir/a', 'abc', 1000)
+    link_files(reference, dest, ['dir/a'])
+
+    assert os.path.samefile(os.path.join(reference, 'dir', 'a'), os.path.join(dest, 'dir', 'a'))
+
+
+def test_link_files_missing(tmpdir):
+    reference = str(tmpdir.join('1'))
+    dest = str(tmpdir.join('2'))
+
+    create_file(reference, 'a', 'abc', 1000)
+
+    assert link_files(reference, dest, ['a', 'b']) == ['b']
+    assert not os.path.exists(os.path.join(dest, 'b'))
+
+
+def test_link_unchanged(tmpdir):
+    reference = str(tmpdir.join('builder', '1'))
+    dest = str(tmpdir.join('builder', '2'))
+
+    create_file(reference, 'a', 'abc', 1000)
+    create_file(reference, 'b', 'def', 1000)
+    engine = RetentionEngine(str(tmpdir), RetentionPolicy())
+    files = {'a': (3, 1000), 'b': (3, 1000), 'c': (3, 1000)}
+
+    # A file removed after the comparison is uploaded.
+    with patch('positronic.brain.transfer.find_unchanged', return_value={'a': 3, 'b': 3}):
+        os.remove(os.path.join(reference, 'b'))
+        assert link_unchanged(engine, reference, dest, files, 'mtime') == {'a': 3}
+
+    assert os.path.samefile(os.path.join(reference, 'a'), os.path.join(dest, 'a'))
+
+
+def test_worker_script_list_files(tmpdir):
+    root = str(tmpdir)
+
+    create_file(root, 'a', 'abc', 1000)
+    create_file(root, 'dir/b', 'abcd', 2000)
+
+    out = run_worker_script(root, 'list_files', '.')
+
+    assert json.loads(out) == {'a': [3, 1000, ''], 'dir/b': [4, 2000, '']}
+
+
+def test_worker_script_list_files_hashes(tmpdir):
+    root = str(tmpdir)
+
+    create_file(root, 'a', 'abc', 1000)
+
+    out = run_worker_script(root, 'list_files', '.', True)
+
+    assert json.loads(out) == {'a': [3, 1000, sha1('abc')]}
+
+
+def test_worker_script_stage(tmpdir):
+    root = str(tmpdir.join('artifacts'))
+    dest = str(tmpdir.join('artifacts-upload'))
+
+    create_file(root, 'a', 'abc', 1000)
+    create_file(root, 'dir/b', 'abcd', 2000)
+
+    run_worker_script(root, 'stage', '.', dest, ['dir/b'])
+
+    assert not os.path.exists(os.path.join(dest, 'a'))
+    assert os.path.getmtime(os.path.join(dest, 'dir', 'b')) == 2000
+
+
+def test_worker_script_stage_links(tmpdir):
+    root = str(tmpdir.join('artifacts'))
+    dest = str(tmpdir.join('artifacts-upload'))
+
+    create_file(root, 'a', 'abc', 1000)
+    os.symlink('a', os.path.join(root, 'b'))
+
+    run_worker_script(root, 'stage', '.', dest, ['b'])
+    assert os.readlink(os.path.join(dest, 'b')) == 'a'
+
+    # As on Windows, where Python 2 doesn't support symbolic links.
+    run_worker_script(root, 'stage', '.', dest, ['b'], prelude='import os; del os.symlink\n')
+    assert not os.path.islink(os.path.join(dest, 'b'))
+    assert open(os.path.join(dest, 'b')).read() == 'abc'
+
+
+#
+# Support Functions
+#
+
+def create_file(root, name, content, mtime):
+    p = os.path.join(root, *name.split('/'))
+
+    if not os.path.isdir(os.path.dirname(p)):
+        os.makedirs(os.path.dirname(p))
+
+    with open(p, 'w') as f:
+        f.write(content)
+
+    os.utime(p, (mtime, mtime))
+
+
+def sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def run_worker_script(cwd, function, *args, **kwargs):
+    p = subprocess.Popen([sys.executable, '-c', WORKER_BOOTSTRAP], cwd=cwd,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    script = kwargs.get('prelude', '') + worker_script('artifacts.py', function, *args)
+    out, _ = p.communicate(script)
+
+    assert p.returncode == 0
+
+    return out
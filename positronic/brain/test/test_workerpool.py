@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import pytest
 from mock import MagicMock
 
 from positronic.brain.job.workerpool import WorkerPoolJob
@@ -33,4 +34,24 @@ def test_forward_context_manager_events():
         pass
 
     assert job.pool['linux'].__enter__.called
-    assert job.pool['linux'].__exit__.called
\ No newline at end of file
+    assert job.pool['linux'].__exit__.called
+
+
+def test_forward_methods():
+    job = WorkerPoolJob('test-forward', {'linux': ['linux-worker'], 'windows': ['win-worker']})
+    job.pool['linux'] = MagicMock()
+    job.pool['windows'] = MagicMock()
+
+    job.command('make', env={'A': '1'})
+    job.watch_paths(['src'])
+
+    for pool_job in job.pool.values():
+        pool_job.command.assert_called_once_with('make', env={'A': '1'})
+        pool_job.watch_paths.assert_called_once_with(['src'])
+
+
+def test_no_forwarding_of_unknown_attributes():
+    job = WorkerPoolJob('test-unknown', {'linux': ['linux-worker']})
+
+    with pytest.raises(AttributeError):
+        job.bogus
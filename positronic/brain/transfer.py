@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+This module contains the build step which transfers artifacts from worker nodes to the master.
+"""
+
+import json
+import os
+import pkgutil
+import shutil
+import time
+from os.path import basename, dirname, exists, isdir, join
+
+from twisted.internet import defer, threads
+
+from buildbot import config
+from buildbot.process.buildstep import BuildStep, BuildStepFailed, RemoteCommand
+from buildbot.process.buildstep import RemoteShellCommand
+from buildbot.status.results import SUCCESS
+from buildbot.steps.transfer import _DirectoryWriter
+
+from positronic.brain.blobstore import file_digest
+from positronic.brain.manifest import scan_build
+from positronic.brain.retention import get_retention_engine
+
+
+# Compression methods supported by the 'uploadDirectory' command of buildslave.
+COMPRESSION_METHODS = (None, 'gz', 'bz2')
+
+# How to tell whether a file on the worker is identical to the one on the master.
+COMPARE_METHODS = ('mtime', 'hash')
+
+# Reads a script from stdin and runs it. We don't pass scripts on the command line, since that
+# doesn't play well with newlines on Windows.
+WORKER_BOOTSTRAP = 'import sys; exec(sys.stdin.read())'
+
+
+class ArtifactUpload(BuildStep):
+    """Uploads the artifacts directory of a worker to the master.
+
+    Unlike DirectoryUpload, files which are identical to those of the previous build on the master
+    are not transferred again but linked on the master instead. Listing files requires a Python
+    interpreter on the worker (see the 'worker_python' property): if that's not available, all
+    files are transferred.
+
+    The following build properties are set: 'artifacts_uploaded_bytes', 'artifacts_skipped_bytes',
+    'artifacts_upload_time' (seconds) and 'artifacts_throughput' (uploaded bytes per second).
+
+    Arguments:
+
+    - slavesrc: The directory to upload from the worker.
+    - masterdest: Where to put artifacts on the master. Its parent directory should contain one
+      directory per build.
+    - url: An URL pointing to the uploaded artifacts.
+    - compress: How to compress data on the wire, one of None, 'gz' or 'bz2'.
+    - blocksize: The size of each chunk of data sent to the master. Each chunk costs one round trip
+      to the master, so use larger blocks for workers on high latency links.
+    - skip_unchanged: Whether to skip files which are already on the master.
+    - compare: How to tell whether a file is already on the master. With 'mtime' files must have
+      the same size and modification time, with 'hash' the same size and SHA-1 digest. Hashes are
+      computed on the worker and those of the previous build are looked up in its manifest, so
+      'hash' also works for builds which regenerate identical files.
+
+    """
+
+    name = 'collect artifacts'
+
+    renderables = ['slavesrc', 'masterdest', 'url']
+
+    haltOnFailure = True
+    flunkOnFailure = True
+
+    def __init__(self, slavesrc, masterdest, url=None, compress=None, blocksize=256 * 1024,
+                 skip_unchanged=False, compare='mtime', **kwargs):
+        BuildStep.__init__(self, **kwargs)
+
+        if compress not in COMPRESSION_METHODS:
+            config.error("'compress' must be one of %s" % ', '.join(map(str, COMPRESSION_METHODS)))
+
+        if compare not in COMPARE_METHODS:
+            config.error("'compare' must be one of %s" % ', '.join(COMPARE_METHODS))
+
+        self.slavesrc = slavesrc
+        self.masterdest = masterdest
+        self.url = url
+        self.compress = compress
+        self.blocksize = blocksize
+        self.skip_unchanged = skip_unchanged
+        self.compare = compare
+
+        self.cmd = None
+        self.stdio = None
+
+    def start(self):
+        self.step_status.setText(['uploading', 'artifacts'])
+        self.stdio = self.addLog('stdio')
+
+        if self.url is not None:
+            self.addURL(basename(self.masterdest), self.url)
+
+        d = self.upload()
+        d.addCallback(self.finished)
+        d.addErrback(self.failed)
+
+    def interrupt(self, reason):
+        BuildStep.interrupt(self, reason)
+
+        if self.cmd:
+            return self.cmd.interrupt(reason)
+
+    @defer.inlineCallbacks
+    def upload(self):
+        started = time.time()
+        masterdest = os.path.expanduser(self.masterdest)
+        source = self.slavesrc
+        staging = None
+        files = None
+        reference = None
+        unchanged = {}
+
+        if self.skip_unchanged:
+            files = yield self.list_files()
+
+        if files:
+            reference = yield threads.deferToThread(
+                previous_build_dir, dirname(masterdest), int(basename(masterdest)))
+
+        if reference:
+            unchanged = yield threads.deferToThread(
+                link_unchanged, get_retention_engine(), reference, masterdest, files, self.compare)
+
+        if unchanged:
+            changed = [f for f in files if f not in unchanged]
+            self.stdio.addHeader('%d files unchanged since %s\n' % (len(unchanged), reference))
+
+            # Put changed files aside, so that we can upload them with a single transfer.
+            staging = self.slavesrc + '-upload'
+            yield self.run_script('stage', self.slavesrc, staging, changed)
+            source = staging
+
+        yield self.upload_directory(source, masterdest)
+
+        if unchanged:
+            yield self.run_command(RemoteCommand('rmdir', {'dir': staging}))
+
+        if files and self.compare == 'hash':
+            # Keep hashes in the manifest, so that the next build doesn't have to compute them.
+            get_retention_engine().record_hashes(
+                basename(dirname(masterdest)), int(basename(masterdest)),
+                dict((f, v[2]) for f, v in files.items()))
+
+        total = yield threads.deferToThread(lambda: scan_build(masterdest)['size'])
+        elapsed = max(time.time() - started, 0.001)
+        skipped = sum(unchanged.values())
+
+        self.setProperty('artifacts_uploaded_bytes', total - skipped, 'ArtifactUpload')
+        self.setProperty('artifacts_skipped_bytes', skipped, 'ArtifactUpload')
+        self.setProperty('artifacts_upload_time', elapsed, 'ArtifactUpload')
+        self.setProperty('artifacts_throughput', int((total - skipped) / elapsed), 'ArtifactUpload')
+
+        defer.returnValue(SUCCESS)
+
+    @defer.inlineCallbacks
+    def list_files(self):
+        """Returns a dictionary mapping each file on the worker to its size and mtime.
+
+        Returns None if files cannot be listed.
+        """
+        try:
+            stdout = yield self.run_script('list_files', '.', self.compare == 'hash')
+            defer.returnValue(dict((f, tuple(v)) for f, v in json.loads(stdout).items()))
+        except (BuildStepFailed, ValueError):
+            self.stdio.addHeader('unable to list files, uploading everything\n')
+            defer.returnValue(None)
+
+    def upload_directory(self, source, masterdest):
+        writer = _DirectoryWriter(masterdest, None, self.compress, 0600)
+
+        cmd = RemoteCommand('uploadDirectory', {
+            'slavesrc': source,
+            'workdir': self.slavesrc,
+            'writer': writer,
+            'maxsize': None,
+            'blocksize': self.blocksize,
+            'compress': self.compress,
+        }, decodeRC={None: SUCCESS, 0: SUCCESS})
+
+        d = self.run_command(cmd)
+
+        @d.addErrback
+        def cancel(failure):
+            writer.cancel()
+            return failure
+
+        return d
+
+    def run_script(self, function, *args):
+        """Runs a function of the worker-side artifacts script. Returns its standard output."""
+        cmd = RemoteShellCommand(
+            workdir=self.slavesrc,
+            command=[self.getProperty('worker_python', 'python'), '-c', WORKER_BOOTSTRAP],
+            initialStdin=worker_script('artifacts.py', function, *args),
+            collectStdout=True,
+            collectStderr=True,
+            logEnviron=False)
+
+        d = self.run_command(cmd)
+        d.addCallback(lambda _: cmd.stdout)
+
+        return d
+
+    def run_command(self, cmd):
+        self.cmd = cmd
+
+        if not cmd.collectStdout:
+            cmd.useLog(self.stdio, False)
+
+        d = self.runCommand(cmd)
+
+        def check(_):
+            self.cmd = None
+
+            if cmd.collectStderr and cmd.stderr:
+                self.stdio.addStderr(cmd.stderr)
+
+            if cmd.didFail():
+                raise BuildStepFailed()
+
+        d.addCallback(check)
+
+        return d
+
+
+def worker_script(name, function, *args):
+    """Returns the source code which runs a function of a worker-side script.
+
+    The returned code is meant to be fed to WORKER_BOOTSTRAP through the standard input.
+    """
+    script = pkgutil.get_data('positronic.brain', 'scripts/' + name)
+
+    return script + '\n%s(*json.loads(%r))\n' % (function, json.dumps(args))
+
+
+def previous_build_dir(root, number):
+    """Returns the directory of the most recent build before `number` in root, if any."""
+    try:
+        numbers = [int(n) for n in os.listdir(root) if n.isdigit() and int(n) < number]
+    except OSError:
+        return None
+
+    return join(root, str(max(numbers))) if numbers else None
+
+
+def find_unchanged(reference, files):
+    """Returns the files that are identical in the reference directory, mapped to their size.
+
+    Files are deemed identical if they have the same size and modification time.
+    """
+    unchanged = {}
+
+    for name, (size, mtime) in ((n, v[:2]) for n, v in files.items()):
+        try:
+            st = os.stat(join(reference, *name.split('/')))
+        except OSError:
+            continue
+
+        if size >= 0 and st.st_size == size and int(st.st_mtime) == mtime:
+            unchanged[name] = size
+
+    return unchanged
+
+
+def find_identical(reference, files, hashes):
+    """Returns the files that are identical in the reference directory, mapped to their size.
+
+    Files are deemed identical if they have the same size and SHA-1 digest. Digests of files in the
+    reference directory are looked up in `hashes`, or computed if missing from it.
+    """
+    identical = {}
+
+    for name, (size, _, digest) in files.items():
+        p = join(reference, *name.split('/'))
+
+        try:
+            if size < 0 or os.path.getsize(p) != size:
+                continue
+        except OSError:
+            continue
+
+        if (hashes.get(name) or file_digest(p)) == digest:
+            identical[name] = size
+
+    return identical
+
+
+def find_identical_in_build(engine, reference, files):
+    """Like find_identical(), with the hashes recorded in the manifest of the reference build.
+
+    This must run in a thread, since it waits for the retention engine.
+    """
+    hashes = engine.hashes(basename(dirname(reference)), int(basename(reference)))
+
+    return find_identical(reference, files, hashes)
+
+
+def link_unchanged(engine, reference, dest, files, compare):
+    """Links the files which are unchanged in the reference build to dest. Returns them mapped to
+    their size.
+
+    Files are compared by size and modification time, or by SHA-1 digest if `compare` is 'hash'
+    (see find_unchanged() and find_identical_in_build()). The lock of the retention engine is held
+    meanwhile, so that the reference build can't be removed between the comparison and the links.
+    Files which went missing anyway are left out, so that they are uploaded.
+
+    This must run in a thread, since it waits for the retention engine.
+    """
+    with engine.lock:
+        if compare == 'hash':
+            unchanged = find_identical_in_build(engine, reference, files)
+        else:
+            unchanged = find_unchanged(reference, files)
+
+        missing = link_files(reference, dest, unchanged)
+
+    return dict((f, size) for f, size in unchanged.items() if f not in missing)
+
+
+def link_files(reference, dest, files):
+    """Makes the given files from the reference directory available in dest.
+
+    Files are hard linked when possible and copied otherwise. Retention counts hard linked files
+    once (see `positronic.brain.retention.DiskUsage`). Returns the files missing from the reference
+    directory.
+    """
+    missing = []
+
+    for name in files:
+        src = join(reference, *name.split('/'))
+        dst = join(dest, *name.split('/'))
+
+        if not exists(src):
+            missing.append(name)
+            continue
+
+        if not isdir(dirname(dst)):
+            os.makedirs(dirname(dst))
+
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    return missing
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+# Positronic Brain - Opinionated Buildbot Workflow
+# Copyright (C) 2014  Develer S.r.L.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This module contains the scheduler and build step used by build matrices and sharded commands to
+start their cells in parallel, cancel them and report their results (see
+`positronic.brain.job.matrix.MatrixJob` and `FreestyleJob.sharded_command()`).
+"""
+
+import os
+import time
+from os.path import join
+
+from buildbot.process.buildrequest import BuildRequest
+from buildbot.schedulers.triggerable import Triggerable
+from buildbot.status.results import EXCEPTION, FAILURE, SUCCESS, WARNINGS, Results
+from buildbot.steps.trigger import Trigger
+from twisted.internet import defer, threads
+from twisted.python import log
+
+from positronic.brain.config import BrainConfig
+from positronic.brain.durations import TEST_PREFIX, get_duration_store, lpt_partition
+from positronic.brain.logs import tail_lines
+from positronic.brain.retention import get_retention_engine
+from positronic.brain.transfer import link_files
+
+# The property identifying the cell of a matrix build which triggered a build.
+MATRIX_BUILD_PROPERTY = 'matrix_build'
+
+# How many lines at the end of the logs of cells are copied to the matrix build.
+MERGED_LOG_LINES = 1000
+
+
+class TrackedTriggerable(Triggerable):
+    """A Triggerable scheduler remembering the build requests added for each cell of a matrix build,
+    so that they can be cancelled."""
+
+    def __init__(self, **kwargs):
+        Triggerable.__init__(self, **kwargs)
+
+        # Matrix build cell -> builder name -> id of the build request added for it.
+        self.requests = {}
+
+    @defer.inlineCallbacks
+    def addBuildsetForSourceStampSetDetails(self, reason, sourcestamps, properties, **kwargs):
+        bsid, brids = yield Triggerable.addBuildsetForSourceStampSetDetails(
+            self, reason, sourcestamps, properties, **kwargs)
+
+        matrix_build = properties.getProperty(MATRIX_BUILD_PROPERTY)
+
+        if matrix_build is not None:
+            self.requests[matrix_build] = brids
+
+        defer.returnValue((bsid, brids))
+
+
+class MatrixTrigger(Trigger):
+    """Triggers all cells of a build matrix at once, and waits for them to finish.
+
+    The results and durations of all cells are collected in the 'summary' log and in the
+    'matrix_results' build property, which maps cell names to dictionaries with the 'result' and
+    'duration' (seconds, queueing included) of the cell.
+
+    Arguments:
+
+    - cells: A dictionary mapping the names of cells to the name of the TrackedTriggerable
+      scheduler starting them, and to the properties set on their builds.
+    - fail_fast: Whether to cancel all other cells as soon as one of them fails.
+    - merge_logs: The name of a step of the cells whose 'stdio' log is copied to this step, in a log
+      named after the cell.
+    - collect_artifacts: Whether to link the artifacts of each cell in a directory named after it,
+      inside the artifacts of this build.
+    - balance: The name of a builder whose past test durations are used to split tests among cells
+      (see `positronic.brain.durations`). Each cell gets its tests in the 'shard_files' property
+      and all tests with a known duration in the 'shard_known_files' property, separated by
+      spaces. The expected duration of each cell is written to the 'balance' log.
+
+    """
+
+    name = 'matrix'
+
+    def __init__(self, cells, fail_fast=False, merge_logs=None, collect_artifacts=False,
+                 balance=None, **kwargs):
+        Trigger.__init__(self, schedulerNames=sorted(set(s for s, _ in cells.values())),
+                         waitForFinish=True, **kwargs)
+
+        self.cells = cells
+        self.fail_fast = fail_fast
+        self.merge_logs = merge_logs
+        self.collect_artifacts = collect_artifacts
+        self.balance = balance
+
+        self.started = None
+        self.cancelled = False
+        # Cell name -> (result, duration).
+        self.cell_results = {}
+        # Cell name -> builder name -> id of the build request of the cell.
+        self.cell_requests = {}
+
+    def matrix_build(self, cell):
+        """Returns the value of MATRIX_BUILD_PROPERTY for a cell of this build."""
+        return '%s/%s/%s' % (self.getProperty('buildername'), self.getProperty('buildnumber'), cell)
+
+    @defer.inlineCallbacks
+    def start(self):
+        schedulers, invalid = self.getSchedulers()
+
+        if invalid:
+            self.step_status.setText(['not valid scheduler:'] + invalid)
+            self.end(FAILURE)
+            return
+
+        self.running = True
+        self.started = time.time()
+        self.schedulers = dict((s.name, s) for s in schedulers)
+
+        sourcestamps = self.prepareSourcestampListForTrigger()
+        shard_files = self.split_tests() if self.balance else {}
+        known_files = sorted(f for files in shard_files.values() for f in files)
+
+        dl = []
+
+        for cell, (scheduler, cell_properties) in sorted(self.cells.items()):
+            properties = self.createTriggerProperties()
+            properties.setProperty(MATRIX_BUILD_PROPERTY, self.matrix_build(cell), 'MatrixTrigger')
+
+            if self.balance:
+                properties.setProperty('shard_files', ' '.join(shard_files[cell]), 'MatrixTrigger')
+                properties.setProperty('shard_known_files', ' '.join(known_files), 'MatrixTrigger')
+
+            for name, value in cell_properties.items():
+                properties.setProperty(name, value, 'MatrixTrigger')
+
+            d = self.schedulers[scheduler].trigger(sourcestamps, set_props=properties)
+            d.addBoth(self.cell_finished, cell)
+            dl.append(d)
+
+        self.step_status.setText(['triggered', '%d cells' % len(dl)])
+
+        rclist = yield defer.DeferredList(dl, consumeErrors=1)
+
+        result = SUCCESS
+
+        for was_cb, results in rclist:
+            if not was_cb:
+                log.err(results)
+                result = EXCEPTION
+                continue
+
+            results, _ = results
+
+            if results not in (SUCCESS, WARNINGS) and result == SUCCESS:
+                result = FAILURE
+
+        for cell, (scheduler, _) in self.cells.items():
+            self.schedulers[scheduler].requests.pop(self.matrix_build(cell), None)
+
+        self.summarize()
+
+        try:
+            builds = yield self.find_builds()
+            self.add_links(builds)
+
+            if self.merge_logs:
+                yield self.copy_logs(builds)
+
+            if self.collect_artifacts:
+                yield self.link_artifacts(builds)
+        except Exception:
+            log.err(None, 'while collecting the builds of matrix cells')
+
+        self.end(result)
+
+    def split_tests(self):
+        """Returns the tests of each cell, balanced by their past durations."""
+        durations = get_duration_store().durations(self.balance, TEST_PREFIX)
+        cells = sorted(self.cells)
+        partition = lpt_partition(durations, len(cells))
+
+        width = max(len(cell) for cell in cells)
+        lines = []
+
+        for cell, tests in zip(cells, partition):
+            lines.append('%-*s  %5d tests  %6.0f s\n' % (
+                width, cell, len(tests), sum(durations[t] for t in tests)))
+
+        self.addCompleteLog('balance', ''.join(lines))
+
+        return dict((cell, sorted(tests)) for cell, tests in zip(cells, partition))
+
+    def cell_finished(self, result, cell):
+        """Records the result of a cell, cancelling the other ones if needed."""
+        if isinstance(result, tuple):
+            results, self.cell_requests[cell] = result
+        else:
+            results = EXCEPTION
+
+        self.cell_results[cell] = (results, time.time() - self.started)
+
+        if self.fail_fast and results not in (SUCCESS, WARNINGS) and not self.cancelled:
+            self.cancelled = True
+            pending = [c for c in self.cells if c not in self.cell_results]
+
+            d = self.cancel_cells(pending)
+            d.addErrback(log.err, 'while cancelling matrix cells')
+
+        return result
+
+    @defer.inlineCallbacks
+    def cancel_cells(self, cells):
+        """Cancels the build requests of the given cells, or interrupts their builds."""
+        master = self.build.builder.botmaster.parent
+
+        for cell in cells:
+            scheduler = self.schedulers[self.cells[cell][0]]
+
+            for buildername, brid in scheduler.requests.get(self.matrix_build(cell), {}).items():
+                brdict = yield master.db.buildrequests.getBuildRequest(brid)
+
+                if brdict is None or brdict['complete']:
+                    continue
+
+                if not brdict['claimed']:
+                    request = yield BuildRequest.fromBrdict(master, brdict)
+                    yield request.cancelBuildRequest()
+
+                # The request may have been claimed in the meantime.
+                builder = master.botmaster.builders.get(buildername)
+
+                for build in list(builder.building) if builder else ():
+                    if brid in [r.id for r in build.requests]:
+                        build.stopBuild('A sibling cell of the matrix failed')
+
+    def summarize(self):
+        """Writes the results of all cells to the summary log and to the build properties."""
+        width = max(len(cell) for cell in self.cells)
+        lines = []
+        properties = {}
+
+        for cell in sorted(self.cells):
+            results, duration = self.cell_results.get(cell, (EXCEPTION, 0))
+            lines.append('%-*s  %-9s  %6.0f s\n' % (width, cell, Results[results], duration))
+            properties[cell] = {'result': Results[results], 'duration': round(duration, 3)}
+
+        self.addCompleteLog('summary', ''.join(lines))
+        self.setProperty('matrix_results', properties, 'MatrixTrigger')
+
+        passed = len([p for p in properties.values() if p['result'] in ('success', 'warnings')])
+        self.step_status.setText(['matrix', '%d/%d cells passed' % (passed, len(properties))])
+
+    @defer.inlineCallbacks
+    def find_builds(self):
+        """Returns the (cell, builder name, build number) of the builds run by all cells."""
+        master = self.build.builder.botmaster.parent
+        builds = []
+
+        for cell, requests in sorted(self.cell_requests.items()):
+            for buildername, brid in sorted(requests.items()):
+                bdicts = yield master.db.builds.getBuildsForRequest(brid)
+                builds.extend((cell, buildername, b['number']) for b in bdicts)
+
+        defer.returnValue(builds)
+
+    def add_links(self, builds):
+        status = self.build.builder.botmaster.parent.status
+
+        for cell, buildername, number in builds:
+            url = status.getURLForBuild(buildername, number)
+            self.step_status.addURL('%s #%d' % (buildername, number), url)
+
+    @defer.inlineCallbacks
+    def copy_logs(self, builds):
+        """Copies the end of the 'stdio' log of the merge_logs step of each cell to this step.
+
+        Only the last MERGED_LOG_LINES lines are copied, and they are read in a thread. Whole logs
+        can be found in the builds of cells, which are linked from this step (see add_links()).
+        """
+        status = self.build.builder.botmaster.parent.status
+
+        for cell, buildername, number in builds:
+            build = status.getBuilder(buildername).getBuild(number)
+
+            for step in build.getSteps() if build else ():
+                if step.getName() != self.merge_logs:
+                    continue
+
+                for step_log in step.getLogs():
+                    if step_log.getName() == 'stdio':
+                        lines = yield threads.deferToThread(tail_lines, step_log, MERGED_LOG_LINES)
+                        self.addCompleteLog(cell, ''.join(line + '\n' for line in lines))
+
+    def link_artifacts(self, builds):
+        """Links the artifacts of each cell inside the artifacts of this build.
+
+        Retention counts linked files once, and keeps counting them as long as this build links
+        them, even after the builds of the cells are removed (see
+        `positronic.brain.retention.DiskUsage`).
+        """
+        root = os.path.expanduser(BrainConfig['artifactsDir'])
+        dest = join(root, self.getProperty('buildername'), str(self.getProperty('buildnumber')))
+        sources = [(join(root, buildername, str(number)), join(dest, cell))
+                   for cell, buildername, number in builds]
+
+        # The builds of the cells must not be removed while their files are being linked.
+        return threads.deferToThread(link_trees, sources, get_retention_engine().lock)
+
+
+def link_trees(sources, lock=None):
+    """Links all files of each (source, destination) pair of directories, where sources exist.
+
+    If a lock is given, it's held meanwhile.
+    """
+    if lock is not None:
+        with lock:
+            return link_trees(sources)
+
+    for src, dest in sources:
+        files = []
+
+        for dirpath, _, filenames in os.walk(src):
+            relative = os.path.relpath(dirpath, src).replace(os.sep, '/')
+            files.extend(f if relative == '.' else relative + '/' + f for f in filenames)
+
+        link_files(src, dest, files)